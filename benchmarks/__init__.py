@@ -0,0 +1,8 @@
+"""
+Benchmarks of the serving and ingest hot paths, see benchmarks/__main__.py.
+
+Run from the project root:
+
+    python -m benchmarks --out bench.json
+    python -m benchmarks --out new.json --baseline bench.json
+"""
@@ -0,0 +1,201 @@
+"""
+Runs the benchmarks against a scratch DATA_ROOT and saves the results as json.
+
+    python -m benchmarks --out new.json --baseline old.json
+
+With --baseline every shared metric is printed next to the baseline, and the
+exit code is 1 when one got worse by more than --max-regression. Run both sides
+on the same machine, the numbers are not comparable across hosts.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+from typing import Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(HERE)
+
+
+def _parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="benchmark_results.json", help="Results file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fraction a metric may get worse before the run fails")
+    parser.add_argument("--data-root", help="Scratch DATA_ROOT, a temporary directory by default")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch DATA_ROOT")
+    parser.add_argument("--only", nargs="*", help="Names of the cases to run")
+    parser.add_argument("--quick", action="store_true", help="Small sizes, to check the suite runs")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--videos", type=int, default=10000, help="Video rows to seed")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--range-mb", type=int, default=256, help="Size of the range request file")
+    parser.add_argument("--sanitize-count", type=int, default=10000)
+    parser.add_argument("--log-procs", type=int, default=4)
+    parser.add_argument("--log-threads", type=int, default=4)
+    parser.add_argument("--log-lines", type=int, default=2000, help="Lines per thread")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.videos, args.requests, args.concurrency = 1000, 20, 4
+        args.range_mb, args.sanitize_count = 16, 1000
+        args.log_procs, args.log_threads, args.log_lines = 2, 2, 200
+    return args
+
+
+def _configure_environment(data_root: str) -> None:
+    """video_server reads its settings at import, so this runs before importing it."""
+    os.environ["DATA_ROOT"] = data_root
+    os.environ["DOMAIN_NAME"] = "localhost"
+    os.environ["DISABLE_AUTH"] = "1"
+    os.environ["USE_HTTP_SERVER"] = "0"
+    os.environ.setdefault("LOG_MAX_BYTES", str(1024 * 1024 * 1024))
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _run_case(name: str, case, bench) -> dict:
+    print(f"Running {name}", flush=True)
+    start = time.perf_counter()
+    try:
+        result = case(bench)
+    except Exception as exc:  # pylint: disable=broad-except
+        traceback.print_exc()
+        result = {"error": f"{type(exc).__name__}: {exc}"}
+    result["case_s"] = time.perf_counter() - start
+    return result
+
+
+def _direction(metric: str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 if the metric is informational."""
+    if metric.endswith("_mb_s") or metric.endswith("_per_s"):
+        return 1
+    if metric == "case_s":
+        return 0
+    if metric.endswith("_ms") or metric.endswith("_us") or metric.endswith("_s"):
+        return -1
+    return 0
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Prints the change of every shared metric, returns the ones that regressed."""
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        base_metrics = baseline.get(case, {})
+        for metric, value in sorted(metrics.items()):
+            base = base_metrics.get(metric)
+            direction = _direction(metric)
+            if direction == 0 or not isinstance(value, (int, float)) or not base:
+                continue
+            change = (value - base) / base
+            worse = -change * direction
+            flag = "REGRESSED" if worse > max_regression else ""
+            print(f"  {case}.{metric}: {base:.4g} -> {value:.4g} ({change:+.1%}) {flag}")
+            if flag:
+                regressions.append(f"{case}.{metric}")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:  # pylint: disable=too-many-locals
+    """Entry point for python -m benchmarks."""
+    args = _parse_args(argv)
+    data_root = os.path.abspath(args.data_root or tempfile.mkdtemp(prefix="video_server_bench_"))
+    _configure_environment(data_root)
+    from benchmarks import cases, media
+    from video_server.prefork import init_data_root
+    from video_server.version import VERSION
+
+    init_data_root()
+    bench = cases.Bench(
+        data_root=data_root,
+        seed=args.seed,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        range_mb=args.range_mb,
+        sanitize_count=args.sanitize_count,
+        log_procs=args.log_procs,
+        log_threads=args.log_threads,
+        log_lines=args.log_lines,
+    )
+    setup: dict = {}
+    start = time.perf_counter()
+    setup["seeded_videos"] = media.seed_videos(args.videos, args.seed)
+    setup["seed_s"] = time.perf_counter() - start
+    clips = media.QUICK_CLIPS if args.quick else media.DEFAULT_CLIPS
+    try:
+        start = time.perf_counter()
+        bench.clips = media.make_clips(os.path.join(data_root, "bench_media"), clips)
+        setup["clips_s"] = time.perf_counter() - start
+    except (OSError, subprocess.CalledProcessError) as exc:
+        setup["clips_error"] = str(exc)
+        print(f"Could not make the clips, the media cases will fail: {exc}", flush=True)
+
+    selected = set(args.only or list(cases.SERVER_CASES) + list(cases.OFFLINE_CASES))
+    results: dict = {}
+    try:
+        server_cases = {k: v for k, v in cases.SERVER_CASES.items() if k in selected}
+        if server_cases:
+            with cases.run_server(bench):
+                for name, case in server_cases.items():
+                    results[name] = _run_case(name, case, bench)
+        for name, case in cases.OFFLINE_CASES.items():
+            if name in selected:
+                results[name] = _run_case(name, case, bench)
+    finally:
+        if not args.keep and not args.data_root:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    out = {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "version": VERSION,
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+            "setup": setup,
+        },
+        "results": results,
+    }
+    with open(args.out, encoding="utf-8", mode="w") as filed:
+        json.dump(out, filed, indent=2)
+    print(f"Wrote {args.out}")
+    failed = [name for name, result in results.items() if "error" in result]
+    if failed:
+        print(f"Failed cases: {', '.join(failed)}")
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8", mode="r") as filed:
+        baseline = json.load(filed)
+    print(f"Compared to {args.baseline} ({baseline['meta'].get('commit', '')}):")
+    regressions = compare(results, baseline["results"], args.max_regression)
+    if regressions:
+        print(f"Regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
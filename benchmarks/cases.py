@@ -0,0 +1,379 @@
+"""
+The benchmark cases. Each one takes the Bench context and returns a flat dict of
+metrics. Metric names end with their unit: _ms, _us and _s are lower is better,
+_mb_s and _per_s are higher is better, anything else is informational.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import statistics
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+import httpx
+import uvicorn  # type: ignore
+
+from benchmarks import log_worker
+from benchmarks.media import make_blob_file, make_titles
+
+MB = 1024 * 1024
+RANGE_SIZE = MB
+JOB_TIMEOUT = 600
+JOB_POLL = 0.05
+
+
+@dataclass
+class Bench:  # pylint: disable=too-many-instance-attributes
+    """Parameters of a run and the fixtures shared by the cases."""
+
+    data_root: str
+    seed: int
+    requests: int
+    concurrency: int
+    range_mb: int
+    sanitize_count: int
+    log_procs: int
+    log_threads: int
+    log_lines: int
+    clips: list[str] = field(default_factory=list)
+    base_url: str = ""
+
+
+def summarize(samples: list[float], unit: str = "ms") -> dict:
+    """Returns mean and percentiles of samples given in seconds."""
+    scale = {"ms": 1e3, "us": 1e6}[unit]
+    ordered = sorted(samples)
+
+    def pct(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * scale
+
+    return {
+        "n": len(ordered),
+        f"mean_{unit}": statistics.fmean(ordered) * scale,
+        f"p50_{unit}": pct(0.50),
+        f"p95_{unit}": pct(0.95),
+        f"p99_{unit}": pct(0.99),
+        f"max_{unit}": ordered[-1] * scale,
+    }
+
+
+def _prefixed(prefix: str, metrics: dict) -> dict:
+    return {f"{prefix}_{key}": value for key, value in metrics.items()}
+
+
+class _Server(uvicorn.Server):
+    """uvicorn in a thread of this process, so the cases can reach into the app."""
+
+    def install_signal_handlers(self) -> None:  # pylint: disable=missing-function-docstring
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def run_server(bench: Bench) -> Iterator[None]:
+    """Serves video_server.app on a free port for the duration of the block."""
+    from video_server.app import app
+
+    port = _free_port()
+    server = _Server(
+        # uvicorn's logging config would close the handlers of the already imported log.
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_config=None, lifespan="on")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("The server failed to start")
+            time.sleep(0.01)
+        bench.base_url = f"http://127.0.0.1:{port}"
+        yield
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def _time_requests(
+    client: httpx.Client, count: int, url: str, before: Optional[Callable[[], None]] = None,
+    headers: Optional[dict] = None,
+) -> list[float]:
+    samples = []
+    for _ in range(count):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        resp = client.get(url, headers=headers)
+        resp.read()
+        samples.append(time.perf_counter() - start)
+        if resp.status_code >= 400:
+            raise RuntimeError(f"GET {url} returned {resp.status_code}")
+    return samples
+
+
+async def _concurrent_gets(base_url: str, urls: list[str], concurrency: int) -> float:
+    """Fetches every url with concurrency requests in flight, returns the seconds it took."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def drain() -> None:
+            while not queue.empty():
+                url = queue.get_nowait()
+                resp = await client.get(url)
+                if resp.status_code >= 400:
+                    raise RuntimeError(f"GET {url} returned {resp.status_code}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(drain() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def catalog_latency(bench: Bench) -> dict:
+    """Latency of /json, /rss and /videos: cached, rebuilt, 304 and under concurrency."""
+    from video_server.catalog import invalidate_catalog
+
+    out: dict = {}
+    with httpx.Client(base_url=bench.base_url, timeout=60) as client:
+        for name, url in (("json", "/json"), ("rss", "/rss"), ("videos", "/videos")):
+            first = client.get(url)
+            first.raise_for_status()
+            out[f"{name}_body_bytes"] = len(first.content)
+            out.update(_prefixed(f"{name}_cached", summarize(
+                _time_requests(client, bench.requests, url)
+            )))
+            # Every request rebuilds the catalog snapshot, as after each new video.
+            cold_count = max(1, bench.requests // 10)
+            out.update(_prefixed(f"{name}_rebuilt", summarize(
+                _time_requests(client, cold_count, url, before=invalidate_catalog)
+            )))
+            etag = client.get(url).headers.get("etag")
+            out.update(_prefixed(f"{name}_not_modified", summarize(
+                _time_requests(client, bench.requests, url, headers={"If-None-Match": etag})
+            )))
+            seconds = asyncio.run(
+                _concurrent_gets(bench.base_url, [url] * bench.requests, bench.concurrency)
+            )
+            out[f"{name}_concurrent_per_s"] = bench.requests / seconds
+    return out
+
+
+def range_throughput(bench: Bench) -> dict:  # pylint: disable=too-many-locals
+    """Throughput of whole file and 1 MiB range requests served through _reverse_proxy."""
+    from video_server.settings import VIDEO_ROOT
+
+    size = bench.range_mb * MB
+    make_blob_file(os.path.join(VIDEO_ROOT, "bench_range", "range.bin"), size, bench.seed)
+    url = "/v/bench_range/range.bin"
+    rng = random.Random(bench.seed)
+    offsets = [rng.randrange(0, size - RANGE_SIZE) for _ in range(bench.requests)]
+    out: dict = {"file_mb": bench.range_mb}
+    with httpx.Client(base_url=bench.base_url, timeout=120) as client:
+        full_samples = []
+        for _ in range(3):
+            start = time.perf_counter()
+            received = 0
+            with client.stream("GET", url) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_raw():
+                    received += len(chunk)
+            full_samples.append(time.perf_counter() - start)
+            if received != size:
+                raise RuntimeError(f"Received {received} of {size} bytes")
+        out["full_file_mb_s"] = bench.range_mb / min(full_samples)
+        range_samples = []
+        for offset in offsets:
+            headers = {"Range": f"bytes={offset}-{offset + RANGE_SIZE - 1}"}
+            start = time.perf_counter()
+            resp = client.get(url, headers=headers)
+            range_samples.append(time.perf_counter() - start)
+            if resp.status_code != 206 or len(resp.content) != RANGE_SIZE:
+                raise RuntimeError(f"Bad range response {resp.status_code}")
+        out.update(_prefixed("range_1mib", summarize(range_samples)))
+        out["range_1mib_mb_s"] = len(offsets) * RANGE_SIZE / MB / sum(range_samples)
+    # Concurrent ranges are sent as whole files of their own, the file server
+    # does the same work per byte either way.
+    seconds = asyncio.run(
+        _concurrent_gets(bench.base_url, [url] * bench.concurrency, bench.concurrency)
+    )
+    out["concurrent_full_file_mb_s"] = bench.concurrency * bench.range_mb / seconds
+    return out
+
+
+def _wait_for_job(client: httpx.Client, status_url: str) -> dict:
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        job = client.get(status_url).json()
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(JOB_POLL)
+    raise TimeoutError(f"{status_url} did not finish in {JOB_TIMEOUT} seconds")
+
+
+def upload_end_to_end(bench: Bench) -> dict:
+    """Time from POST /upload to the 202, and to the ingest job being done, per clip."""
+    if not bench.clips:
+        raise RuntimeError("No clips, static_ffmpeg could not make them")
+    out: dict = {}
+    with httpx.Client(base_url=bench.base_url, timeout=JOB_TIMEOUT) as client:
+        for clip in bench.clips:
+            name = os.path.splitext(os.path.basename(clip))[0]
+            title = f"bench upload {name} {uuid.uuid4().hex[:8]}"
+            start = time.perf_counter()
+            with open(clip, mode="rb") as filed:
+                resp = client.post(
+                    "/upload",
+                    params={"title": title, "do_encode": "false"},
+                    files={"file": (os.path.basename(clip), filed, "video/mp4")},
+                )
+            accepted = time.perf_counter() - start
+            if resp.status_code != 202:
+                raise RuntimeError(f"/upload returned {resp.status_code}: {resp.text}")
+            job = _wait_for_job(client, resp.json()["status_url"])
+            if job["state"] != "done":
+                raise RuntimeError(f"Ingest of {name} failed: {job['error']}")
+            out[f"{name}_accepted_s"] = accepted
+            out[f"{name}_done_s"] = time.perf_counter() - start
+            out[f"{name}_mb"] = os.path.getsize(clip) / MB
+    return out
+
+
+def metadata_files(bench: Bench) -> dict:
+    """Time of create_metadata_files (torrent, previews, player page) per clip."""
+    from video_server.generate_files import create_metadata_files
+    from video_server.settings import (
+        DOMAIN_NAME,
+        STUN_SERVERS,
+        TRACKER_ANNOUNCE_LIST,
+        WEBTORRENT_CHUNK_FACTOR,
+    )
+
+    if not bench.clips:
+        raise RuntimeError("No clips, static_ffmpeg could not make them")
+    out: dict = {}
+    for index, clip in enumerate(bench.clips):
+        name = os.path.splitext(os.path.basename(clip))[0]
+        out_dir = os.path.join(bench.data_root, "bench_metadata", name)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        # The torrent is written next to the video, so work on a copy.
+        vidfile = os.path.join(out_dir, "720.mp4")
+        shutil.copyfile(clip, vidfile)
+        start = time.perf_counter()
+        create_metadata_files(
+            vid_id=index + 1,
+            vid_title=f"bench metadata {name}",
+            vidfiles=[vidfile],
+            domain_name=DOMAIN_NAME,
+            tracker_announce_list=TRACKER_ANNOUNCE_LIST,
+            stun_servers=STUN_SERVERS,
+            out_dir=out_dir,
+            chunk_factor=WEBTORRENT_CHUNK_FACTOR,
+        )
+        out[f"{name}_s"] = time.perf_counter() - start
+    return out
+
+
+def sanitize(bench: Bench) -> dict:
+    """Per call time of sanitize_path over a corpus of realistic titles, best of 5."""
+    from video_server.io import sanitize_path
+
+    titles = make_titles(bench.sanitize_count, bench.seed)
+    runs = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for title in titles:
+            sanitize_path(title)
+        runs.append(time.perf_counter() - start)
+    return {
+        "titles": len(titles),
+        "best_per_call_us": min(runs) / len(titles) * 1e6,
+        "mean_per_call_us": statistics.fmean(runs) / len(titles) * 1e6,
+    }
+
+
+def _count_marked_lines(logfile: str, marker: str) -> int:
+    count = 0
+    for path in [logfile] + [f"{logfile}.{index}" for index in range(1, 100)]:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8", errors="replace", mode="r") as filed:
+            count += sum(1 for line in filed if marker in line)
+    return count
+
+
+def log_contention(bench: Bench) -> dict:  # pylint: disable=too-many-locals
+    """
+    Processes times threads all logging at once. The caller side latency is
+    what a request pays, drained_s also includes the listeners writing out
+    their queues as the processes exit.
+    """
+    from video_server.settings import LOGFILE
+
+    marker = f"bench-{uuid.uuid4().hex}"
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=log_worker.run,
+            args=(bench.log_threads, bench.log_lines, marker, results),
+        )
+        for _ in range(bench.log_procs)
+    ]
+    for proc in procs:
+        proc.start()
+    samples: list[float] = []
+    windows = []
+    for _ in procs:
+        proc_samples, started, finished = results.get(timeout=600)
+        samples.extend(proc_samples)
+        windows.append((started, finished))
+    for proc in procs:
+        proc.join()
+    drained = time.time()
+    first_start = min(started for started, _ in windows)
+    logging_s = max(finished for _, finished in windows) - first_start
+    expected = bench.log_procs * bench.log_threads * bench.log_lines
+    written = _count_marked_lines(LOGFILE, marker)
+    out = _prefixed("call", summarize(samples, unit="us"))
+    out.update(
+        {
+            "processes": bench.log_procs,
+            "threads": bench.log_threads,
+            "lines": expected,
+            "lines_lost": expected - written,
+            "logging_s": logging_s,
+            "drained_s": drained - first_start,
+            "lines_per_s": expected / logging_s,
+        }
+    )
+    return out
+
+
+# Cases that need the server running.
+SERVER_CASES: dict[str, Callable[[Bench], dict]] = {
+    "catalog_latency": catalog_latency,
+    "range_throughput": range_throughput,
+    "upload_end_to_end": upload_end_to_end,
+}
+OFFLINE_CASES: dict[str, Callable[[Bench], dict]] = {
+    "metadata_files": metadata_files,
+    "sanitize_path": sanitize,
+    "log_contention": log_contention,
+}
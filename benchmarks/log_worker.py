@@ -0,0 +1,40 @@
+"""
+Child process of the log contention benchmark. It only imports video_server.log,
+like a uvicorn worker that does nothing but log.
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+def run(threads: int, lines: int, marker: str, results) -> None:
+    """
+    Logs lines records from each of threads threads. Puts the per call seconds
+    and the wall clock start and end of the logging on results.
+    """
+    # The handler echoes every record to stdout, which would be measured too.
+    sys.stdout = open(os.devnull, mode="w", encoding="utf-8")  # pylint: disable=consider-using-with
+    from video_server.log import log  # pylint: disable=import-outside-toplevel
+
+    samples: list[float] = []
+    lock = threading.Lock()
+
+    def write_lines() -> None:
+        mine = []
+        for i in range(lines):
+            start = time.perf_counter()
+            log.info("%s pid %s line %s", marker, os.getpid(), i)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(mine)
+
+    workers = [threading.Thread(target=write_lines) for _ in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((samples, started, time.time()))
+    # The listener drains the queue at exit, the parent times that too.
@@ -0,0 +1,105 @@
+"""
+Synthetic fixtures: testsrc videos made with static_ffmpeg and a seeded library
+of Video rows. Everything is derived from the seed, so two runs with the same
+arguments measure the same work.
+"""
+
+import os
+import random
+import subprocess
+from datetime import datetime, timedelta
+
+# (seconds, width, height) of the generated clips.
+DEFAULT_CLIPS = [(5, 640, 360), (10, 1280, 720), (30, 1920, 1080)]
+QUICK_CLIPS = [(2, 320, 240)]
+SEED_BATCH_SIZE = 500
+_WORDS = [
+    "lecture", "Folge", "épisode", "trailer", "talk", "Q&A", "(live)", "[4K]",
+    "part", "#12", "v2.0", "behind-the-scenes", "日本語", "demo", "100%", "re: intro",
+]
+
+
+def make_clip(out_dir: str, seconds: int, width: int, height: int) -> str:
+    """Encodes a testsrc clip with a sine tone, returns its path. Reuses an existing one."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"testsrc_{seconds}s_{height}p.mp4")
+    if os.path.exists(path):
+        return path
+    tmp_path = f"{path}.tmp.mp4"
+    cmd = [
+        "static_ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc=duration={seconds}:size={width}x{height}:rate=30",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", "-movflags", "+faststart", tmp_path,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def make_clips(out_dir: str, clips: list[tuple[int, int, int]]) -> list[str]:
+    """Makes every clip, returns their paths from shortest to longest."""
+    return [make_clip(out_dir, *clip) for clip in clips]
+
+
+def make_blob_file(path: str, size: int, seed: int) -> str:
+    """Writes size pseudo random bytes, which compress as badly as video does."""
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rng = random.Random(seed)
+    block = rng.randbytes(1024 * 1024)
+    with open(path, mode="wb") as filed:
+        remaining = size
+        while remaining > 0:
+            filed.write(block[:remaining])
+            remaining -= len(block)
+    return path
+
+
+def make_titles(count: int, seed: int) -> list[str]:
+    """Returns unique titles like the ones people type, unicode and punctuation included."""
+    rng = random.Random(seed)
+    titles = []
+    for i in range(count):
+        words = rng.sample(_WORDS, rng.randint(2, 6))
+        titles.append(f"{' '.join(words)} {i}")
+    return titles
+
+
+def seed_videos(count: int, seed: int) -> int:  # pylint: disable=too-many-locals
+    """Inserts count Video rows with spread out dates and views, returns the number inserted."""
+    # pylint: disable=import-outside-toplevel
+    from video_server.catalog import invalidate_catalog
+    from video_server.db import path_to_url
+    from video_server.io import sanitize_path
+    from video_server.models import Video, db_proxy
+    from video_server.settings import VIDEO_ROOT
+
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    rows = []
+    for i, title in enumerate(make_titles(count, seed)):
+        name = sanitize_path(title)
+        url = path_to_url(f"v/{name}")
+        published = start + timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 3))
+        rows.append(
+            {
+                "title": title,
+                "description": f"Synthetic video {i} for the benchmarks.",
+                "url": url,
+                "iframe": url,
+                "path": os.path.join(VIDEO_ROOT, name, "720.mp4"),
+                "published": published,
+                "updated": published,
+                "views": rng.randint(0, 100000),
+                "duration": rng.uniform(10, 7200),
+            }
+        )
+    with db_proxy.atomic():
+        for index in range(0, len(rows), SEED_BATCH_SIZE):
+            # pylint: disable-next=no-value-for-parameter
+            Video.insert_many(rows[index : index + SEED_BATCH_SIZE]).execute()
+    invalidate_catalog()
+    return len(rows)
@@ -9,7 +9,9 @@ mkdir -p $DATA_ROOT
 # First launch the uvicorn server
 pm2 start ./unicorn.sh
 echo DATA_ROOT is $DATA_ROOT
-# The http-server has the proper settings to allow efficient video streaming, we need to use both
-# servers to enable streaming of video.
-pm2 start ./http_server.sh
+# Static files are served in process by default. The node http-server sidecar is
+# only started when USE_HTTP_SERVER=1.
+if [ "$USE_HTTP_SERVER" = "1" ]; then
+    pm2 start ./http_server.sh
+fi
 pm2 logs
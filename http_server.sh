@@ -10,5 +10,5 @@ if [ -z "$FILE_PORT" ]; then
     echo "ERROR: FILE_PORT is unset"
     exit 1
 fi
-echo http-server $DATA_ROOT/www -p $FILE_PORT --cors=*
-http-server $DATA_ROOT/www -p $FILE_PORT --cors=*
+echo http-server $DATA_ROOT/www -p $FILE_PORT --cors=* --gzip --brotli
+http-server $DATA_ROOT/www -p $FILE_PORT --cors=* --gzip --brotli
@@ -0,0 +1,67 @@
+import os
+import shutil
+import unittest
+
+from video_server.assets import (
+    find_variant,
+    fingerprinted_name,
+    is_fingerprinted,
+    rewrite_references,
+)
+from video_server.generate_files import PLAYER_DIR, build_player
+from video_server.io import read_utf8
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "assets")
+
+
+class AssetsTester(unittest.TestCase):
+    """Tester for the fingerprinted player assets."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_fingerprinted_name(self) -> None:
+        name = fingerprinted_name("desktop/plyr.min.js", b"data")
+        self.assertTrue(name.startswith("desktop/plyr.min."))
+        self.assertTrue(is_fingerprinted(name))
+        self.assertFalse(is_fingerprinted("desktop/plyr.min.js"))
+        self.assertNotEqual(name, fingerprinted_name("desktop/plyr.min.js", b"other"))
+
+    def test_rewrite_references(self) -> None:
+        names = {"desktop/movie.js": "desktop/movie.0123456789ab.js"}
+        html = '<script src="movie.js"></script><a href="https://x.example/movie.js">'
+        out = rewrite_references(html, "desktop", names)
+        self.assertIn('src="movie.0123456789ab.js"', out)
+        self.assertIn('href="https://x.example/movie.js"', out)
+
+    def test_find_variant(self) -> None:
+        os.makedirs(TMP_DIR)
+        path = os.path.join(TMP_DIR, "a.js")
+        for suffix in ["", ".gz"]:
+            with open(path + suffix, mode="wb") as filed:
+                filed.write(b"x")
+        self.assertEqual(find_variant(path, "gzip, br"), ("gzip", path + ".gz"))
+        self.assertIsNone(find_variant(path, "gzip;q=0, br"))
+        self.assertIsNone(find_variant(path, ""))
+
+    def test_build_player(self) -> None:
+        dst_dir = os.path.join(TMP_DIR, "player")
+        template_path = build_player(PLAYER_DIR, dst_dir, root=TMP_DIR)
+        desktop = read_utf8(os.path.join(dst_dir, "desktop", "index.html"))
+        self.assertNotIn('src="plyr.min.js"', desktop)
+        hashed = [name for name in os.listdir(os.path.join(dst_dir, "desktop")) if is_fingerprinted(name)]
+        self.assertTrue(any(name.startswith("plyr.min.") and name.endswith(".js") for name in hashed))
+        self.assertTrue(os.path.exists(os.path.join(dst_dir, "mobile", "video.min.js.gz")))
+        template = read_utf8(template_path)
+        self.assertNotIn('"/player/index.html', template)
+        index_name = template.split('"/player/')[1].split("?")[0]
+        self.assertTrue(is_fingerprinted(index_name))
+        self.assertTrue(os.path.exists(os.path.join(dst_dir, index_name)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import unittest
+
+from video_server.auth import LoginLimiter, issue_token, password_matches, verify_token
+from video_server.settings import PASSWORD
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "auth")
+
+
+class AuthTester(unittest.TestCase):
+    """Tester for the session tokens and the login limiter."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR)
+
+    def test_token_roundtrip(self) -> None:
+        token = issue_token()
+        self.assertTrue(verify_token(token))
+        self.assertNotIn(PASSWORD, token)
+
+    def test_tampered_and_expired_tokens(self) -> None:
+        token = issue_token()
+        expires, rest = token.split(".", 1)
+        self.assertFalse(verify_token(f"{int(expires) + 1000}.{rest}"))
+        self.assertFalse(verify_token(issue_token(ttl=-1)))
+        self.assertFalse(verify_token(None))
+        self.assertFalse(verify_token("garbage"))
+        self.assertFalse(verify_token(f"{expires}.é.ü"))
+
+    def test_password_matches(self) -> None:
+        self.assertTrue(password_matches(PASSWORD))
+        self.assertFalse(password_matches(PASSWORD + "x"))
+        self.assertFalse(password_matches(None))
+
+    def test_limiter_sliding_window(self) -> None:
+        path = os.path.join(TMP_DIR, "limiter")
+        limiter = LoginLimiter(path, max_failures=3, window=60)
+        for now in [100, 110, 120]:
+            self.assertTrue(limiter.allowed(now))
+            limiter.record_failure(now)
+        self.assertFalse(limiter.allowed(150))
+        # The first failure leaves the window at 160.
+        self.assertTrue(limiter.allowed(160))
+        # Another worker sees the same failures.
+        other = LoginLimiter(path, max_failures=3, window=60)
+        self.assertFalse(other.allowed(150))
+        other.reset()
+        self.assertTrue(limiter.allowed(150))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import unittest
+
+from video_server import torrent
+from video_server.blobs import (
+    blob_path,
+    convert_linked,
+    link_blob,
+    link_existing_blob,
+    prune_blobs,
+    rendition_key,
+    store_and_link,
+    store_blob,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "blobs")
+BLOB_ROOT = os.path.join(TMP_DIR, "blobs")
+VIDEO_ROOT = os.path.join(TMP_DIR, "v")
+DIGEST = "ab" * 32
+
+
+def write(path: str, data: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="wb") as filed:
+        filed.write(data)
+    return path
+
+
+class BlobsTester(unittest.TestCase):
+    """Tester for the content addressed blob store."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_duplicate_uploads_share_a_blob(self) -> None:
+        for title in ["first", "second"]:
+            upload = write(os.path.join(VIDEO_ROOT, title, "upload.mp4"), b"video bytes")
+            blob = store_blob(upload, DIGEST, root=BLOB_ROOT)
+            link_blob(blob, os.path.join(VIDEO_ROOT, title, "720.mp4"))
+            self.assertFalse(os.path.exists(upload))
+        self.assertEqual(blob, blob_path(DIGEST, root=BLOB_ROOT))
+        self.assertEqual(os.listdir(os.path.dirname(blob)), [os.path.basename(blob)])
+        for title in ["first", "second"]:
+            link = os.path.join(VIDEO_ROOT, title, "720.mp4")
+            self.assertEqual(os.path.realpath(link), os.path.realpath(blob))
+        # Storing the link again, as a retry does, keeps the blob.
+        link = os.path.join(VIDEO_ROOT, "first", "720.mp4")
+        self.assertEqual(store_blob(link, DIGEST, root=BLOB_ROOT), blob)
+        self.assertTrue(os.path.exists(blob))
+
+    def test_links_are_relative(self) -> None:
+        link = os.path.join(VIDEO_ROOT, "title", "720.mp4")
+        write(os.path.join(VIDEO_ROOT, "title", "upload.mp4"), b"video bytes")
+        store_and_link(os.path.join(VIDEO_ROOT, "title", "upload.mp4"), DIGEST, link, root=BLOB_ROOT)
+        self.assertFalse(os.path.isabs(os.readlink(link)))
+        # The store and the titles still match after DATA_ROOT moved.
+        moved = os.path.join(HERE, "test_data", "tmp", "blobs_moved")
+        shutil.rmtree(moved, ignore_errors=True)
+        os.rename(TMP_DIR, moved)
+        try:
+            with open(os.path.join(moved, "v", "title", "720.mp4"), mode="rb") as filed:
+                self.assertEqual(filed.read(), b"video bytes")
+        finally:
+            shutil.rmtree(moved, ignore_errors=True)
+
+    def test_link_existing_blob(self) -> None:
+        link = os.path.join(VIDEO_ROOT, "title", "480.mp4")
+        os.makedirs(os.path.dirname(link))
+        self.assertFalse(link_existing_blob(DIGEST, link, root=BLOB_ROOT))
+        self.assertFalse(os.path.lexists(link))
+        store_blob(write(os.path.join(TMP_DIR, "a.mp4"), b"a"), DIGEST, root=BLOB_ROOT)
+        self.assertTrue(link_existing_blob(DIGEST, link, root=BLOB_ROOT))
+        self.assertEqual(os.path.realpath(link), os.path.realpath(blob_path(DIGEST, root=BLOB_ROOT)))
+
+    def test_converted_links_stay_deduplicated(self) -> None:
+        calls = []
+
+        def convert(path: str) -> None:
+            calls.append(path)
+            os.remove(path)
+            write(path, b"converted")
+
+        links = []
+        for title in ["first", "second"]:
+            link = os.path.join(VIDEO_ROOT, title, "720.mp4")
+            write(os.path.join(VIDEO_ROOT, title, "upload.mp4"), b"source")
+            store_and_link(os.path.join(VIDEO_ROOT, title, "upload.mp4"), DIGEST, link, root=BLOB_ROOT)
+            convert_linked(link, "h264", convert, root=BLOB_ROOT)
+            links.append(link)
+        self.assertEqual(len(calls), 1)
+        for link in links:
+            self.assertTrue(os.path.islink(link))
+            with open(link, mode="rb") as filed:
+                self.assertEqual(filed.read(), b"converted")
+        self.assertEqual(os.path.realpath(links[0]), os.path.realpath(links[1]))
+
+    def test_rendition_key(self) -> None:
+        key = rendition_key(DIGEST, 480, 28, "veryslow")
+        self.assertEqual(key, rendition_key(DIGEST, 480, 28, "veryslow"))
+        self.assertNotEqual(key, rendition_key(DIGEST, 480, 30, "veryslow"))
+        self.assertNotEqual(key, rendition_key(DIGEST, 720, 28, "veryslow"))
+        self.assertEqual(key, rendition_key(DIGEST, 480, 28, "veryslow", []))
+        self.assertNotEqual(key, rendition_key(DIGEST, 480, 28, "veryslow", ["-g", "48"]))
+
+    def test_prune(self) -> None:
+        kept = store_blob(write(os.path.join(TMP_DIR, "a.mp4"), b"a"), "aa" * 32, root=BLOB_ROOT)
+        store_blob(write(os.path.join(TMP_DIR, "b.mp4"), b"b"), "bb" * 32, root=BLOB_ROOT)
+        os.makedirs(os.path.join(VIDEO_ROOT, "title"))
+        link_blob(kept, os.path.join(VIDEO_ROOT, "title", "720.mp4"))
+        self.assertEqual(prune_blobs(VIDEO_ROOT, root=BLOB_ROOT, min_age=3600), 0)
+        self.assertEqual(prune_blobs(VIDEO_ROOT, root=BLOB_ROOT, min_age=0), 1)
+        self.assertTrue(os.path.exists(kept))
+
+    def test_torrent_pieces_are_cached_with_the_blob(self) -> None:
+        blob = store_blob(write(os.path.join(TMP_DIR, "a.mp4"), b"x" * 1000), DIGEST, root=BLOB_ROOT)
+        link = os.path.join(VIDEO_ROOT, "title", "720.mp4")
+        os.makedirs(os.path.dirname(link))
+        link_blob(blob, link)
+        torrent.make_torrent(
+            vidfile=link,
+            torrent_path=os.path.join(VIDEO_ROOT, "title", "720.torrent"),
+            tracker_announce_list=["wss://a.example"],
+            chunk_factor=8,
+        )
+        self.assertIsNotNone(torrent.load_pieces(blob, 1 << 8))
+
+
+if __name__ == "__main__":
+    unittest.main()
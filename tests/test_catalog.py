@@ -0,0 +1,33 @@
+import json
+import unittest
+
+from video_server.catalog import build_json, get_catalog, invalidate_catalog
+from video_server.models import Video
+
+TITLE = "catalog test video"
+
+
+class CatalogTester(unittest.TestCase):
+    """Tester for the cached catalog snapshot."""
+
+    def tearDown(self) -> None:
+        Video.delete().where(Video.title == TITLE).execute()
+        invalidate_catalog()
+
+    def test_snapshot_follows_generation(self) -> None:
+        before = get_catalog()
+        self.assertIs(get_catalog(), before)
+        Video.create(title=TITLE, url="http://localhost/v/catalog", path="/tmp/catalog.mp4")
+        # Not visible until the write is announced.
+        self.assertIs(get_catalog(), before)
+        invalidate_catalog()
+        after = get_catalog()
+        self.assertGreater(after.generation, before.generation)
+        body, etag = after.body("json", build_json)
+        self.assertIs(after.body("json", build_json)[0], body)
+        self.assertIn(TITLE, [item["title"] for item in json.loads(body)])
+        self.assertTrue(etag.startswith('"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
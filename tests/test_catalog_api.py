@@ -0,0 +1,68 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from video_server.catalog_api import QueryError, parse_query, stream_page
+from video_server.models import Video
+
+PREFIX = "catalog api test"
+
+
+def fetch(**params) -> dict:
+    return json.loads(b"".join(stream_page(parse_query(search=PREFIX, **params))))
+
+
+class CatalogApiTester(unittest.TestCase):
+    """Tester for the keyset paginated catalog."""
+
+    def setUp(self) -> None:
+        base = datetime(2020, 1, 1)
+        for i in range(5):
+            Video.create(
+                title=f"{PREFIX} {i}",
+                url=f"http://localhost/v/catalog_api_{i}",
+                path=f"/tmp/catalog_api_{i}.mp4",
+                # Two videos share a timestamp so the id breaks the tie.
+                published=base + timedelta(days=min(i, 3)),
+                views=10 * i,
+                duration=float(i),
+            )
+
+    def tearDown(self) -> None:
+        Video.delete().where(Video.title.startswith(PREFIX)).execute()
+
+    def test_pages_cover_everything_once(self) -> None:
+        titles: list[str] = []
+        cursor = None
+        while True:
+            page = fetch(limit=2, cursor=cursor, fields="title")
+            titles.extend(item["title"] for item in page["videos"])
+            self.assertEqual(list(page["videos"][0]), ["title"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(titles, [f"{PREFIX} {i}" for i in [4, 3, 2, 1, 0]])
+
+    def test_sort_by_views_ascending(self) -> None:
+        first = fetch(sort="views", order="asc", limit=3)
+        second = fetch(sort="views", order="asc", limit=3, cursor=first["next_cursor"])
+        views = [item["views"] for item in first["videos"] + second["videos"]]
+        self.assertEqual(views, [0, 10, 20, 30, 40])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_filters(self) -> None:
+        page = fetch(min_duration=1, max_duration=2, fields="duration")
+        self.assertEqual(sorted(item["duration"] for item in page["videos"]), [1.0, 2.0])
+
+    def test_invalid_params(self) -> None:
+        with self.assertRaises(QueryError):
+            parse_query(fields="title,password")
+        with self.assertRaises(QueryError):
+            parse_query(sort="title")
+        cursor = fetch(limit=1)["next_cursor"]
+        with self.assertRaises(QueryError):
+            parse_query(sort="views", cursor=cursor)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+import unittest
+from dataclasses import asdict
+from unittest import mock
+
+from starlette.testclient import TestClient
+
+from video_server import app as app_module
+from video_server import chunked_upload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "chunked_upload")
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+async def _body(data: bytes):
+    yield data[: len(data) // 2]
+    yield data[len(data) // 2 :]
+
+
+class ChunkedUploadTester(unittest.TestCase):
+    """Tester for the resumable chunked uploads."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR, exist_ok=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_out_of_order_chunks(self) -> None:
+        chunk_size = 4096
+        session = chunked_upload.create_session("test", "test.mp4", len(DATA), chunk_size)
+        self.assertEqual(session.num_chunks, 3)
+        self.assertEqual(chunked_upload.missing_chunks(session), [(0, 2)])
+        asyncio.run(chunked_upload.write_chunk(session, 2, _body(DATA[8192:])))
+        self.assertEqual(chunked_upload.missing_chunks(session), [(0, 1)])
+        with self.assertRaises(chunked_upload.ChunkError):
+            asyncio.run(chunked_upload.write_chunk(session, 0, _body(DATA[:100])))
+        asyncio.run(chunked_upload.write_chunk(session, 0, _body(DATA[:4096])))
+        self.assertEqual(chunked_upload.missing_chunks(session), [(1, 1)])
+        # Reloading from disk keeps the state.
+        session = chunked_upload.load_session(session.id)
+        status = chunked_upload.session_status(session)
+        self.assertEqual(status["missing_bytes"], [(4096, 8191)])
+        asyncio.run(chunked_upload.write_chunk(session, 1, _body(DATA[4096:8192])))
+        dst = os.path.join(TMP_DIR, "out.mp4")
+        chunked_upload.finalize_session(session, dst)
+        with open(dst, mode="rb") as filed:
+            self.assertEqual(filed.read(), DATA)
+        self.assertIsNone(chunked_upload.load_session(session.id))
+
+    def test_buffered_writes(self) -> None:
+        async def pieces():
+            for start in range(0, len(DATA), 700):
+                yield DATA[start : start + 700]
+
+        with mock.patch.object(chunked_upload, "UPLOAD_SESSIONS_ROOT", TMP_DIR), mock.patch.object(
+            chunked_upload, "WRITE_BUFFER_SIZE", 2000
+        ):
+            session = chunked_upload.create_session("test", "test.mp4", len(DATA), len(DATA))
+            asyncio.run(chunked_upload.write_chunk(session, 0, pieces()))
+            with open(os.path.join(TMP_DIR, session.id, "data"), mode="rb") as filed:
+                self.assertEqual(filed.read(), DATA)
+            self.assertEqual(chunked_upload.missing_chunks(session), [])
+
+    def test_create_rejects_empty_size(self) -> None:
+        with mock.patch.object(app_module, "DISABLE_AUTH", True):
+            client = TestClient(app_module.app)
+            for size in [0, -1]:
+                params = {"title": "chunked size test", "filename": "a.mp4", "size": size}
+                self.assertEqual(client.post("/uploads", params=params).status_code, 400)
+
+    def test_expire_sessions(self) -> None:
+        with mock.patch.object(chunked_upload, "UPLOAD_SESSIONS_ROOT", TMP_DIR):
+            idle = chunked_upload.create_session("idle", "idle.mp4", len(DATA), 4096)
+            active = chunked_upload.create_session("active", "active.mp4", len(DATA), 4096)
+            # The idle one was created two hours ago and never got a chunk.
+            idle.created = time.time() - 7200
+            session_file = os.path.join(TMP_DIR, idle.id, "session.json")
+            with open(session_file, encoding="utf-8", mode="w") as filed:
+                json.dump(asdict(idle), filed)
+            received = os.path.join(TMP_DIR, idle.id, "received")
+            os.utime(received, (idle.created, idle.created))
+            asyncio.run(chunked_upload.write_chunk(active, 0, _body(DATA[:4096])))
+            self.assertEqual(chunked_upload.expire_sessions(3600), 1)
+            self.assertIsNone(chunked_upload.load_session(idle.id))
+            self.assertIsNotNone(chunked_upload.load_session(active.id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from video_server import extractor
+
+
+class ExtractorTester(unittest.TestCase):
+    """Tester for the yt-dlp info dict cache."""
+
+    def setUp(self) -> None:
+        extractor.invalidate("https://example.com/v")
+
+    def test_info_is_cached(self) -> None:
+        info = {"title": "v", "formats": []}
+        with mock.patch.object(extractor, "_extract", return_value=info) as extract:
+            first = asyncio.run(extractor.extract_info("https://example.com/v"))
+            second = asyncio.run(extractor.extract_info("https://example.com/v"))
+        self.assertEqual(extract.call_count, 1)
+        self.assertIs(first, second)
+
+    def test_info_expires(self) -> None:
+        info = {"title": "v", "formats": []}
+        with mock.patch.object(extractor, "_extract", return_value=info) as extract:
+            with mock.patch.object(extractor, "YTDLP_INFO_TTL", -1):
+                asyncio.run(extractor.extract_info("https://example.com/v"))
+                asyncio.run(extractor.extract_info("https://example.com/v"))
+        self.assertEqual(extract.call_count, 2)
+
+    def test_remembered_info_is_not_extracted(self) -> None:
+        info = {"title": "v", "formats": []}
+        extractor.remember_info("https://example.com/v", info)
+        with mock.patch.object(extractor, "_extract") as extract:
+            self.assertIs(asyncio.run(extractor.extract_info("https://example.com/v")), info)
+        extract.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
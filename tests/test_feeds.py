@@ -0,0 +1,71 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from video_server.app import app
+from video_server.catalog import feed_state, invalidate_catalog, stream_json, stream_rss
+from video_server.models import Video
+
+PREFIX = "feed test"
+
+
+async def collect(stream) -> str:
+    return "".join([part async for part in stream])
+
+
+class FeedsTester(unittest.TestCase):
+    """Tester for the streamed feeds and their conditional requests."""
+
+    def setUp(self) -> None:
+        base = datetime(2021, 1, 1)
+        for i in range(3):
+            Video.create(
+                title=f"{PREFIX} {i}",
+                url=f"http://localhost/v/feed_{i}",
+                path=f"/tmp/feed_{i}.mp4",
+                published=base + timedelta(days=i),
+                updated=base + timedelta(days=i),
+            )
+        invalidate_catalog()
+
+    def tearDown(self) -> None:
+        Video.delete().where(Video.title.startswith(PREFIX)).execute()
+        invalidate_catalog()
+
+    def test_stream_json_limit(self) -> None:
+        since = datetime(2021, 1, 1, 12)
+        items = json.loads(asyncio.run(collect(stream_json(limit=1, since=since))))
+        self.assertEqual([item["title"] for item in items], [f"{PREFIX} 2"])
+
+    def test_stream_rss_since(self) -> None:
+        body = asyncio.run(collect(stream_rss(since=datetime(2021, 1, 2, 12))))
+        self.assertIn(f"{PREFIX} 2", body)
+        self.assertNotIn(f"{PREFIX} 1", body)
+        self.assertTrue(body.endswith("</rss>"))
+
+    def test_feed_state(self) -> None:
+        _, last_updated = feed_state()
+        self.assertGreaterEqual(last_updated, datetime(2021, 1, 3))
+
+    def test_conditional_get(self) -> None:
+        client = TestClient(app)
+        first = client.get("/rss")
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers["etag"]
+        self.assertIn("last-modified", first.headers)
+        cached = client.get("/rss", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        limited = client.get("/json?limit=2", headers={"If-None-Match": etag})
+        self.assertEqual(limited.status_code, 200)
+        self.assertEqual(len(limited.json()), 2)
+        invalidate_catalog()
+        changed = client.get("/rss", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
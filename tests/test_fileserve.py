@@ -0,0 +1,151 @@
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from video_server.app import app as video_app
+from video_server import fileserve
+from video_server.assets import has_variants, write_file
+from video_server.blobs import blob_path, store_and_link
+from video_server.fileserve import parse_range_header, serve_file
+from video_server.settings import VIDEO_ROOT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "fileserve")
+LINKED_DIR = os.path.join(VIDEO_ROOT, "fileserve_test_video")
+BLOB_KEY = "fe" * 32
+DATA = bytes(range(256)) * 4
+
+
+async def _serve(request):
+    return await serve_file(request, TMP_DIR)
+
+
+class FileServeTester(unittest.TestCase):
+    """Tester for the in process file server."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(os.path.join(TMP_DIR, "sub"), exist_ok=True)
+        with open(os.path.join(TMP_DIR, "data.bin"), mode="wb") as filed:
+            filed.write(DATA)
+        with open(os.path.join(TMP_DIR, "sub", "index.html"), mode="wb") as filed:
+            filed.write(b"<html></html>")
+        app = Starlette(routes=[Route("/{path:path}", _serve, methods=["GET", "HEAD"])])
+        self.client = TestClient(app)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        shutil.rmtree(LINKED_DIR, ignore_errors=True)
+        if os.path.exists(blob_path(BLOB_KEY)):
+            os.remove(blob_path(BLOB_KEY))
+
+    def test_parse_range_header(self) -> None:
+        self.assertEqual(parse_range_header("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parse_range_header("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parse_range_header("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parse_range_header("bytes=0-0,50-200", 100), [(0, 0), (50, 99)])
+        self.assertEqual(parse_range_header("bytes=200-300", 100), [])
+        self.assertIsNone(parse_range_header("items=0-9", 100))
+        self.assertIsNone(parse_range_header("bytes=9-0", 100))
+
+    def test_full_and_single_range(self) -> None:
+        resp = self.client.get("/data.bin")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, DATA)
+        resp = self.client.get("/data.bin", headers={"Range": "bytes=10-19"})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, DATA[10:20])
+        self.assertEqual(resp.headers["content-range"], f"bytes 10-19/{len(DATA)}")
+        resp = self.client.get("/data.bin", headers={"Range": "bytes=5000-"})
+        self.assertEqual(resp.status_code, 416)
+
+    def test_multi_range(self) -> None:
+        resp = self.client.get("/data.bin", headers={"Range": "bytes=0-3,100-103"})
+        self.assertEqual(resp.status_code, 206)
+        self.assertTrue(resp.headers["content-type"].startswith("multipart/byteranges"))
+        self.assertEqual(int(resp.headers["content-length"]), len(resp.content))
+        self.assertIn(DATA[0:4], resp.content)
+        self.assertIn(DATA[100:104], resp.content)
+
+    def test_conditional_and_head(self) -> None:
+        resp = self.client.head("/data.bin")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b"")
+        self.assertEqual(int(resp.headers["content-length"]), len(DATA))
+        etag = resp.headers["etag"]
+        resp = self.client.get("/data.bin", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        resp = self.client.get(
+            "/data.bin", headers={"Range": "bytes=0-9", "If-Range": '"stale"'}
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, DATA)
+
+    def test_directory_index_and_escape(self) -> None:
+        resp = self.client.get("/sub/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b"<html></html>")
+        resp = self.client.get("/missing.bin")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_precompressed_and_immutable(self) -> None:
+        script = b"console.log('hello');\n" * 100
+        write_file(os.path.join(TMP_DIR, "player.0123456789ab.js"), script)
+        self.assertTrue(os.path.exists(os.path.join(TMP_DIR, "player.0123456789ab.js.gz")))
+        resp = self.client.get("/player.0123456789ab.js", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["content-encoding"], "gzip")
+        self.assertEqual(resp.headers["vary"], "Accept-Encoding")
+        self.assertIn("immutable", resp.headers["cache-control"])
+        self.assertTrue(resp.headers["content-type"].startswith("text/javascript"))
+        self.assertEqual(resp.content, script)
+        resp = self.client.get("/player.0123456789ab.js", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", resp.headers)
+        self.assertEqual(resp.content, script)
+        resp = self.client.get("/data.bin")
+        self.assertNotIn("cache-control", resp.headers)
+
+    def test_unreadable_file(self) -> None:
+        real_open = os.open
+        denied = os.path.join(TMP_DIR, "data.bin")
+
+        def fake_open(path, flags, *args):
+            if path == denied:
+                raise PermissionError(13, "Permission denied", path)
+            return real_open(path, flags, *args)
+
+        with mock.patch.object(fileserve.os, "open", fake_open):
+            self.assertEqual(self.client.get("/data.bin").status_code, 403)
+        with mock.patch.object(fileserve.os, "stat", side_effect=PermissionError(13, "denied")):
+            self.assertEqual(self.client.get("/data.bin").status_code, 403)
+
+    def test_no_variants_for_videos(self) -> None:
+        video = os.path.join(TMP_DIR, "720.mp4")
+        for path in [video, video + ".gz"]:
+            with open(path, mode="wb") as filed:
+                filed.write(DATA)
+        self.assertFalse(has_variants(video))
+        resp = self.client.get("/720.mp4", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("content-encoding", resp.headers)
+        self.assertEqual(resp.content, DATA)
+
+    def test_www_follows_blob_links(self) -> None:
+        os.makedirs(LINKED_DIR, exist_ok=True)
+        upload = os.path.join(LINKED_DIR, "upload.mp4")
+        with open(upload, mode="wb") as filed:
+            filed.write(DATA)
+        store_and_link(upload, BLOB_KEY, os.path.join(LINKED_DIR, "720.mp4"))
+        client = TestClient(video_app)
+        for url in ["/www/v/fileserve_test_video/720.mp4", "/v/fileserve_test_video/720.mp4"]:
+            resp = client.get(url, headers={"Range": "bytes=0-9"})
+            self.assertEqual(resp.status_code, 206, url)
+            self.assertEqual(resp.content, DATA[:10])
+
+
+if __name__ == "__main__":
+    unittest.main()
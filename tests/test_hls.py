@@ -0,0 +1,89 @@
+import os
+import shutil
+import unittest
+
+from video_server.hls import Rendition, codecs, master_playlist, segment_bandwidths
+from video_server.probe import parse_probe
+
+FFPROBE_OUTPUT = {
+    "streams": [
+        {
+            "codec_type": "video",
+            "codec_name": "h264",
+            "profile": "High",
+            "level": 31,
+            "width": 1280,
+            "height": 720,
+        },
+        {"codec_type": "audio", "codec_name": "aac", "profile": "LC"},
+    ],
+    "format": {"duration": "12.500000"},
+}
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:2
+#EXT-X-PLAYLIST-TYPE:VOD
+#EXT-X-MAP:URI="init.mp4"
+#EXTINF:2.000000,
+seg_00000.m4s
+#EXTINF:2.000000,
+seg_00001.m4s
+#EXT-X-ENDLIST
+"""
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "hls")
+
+
+class HlsTester(unittest.TestCase):
+    """Tester for the hls master playlist."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_codecs(self) -> None:
+        self.assertEqual(codecs(parse_probe(FFPROBE_OUTPUT)), "avc1.64001F,mp4a.40.2")
+        baseline = dict(FFPROBE_OUTPUT["streams"][0], profile="Constrained Baseline", level=30)
+        self.assertEqual(codecs(parse_probe({"streams": [baseline]})), "avc1.42E01E")
+        # Without a profile and level the defaults are used.
+        bare = [{"codec_type": "video", "codec_name": "h264"}, {"codec_type": "audio", "codec_name": "aac"}]
+        self.assertEqual(codecs(parse_probe({"streams": bare})), "avc1.640028,mp4a.40.2")
+
+    def test_segment_bandwidths(self) -> None:
+        with open(os.path.join(TMP_DIR, "seg_00000.m4s"), mode="wb") as filed:
+            filed.write(b"x" * 3000)
+        with open(os.path.join(TMP_DIR, "seg_00001.m4s"), mode="wb") as filed:
+            filed.write(b"x" * 1000)
+        playlist = os.path.join(TMP_DIR, "index.m3u8")
+        with open(playlist, encoding="utf-8", mode="w") as filed:
+            filed.write(MEDIA_PLAYLIST)
+        # 24000 bits in 2 seconds at the peak, 32000 bits in 4 seconds on average.
+        self.assertEqual(segment_bandwidths(playlist), (12000, 8000))
+
+    def test_master_playlist(self) -> None:
+        playlist = master_playlist(
+            [
+                Rendition("480/index.m3u8", 900000, 800000, 854, 480, "avc1.64001E,mp4a.40.2"),
+                Rendition("720/index.m3u8", 2500000, 2000000, 1280, 720, "avc1.64001F,mp4a.40.2"),
+            ]
+        )
+        self.assertEqual(
+            playlist.splitlines(),
+            [
+                "#EXTM3U",
+                "#EXT-X-VERSION:7",
+                "#EXT-X-INDEPENDENT-SEGMENTS",
+                "#EXT-X-STREAM-INF:BANDWIDTH=2500000,AVERAGE-BANDWIDTH=2000000,"
+                'RESOLUTION=1280x720,CODECS="avc1.64001F,mp4a.40.2"',
+                "720/index.m3u8",
+                "#EXT-X-STREAM-INF:BANDWIDTH=900000,AVERAGE-BANDWIDTH=800000,"
+                'RESOLUTION=854x480,CODECS="avc1.64001E,mp4a.40.2"',
+                "480/index.m3u8",
+            ],
+        )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from video_server import jobs
+from video_server.catalog import get_catalog, invalidate_catalog
+from video_server.models import IngestJob, Video
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "jobs")
+TITLE = "jobs test video"
+
+
+class JobsTester(unittest.TestCase):
+    """Tester for the ingest job state machine."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR)
+        self.job_id = jobs.enqueue_job(TITLE, jobs.KIND_UPLOAD, TMP_DIR, {"source": "x.mp4"})
+
+    def tearDown(self) -> None:
+        IngestJob.delete().where(IngestJob.title == TITLE).execute()
+        Video.delete().where(Video.title == TITLE).execute()
+        invalidate_catalog()
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def _job(self) -> IngestJob:
+        job = jobs.get_job(self.job_id)
+        assert job is not None
+        return job
+
+    def test_claim_is_atomic(self) -> None:
+        first, second = self._job(), self._job()
+        self.assertTrue(jobs._claim(first))
+        self.assertFalse(jobs._claim(second))
+        job = self._job()
+        self.assertEqual(job.state, jobs.ENCODING)
+        self.assertEqual(job.attempts, 1)
+
+    def test_requeue_orphaned_jobs(self) -> None:
+        self.assertTrue(jobs._claim(self._job()))
+        self.assertGreaterEqual(jobs.requeue_orphaned_jobs(), 1)
+        self.assertEqual(self._job().state, jobs.QUEUED)
+
+    def test_retry_job(self) -> None:
+        self.assertFalse(jobs.retry_job(self.job_id))
+        IngestJob.update(state=jobs.FAILED, attempts=3, error="boom").where(
+            IngestJob.id == self.job_id
+        ).execute()
+        self.assertTrue(jobs.retry_job(self.job_id))
+        job = self._job()
+        self.assertEqual((job.state, job.attempts, job.error), (jobs.QUEUED, 0, ""))
+
+    def test_error_requeues_until_the_last_attempt(self) -> None:
+        async def fail(job: IngestJob, _params: dict) -> tuple[int, list[str]]:
+            jobs._get_or_create_video(job.title, "", os.path.join(TMP_DIR, "720.mp4"))
+            raise RuntimeError("encoder crashed")
+
+        with mock.patch.object(jobs, "_run_upload", fail), mock.patch.object(
+            jobs, "MAX_JOB_ATTEMPTS", 2
+        ), mock.patch.object(jobs, "NO_CLEANUP", False):
+            job = self._job()
+            self.assertTrue(jobs._claim(job))
+            asyncio.run(jobs.run_job(job))
+            job = self._job()
+            self.assertEqual((job.state, job.error), (jobs.QUEUED, "encoder crashed"))
+            self.assertTrue(os.path.exists(TMP_DIR))
+            self.assertTrue(jobs._claim(job))
+            asyncio.run(jobs.run_job(job))
+        job = self._job()
+        self.assertEqual((job.state, job.attempts), (jobs.FAILED, 2))
+        self.assertIsNone(Video.get_or_none(Video.title == TITLE))
+        self.assertFalse(os.path.exists(TMP_DIR))
+
+    def test_video_is_listed_once_published(self) -> None:
+        vid_id = jobs._get_or_create_video(TITLE, "", os.path.join(TMP_DIR, "720.mp4"))
+        invalidate_catalog()
+        self.assertNotIn(vid_id, [video.id for video in get_catalog().videos])
+        with open(os.path.join(TMP_DIR, "video.json"), encoding="utf-8", mode="w") as filed:
+            json.dump({"posters": {"720": "poster.jpg"}}, filed)
+        jobs._publish(vid_id, TMP_DIR)
+        video = Video.get_by_id(vid_id)
+        self.assertTrue(video.ready)
+        self.assertEqual(json.loads(video.previews), {"posters": {"720": "poster.jpg"}})
+        self.assertIn(vid_id, [video.id for video in get_catalog().videos])
+
+
+if __name__ == "__main__":
+    unittest.main()
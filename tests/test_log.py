@@ -0,0 +1,78 @@
+import json
+import logging
+import logging.config
+import os
+import shutil
+import unittest
+
+from video_server.log import JsonFormatter, RotatingAppendHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "log")
+
+
+def make_record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+class LogTester(unittest.TestCase):
+    """Tester for the log file handler."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR)
+        self.path = os.path.join(TMP_DIR, "log.txt")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_size_rotation(self) -> None:
+        handler = RotatingAppendHandler(self.path, max_bytes=100, backup_count=2, rotate_seconds=0)
+        try:
+            for i in range(3):
+                handler.emit(make_record("x" * 150 + str(i)))
+                handler.next_check = 0  # Don't wait for the check interval.
+        finally:
+            handler.close()
+        self.assertTrue(os.path.exists(f"{self.path}.1"))
+        self.assertTrue(os.path.exists(f"{self.path}.2"))
+        self.assertFalse(os.path.exists(f"{self.path}.3"))
+        with open(self.path, encoding="utf-8") as filed:
+            self.assertTrue(filed.read().strip().endswith("2"))
+
+    def test_reopens_after_rotation_elsewhere(self) -> None:
+        handler = RotatingAppendHandler(self.path, max_bytes=0, backup_count=1, rotate_seconds=0)
+        try:
+            handler.emit(make_record("first"))
+            os.replace(self.path, f"{self.path}.1")
+            handler.next_check = 0
+            handler.emit(make_record("second"))
+        finally:
+            handler.close()
+        with open(self.path, encoding="utf-8") as filed:
+            self.assertEqual(filed.read().strip(), "second")
+
+    def test_survives_dict_config(self) -> None:
+        handler = RotatingAppendHandler(self.path, max_bytes=0, backup_count=1, rotate_seconds=0)
+        try:
+            handler.emit(make_record("before"))
+            # Closes every existing handler, as uvicorn's default log config does.
+            logging.config.dictConfig({"version": 1, "disable_existing_loggers": False})
+            handler.emit(make_record("after"))
+        finally:
+            handler.close()
+        with open(self.path, encoding="utf-8") as filed:
+            self.assertEqual(filed.read().split(), ["before", "after"])
+
+    def test_lock_next_to_the_file(self) -> None:
+        handler = RotatingAppendHandler(self.path, max_bytes=0, backup_count=1, rotate_seconds=0)
+        handler.close()
+        self.assertEqual(handler.rotate_lock.lock_file, f"{self.path}.lock")
+
+    def test_json_formatter(self) -> None:
+        line = JsonFormatter().format(make_record("hello"))
+        self.assertEqual(json.loads(line)["message"], "hello")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import shutil
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from starlette.testclient import TestClient
+
+from video_server import app as app_module
+from video_server.log import WARNING
+from video_server.log_tail import LogFilter, follow, read_lines_backwards, tail
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEST_DIR = os.path.join(HERE, "test_data", "tmp", "log_tail")
+LOG_PATH = os.path.join(TEST_DIR, "log.txt")
+
+LINES = [
+    "INFO 2024-01-01 10:00:00,000 app.py:1->a - first",
+    "WARNING 2024-01-01 11:00:00,000 app.py:2->b - disk low",
+    "INFO 2024-01-02 10:00:00,000 app.py:3->c - second",
+    "ERROR 2024-01-02 11:00:00,000 app.py:4->d - upload failed",
+    "INFO 2024-01-03 10:00:00,000 app.py:5->e - third",
+]
+
+
+class LogTailTester(unittest.TestCase):
+    """Tester for reading and following the end of the log."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+        os.makedirs(TEST_DIR, exist_ok=True)
+        with open(LOG_PATH, mode="w", encoding="utf-8") as filed:
+            filed.write("\n".join(LINES) + "\n")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+    def test_read_lines_backwards(self) -> None:
+        # A tiny block size splits lines across blocks.
+        lines = list(read_lines_backwards(LOG_PATH, block_size=7))
+        self.assertEqual(lines, LINES[::-1])
+
+    def test_tail(self) -> None:
+        self.assertEqual(tail(LOG_PATH, 2), LINES[-2:])
+        self.assertEqual(tail(LOG_PATH, 100), LINES)
+        self.assertEqual(tail(os.path.join(TEST_DIR, "missing.txt"), 10), [])
+
+    def test_filters(self) -> None:
+        self.assertEqual(tail(LOG_PATH, 10, LogFilter(level=WARNING)), [LINES[1], LINES[3]])
+        self.assertEqual(tail(LOG_PATH, 10, LogFilter(grep="upload")), [LINES[3]])
+        since = datetime(2024, 1, 2)
+        self.assertEqual(tail(LOG_PATH, 10, LogFilter(since=since)), LINES[2:])
+        both = LogFilter(level=WARNING, since=since)
+        self.assertEqual(tail(LOG_PATH, 10, both), [LINES[3]])
+
+    def test_endpoint_since_with_offset(self) -> None:
+        since = datetime(2024, 1, 2).astimezone().astimezone(timezone.utc)
+        self.assertEqual(app_module.parse_local_time(since.isoformat()), datetime(2024, 1, 2))
+        with mock.patch.object(app_module, "LOGFILE", LOG_PATH), mock.patch.object(
+            app_module, "DISABLE_AUTH", True
+        ):
+            response = TestClient(app_module.app).get("/log", params={"since": since.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "".join(f"{line}\n" for line in LINES[2:]))
+
+    def test_follow(self) -> None:
+        async def run() -> list[str]:
+            out: list[str] = []
+            lines = follow(LOG_PATH, LogFilter(grep="new"), poll_interval=0.01)
+
+            async def collect() -> None:
+                async for line in lines:
+                    out.append(line)
+                    if len(out) == 2:
+                        break
+
+            task = asyncio.create_task(collect())
+            await asyncio.sleep(0.05)
+            with open(LOG_PATH, mode="a", encoding="utf-8") as filed:
+                filed.write("INFO new one\nINFO skipped\nINFO new two\n")
+            await asyncio.wait_for(task, timeout=5)
+            await lines.aclose()  # type: ignore[attr-defined]
+            return out
+
+        self.assertEqual(asyncio.run(run()), ["INFO new one", "INFO new two"])
+
+
+if __name__ == "__main__":
+    unittest.main()
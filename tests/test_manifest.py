@@ -0,0 +1,95 @@
+import os
+import shutil
+import unittest
+
+from peewee import SqliteDatabase  # type: ignore
+
+from video_server.manifest import (
+    file_sha256,
+    forget_tree,
+    list_files,
+    reconcile,
+    record_files,
+    record_tree,
+    sync_file,
+)
+from video_server.models import FileEntry
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "test_data", "tmp", "manifest")
+
+
+def write(rel_path: str, data: bytes) -> str:
+    path = os.path.join(ROOT, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="wb") as filed:
+        filed.write(data)
+    return path
+
+
+class ManifestTester(unittest.TestCase):
+    """Tester for the file manifest."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(ROOT, ignore_errors=True)
+        # A database of its own, the manifest of DATA_ROOT is left alone.
+        self.test_db = SqliteDatabase(":memory:")
+        self.bound = self.test_db.bind_ctx([FileEntry])
+        self.bound.__enter__()  # pylint: disable=unnecessary-dunder-call
+        self.test_db.create_tables([FileEntry])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(ROOT, ignore_errors=True)
+        self.bound.__exit__(None, None, None)
+        self.test_db.close()
+
+    def test_record_and_forget(self) -> None:
+        write("v/a/720.mp4", b"a720")
+        write("v/a/480.mp4", b"a480")
+        write("v/ab/720.mp4", b"ab720")
+        self.assertEqual(record_tree(os.path.join(ROOT, "v"), root=ROOT), 3)
+        # Unchanged files are not hashed or written again.
+        self.assertEqual(record_tree(os.path.join(ROOT, "v"), root=ROOT), 0)
+        entry = FileEntry.get(FileEntry.path == "v/a/720.mp4")
+        self.assertEqual(entry.size, 4)
+        self.assertEqual(entry.sha256, file_sha256(os.path.join(ROOT, "v/a/720.mp4")))
+        # Only the directory itself, not v/ab which shares the prefix.
+        self.assertEqual(forget_tree(os.path.join(ROOT, "v/a"), root=ROOT), 2)
+        self.assertEqual([e.path for e in list_files()], ["v/ab/720.mp4"])
+
+    def test_known_digests_are_not_hashed_again(self) -> None:
+        known = write("v/a/720.mp4", b"a720")
+        other = write("v/a/480.mp4", b"a480")
+        record_tree(os.path.join(ROOT, "v"), digests={known: "f" * 64}, root=ROOT)
+        self.assertEqual(FileEntry.get(FileEntry.path == "v/a/720.mp4").sha256, "f" * 64)
+        self.assertEqual(FileEntry.get(FileEntry.path == "v/a/480.mp4").sha256, file_sha256(other))
+
+    def test_reconcile(self) -> None:
+        path = write("v/a/720.mp4", b"old")
+        record_files([path], root=ROOT)
+        write("v/b/720.mp4", b"new")
+        os.remove(path)
+        self.assertEqual(reconcile(ROOT, root=ROOT), (1, 1))
+        self.assertEqual([e.path for e in list_files()], ["v/b/720.mp4"])
+
+    def test_pages(self) -> None:
+        for index in range(5):
+            write(f"f{index}.txt", b"x")
+        record_tree(ROOT, root=ROOT)
+        first = list_files(limit=3)
+        second = list_files(after=first[-1].path, limit=3)
+        self.assertEqual([e.path for e in first + second], [f"f{i}.txt" for i in range(5)])
+
+    def test_sync_file(self) -> None:
+        src = write("src/player.js", b"one")
+        dst = os.path.join(ROOT, "www", "player.js")
+        self.assertTrue(sync_file(src, dst, root=ROOT))
+        self.assertFalse(sync_file(src, dst, root=ROOT))
+        write("src/player.js", b"two!")
+        self.assertTrue(sync_file(src, dst, root=ROOT))
+        with open(dst, mode="rb") as filed:
+            self.assertEqual(filed.read(), b"two!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from video_server.metrics import (
+    MetricsMiddleware,
+    observe_stage,
+    observe_sql,
+    remove_dead_process_files,
+    render_metrics,
+    sample_executors,
+    time_stage,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "metrics")
+
+
+async def _video(request):
+    return PlainTextResponse(request.path_params["title"])
+
+
+class MetricsTester(unittest.TestCase):
+    """Tester for the prometheus metrics."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR, exist_ok=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_request_labeled_by_route(self) -> None:
+        app = Starlette(routes=[Route("/metrics_test/{title}", _video)])
+        app.add_middleware(MetricsMiddleware)
+        client = TestClient(app)
+        self.assertEqual(client.get("/metrics_test/some_title").status_code, 200)
+        self.assertEqual(client.get("/metrics_test_missing").status_code, 404)
+        text = render_metrics().decode("utf-8")
+        self.assertIn('route="/metrics_test/{title}"', text)
+        self.assertNotIn("some_title", text)
+        self.assertIn('route="unmatched",status="404"', text)
+
+    def test_stage_and_sql(self) -> None:
+        with time_stage("metrics_test_stage", 720):
+            pass
+        observe_sql("  select * from video", 0.001)
+        text = render_metrics().decode("utf-8")
+        self.assertIn('rendition="720",stage="metrics_test_stage"', text)
+        self.assertIn('statement="SELECT"', text)
+
+    def test_observe_stage(self) -> None:
+        observe_stage("metrics_test_probe", 1080, 0.01)
+        text = render_metrics().decode("utf-8")
+        self.assertIn('rendition="1080",stage="metrics_test_probe"', text)
+
+    def test_sample_executors(self) -> None:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            sample_executors({"metrics_test": executor})
+        self.assertIn('executor="metrics_test"', render_metrics().decode("utf-8"))
+
+    def test_remove_dead_process_files(self) -> None:
+        alive = os.path.join(TMP_DIR, f"counter_{os.getpid()}.db")
+        dead = os.path.join(TMP_DIR, "gauge_livesum_999999999.db")
+        other = os.path.join(TMP_DIR, "README")
+        for path in (alive, dead, other):
+            with open(path, mode="wb"):
+                pass
+        self.assertEqual(remove_dead_process_files(TMP_DIR), 1)
+        self.assertTrue(os.path.exists(alive))
+        self.assertFalse(os.path.exists(dead))
+        self.assertTrue(os.path.exists(other))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import unittest
+
+from video_server.once import run_once
+from video_server.settings import DATA_ROOT
+
+NAME = "test_once"
+
+
+class OnceTester(unittest.TestCase):
+    """Tester for the run once setup steps."""
+
+    def setUp(self) -> None:
+        self.stamp = os.path.join(DATA_ROOT, f"{NAME}.stamp")
+        if os.path.exists(self.stamp):
+            os.remove(self.stamp)
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.stamp):
+            os.remove(self.stamp)
+
+    def test_runs_once_per_fingerprint(self) -> None:
+        calls = []
+        fingerprint = ["a"]
+        self.assertTrue(run_once(NAME, lambda: fingerprint[0], lambda: calls.append(1)))
+        self.assertFalse(run_once(NAME, lambda: fingerprint[0], lambda: calls.append(1)))
+        fingerprint[0] = "b"
+        self.assertTrue(run_once(NAME, lambda: fingerprint[0], lambda: calls.append(1)))
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
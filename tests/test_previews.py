@@ -0,0 +1,49 @@
+import os
+import shutil
+import unittest
+
+from PIL import Image  # type: ignore
+
+from video_server.previews import make_posters, storyboard_vtt, tile_interval
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "previews")
+
+
+class PreviewsTester(unittest.TestCase):
+    """Tester for the posters and the storyboard track."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR)
+
+    def test_tile_interval(self) -> None:
+        self.assertEqual(tile_interval(60), 2.0)
+        self.assertEqual(tile_interval(3000), 10.0)
+
+    def test_storyboard_vtt(self) -> None:
+        vtt = storyboard_vtt(duration=205, interval=2, tile_width=160, tile_height=90)
+        lines = vtt.splitlines()
+        self.assertEqual(lines[0], "WEBVTT")
+        self.assertEqual(lines[2], "00:00:00.000 --> 00:00:02.000")
+        self.assertEqual(lines[3], "sprite_001.jpg#xywh=0,0,160,90")
+        # Tile 11 is the second tile of the second row.
+        self.assertIn("sprite_001.jpg#xywh=160,90,160,90", lines[2 + 11 * 3 + 1])
+        # Tile 100 starts the second sheet, the last cue ends at the duration.
+        self.assertIn("sprite_002.jpg#xywh=0,0,160,90", vtt)
+        self.assertEqual(lines[-2], "00:03:24.000 --> 00:03:25.000")
+
+    def test_make_posters(self) -> None:
+        thumbnail = os.path.join(TMP_DIR, "thumbnail.jpg")
+        Image.new("RGB", (800, 450)).save(thumbnail, "JPEG")
+        posters = make_posters(thumbnail, TMP_DIR)
+        self.assertEqual((posters["small"]["width"], posters["small"]["height"]), (320, 180))
+        # Never upscaled.
+        self.assertEqual(posters["large"]["width"], 800)
+        for poster in posters.values():
+            self.assertTrue(os.path.exists(os.path.join(TMP_DIR, poster["jpg"])))
+            self.assertTrue(os.path.exists(os.path.join(TMP_DIR, poster["webp"])))
+
+
+if __name__ == "__main__":
+    unittest.main()
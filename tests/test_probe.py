@@ -0,0 +1,32 @@
+import unittest
+
+from video_server.probe import parse_probe
+
+FFPROBE_OUTPUT = {
+    "streams": [
+        {"codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720},
+        {"codec_type": "audio", "codec_name": "aac"},
+    ],
+    "format": {"duration": "12.500000"},
+}
+
+
+class ProbeTester(unittest.TestCase):
+    """Tester for the ffprobe parsing."""
+
+    def test_parse_probe(self) -> None:
+        result = parse_probe(FFPROBE_OUTPUT)
+        self.assertEqual(result.height, 720)
+        self.assertEqual(result.width, 1280)
+        self.assertEqual(result.video_codec, "h264")
+        self.assertEqual(result.duration, 12.5)
+        self.assertTrue(result.has_audio)
+
+    def test_parse_probe_silent(self) -> None:
+        result = parse_probe({"streams": FFPROBE_OUTPUT["streams"][:1], "format": {}})
+        self.assertFalse(result.has_audio)
+        self.assertIsNone(result.duration)
+
+
+if __name__ == "__main__":
+    unittest.main()
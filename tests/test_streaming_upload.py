@@ -0,0 +1,149 @@
+import asyncio
+import os
+import shutil
+import unittest
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from video_server.streaming_upload import (
+    UploadFormatError,
+    UploadRejected,
+    UploadTooLarge,
+    receive_multipart,
+    receive_raw,
+)
+from video_server.torrent import StreamHasher
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "streaming_upload")
+TEST_MP4 = os.path.join(HERE, "test_data", "test.mp4")
+MAX_SIZE = 1024 * 1024 * 8
+
+
+def _request(chunks: list[bytes], content_type: str = "application/octet-stream") -> Request:
+    """A request whose client disconnects after sending chunks."""
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.disconnect"})
+
+    async def receive() -> dict:
+        return messages.pop(0)
+
+    headers = [(b"content-type", content_type.encode())]
+    return Request({"type": "http", "method": "POST", "headers": headers}, receive)
+
+
+async def _multipart(request: Request):
+    received = await receive_multipart(
+        request,
+        destinations={
+            "file": os.path.join(TMP_DIR, "upload.mp4"),
+            "thumbnail": os.path.join(TMP_DIR, "thumbnail.jpg"),
+        },
+        max_size=MAX_SIZE,
+    )
+    return JSONResponse({name: [f.filename, f.size] for name, f in received.items()})
+
+
+async def _raw(request: Request):
+    hasher = StreamHasher(1 << 15)
+    try:
+        size = await receive_raw(
+            request, os.path.join(TMP_DIR, "raw.mp4"), max_size=MAX_SIZE, hasher=hasher
+        )
+    except UploadTooLarge:
+        return PlainTextResponse("too large", status_code=413)
+    except UploadFormatError as exc:
+        return PlainTextResponse(f"{exc}", status_code=400)
+    return JSONResponse({"size": size, "hashed": hasher.size})
+
+
+class StreamingUploadTester(unittest.TestCase):
+    """Tester for the streaming upload parser."""
+
+    def setUp(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR, exist_ok=True)
+        app = Starlette(
+            routes=[
+                Route("/multipart", _multipart, methods=["POST"]),
+                Route("/raw", _raw, methods=["POST"]),
+            ]
+        )
+        self.client = TestClient(app)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_multipart(self) -> None:
+        with open(TEST_MP4, mode="rb") as filed:
+            data = filed.read()
+        resp = self.client.post(
+            "/multipart",
+            files={
+                "file": ("test.mp4", data, "video/mp4"),
+                "thumbnail": ("thumb.jpg", b"jpegbytes", "image/jpeg"),
+                "ignored": ("other.bin", b"x", "application/octet-stream"),
+            },
+            data={"title": "skipped"},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {"file": ["test.mp4", len(data)], "thumbnail": ["thumb.jpg", 9]})
+        with open(os.path.join(TMP_DIR, "upload.mp4"), mode="rb") as filed:
+            self.assertEqual(filed.read(), data)
+
+    def test_raw_and_limit(self) -> None:
+        resp = self.client.post("/raw", content=b"a" * 1000)
+        self.assertEqual(resp.json(), {"size": 1000, "hashed": 1000})
+        resp = self.client.post("/raw", content=b"a" * (MAX_SIZE + 1))
+        self.assertEqual(resp.status_code, 413)
+
+    def test_invalid_content_length(self) -> None:
+        async def receive() -> dict:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        scope = {"type": "http", "method": "POST", "headers": [(b"content-length", b"12abc")]}
+        request = Request(scope, receive)
+        dst = os.path.join(TMP_DIR, "raw.mp4")
+        with self.assertRaises(UploadFormatError):
+            asyncio.run(receive_raw(request, dst, max_size=MAX_SIZE))
+
+    def test_raw_disconnect_removes_partial_file(self) -> None:
+        dst = os.path.join(TMP_DIR, "raw.mp4")
+        with self.assertRaises(UploadFormatError):
+            asyncio.run(receive_raw(_request([b"a" * 1000, b"b" * 1000]), dst, max_size=MAX_SIZE))
+        self.assertFalse(os.path.exists(dst))
+
+    def test_multipart_disconnect_removes_partial_file(self) -> None:
+        body = b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.mp4"\r\n\r\n'
+        dst = os.path.join(TMP_DIR, "upload.mp4")
+        request = _request([body, b"a" * 1000], "multipart/form-data; boundary=xyz")
+        with self.assertRaises(UploadFormatError):
+            asyncio.run(receive_multipart(request, {"file": dst}, max_size=MAX_SIZE))
+        self.assertFalse(os.path.exists(dst))
+
+    def test_check_part_aborts_before_the_body(self) -> None:
+        body = b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.exe"\r\n\r\n'
+        dst = os.path.join(TMP_DIR, "upload.mp4")
+        seen = []
+
+        def check_part(field_name: str, filename: str) -> None:
+            seen.append((field_name, filename))
+            raise UploadRejected(PlainTextResponse("bad extension", status_code=415))
+
+        # The disconnect after the headers is never read: the upload stops at the part headers.
+        request = _request([body, b"a" * 1000], "multipart/form-data; boundary=xyz")
+        with self.assertRaises(UploadRejected) as ctx:
+            asyncio.run(
+                receive_multipart(request, {"file": dst}, max_size=MAX_SIZE, check_part=check_part)
+            )
+        self.assertEqual(ctx.exception.response.status_code, 415)
+        self.assertEqual(seen, [("file", "a.exe")])
+        self.assertFalse(os.path.exists(dst))
+
+
+if __name__ == "__main__":
+    unittest.main()
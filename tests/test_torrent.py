@@ -0,0 +1,83 @@
+import hashlib
+import os
+import shutil
+import unittest
+
+from video_server import torrent
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMP_DIR = os.path.join(HERE, "test_data", "tmp", "torrent")
+TEST_MP4 = os.path.join(HERE, "test_data", "test.mp4")
+
+
+def expected_pieces(path: str, piece_length: int) -> bytes:
+    out = b""
+    with open(path, mode="rb") as filed:
+        while chunk := filed.read(piece_length):
+            out += hashlib.sha1(chunk).digest()
+    return out
+
+
+class TorrentTester(unittest.TestCase):
+    """Tester for the torrent writer."""
+
+    def test_bencode(self) -> None:
+        self.assertEqual(torrent.bencode(42), b"i42e")
+        self.assertEqual(torrent.bencode("spam"), b"4:spam")
+        self.assertEqual(torrent.bencode(["a", 1]), b"l1:ai1ee")
+        self.assertEqual(torrent.bencode({"b": 1, "a": "x"}), b"d1:a1:x1:bi1ee")
+
+    def test_hash_file_matches_sequential(self) -> None:
+        piece_length = 1 << 15
+        expected = expected_pieces(TEST_MP4, piece_length)
+        self.assertEqual(torrent.hash_file(TEST_MP4, piece_length), expected)
+        old_min = torrent.MIN_PIECES_FOR_POOL
+        old_per_task = torrent.PIECES_PER_TASK
+        torrent.MIN_PIECES_FOR_POOL = 1
+        torrent.PIECES_PER_TASK = 16
+        try:
+            self.assertEqual(torrent.hash_file(TEST_MP4, piece_length, max_workers=2), expected)
+        finally:
+            torrent.MIN_PIECES_FOR_POOL = old_min
+            torrent.PIECES_PER_TASK = old_per_task
+
+    def test_stream_hasher(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR, exist_ok=True)
+        piece_length = 1 << 15
+        dst = os.path.join(TMP_DIR, "copy.mp4")
+        hasher = torrent.StreamHasher(piece_length)
+        with open(TEST_MP4, mode="rb") as src, open(dst, mode="wb") as out:
+            # Odd sized chunks so that pieces straddle the writes.
+            while chunk := src.read(10000):
+                out.write(chunk)
+                hasher.update(chunk)
+        hasher.save_pieces(dst)
+        expected = expected_pieces(TEST_MP4, piece_length)
+        self.assertEqual(torrent.load_pieces(dst, piece_length), expected)
+        self.assertIsNone(torrent.load_pieces(dst, piece_length * 2))
+        with open(TEST_MP4, mode="rb") as filed:
+            self.assertEqual(hasher.content_digest(), hashlib.sha256(filed.read()).hexdigest())
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+    def test_make_torrent(self) -> None:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+        os.makedirs(TMP_DIR, exist_ok=True)
+        torrent_path = os.path.join(TMP_DIR, "test.torrent")
+        torrent.make_torrent(
+            vidfile=TEST_MP4,
+            torrent_path=torrent_path,
+            tracker_announce_list=["wss://a.example", "wss://b.example"],
+            chunk_factor=17,
+            webseed="https://example.com/v/test/test.mp4",
+        )
+        with open(torrent_path, mode="rb") as filed:
+            data = filed.read()
+        self.assertIn(b"8:url-listl35:https://example.com/v/test/test.mp4e", data)
+        self.assertIn(b"12:piece lengthi131072e", data)
+        self.assertIn(expected_pieces(TEST_MP4, 1 << 17), data)
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
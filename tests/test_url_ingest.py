@@ -0,0 +1,70 @@
+import asyncio
+import gc
+import os
+import sys
+import unittest
+from unittest import mock
+
+from starlette.testclient import TestClient
+
+from video_server import app as app_module
+from video_server.url_ingest import (
+    UrlIngestError,
+    compact_formats,
+    match_formats,
+    run_cmd,
+)
+
+
+class UrlIngestTester(unittest.TestCase):
+    """Tester for the url ingest helpers."""
+
+    def test_match_formats(self) -> None:
+        sizemap = match_formats([(360, "a"), (480, "b"), (720, "c"), (1080, "d")])
+        self.assertEqual(sizemap, {1080: "d", 720: "c", 480: "b"})
+
+    def test_match_formats_too_small(self) -> None:
+        sizemap = match_formats([(360, "a")])
+        self.assertEqual(sizemap, {1080: None, 720: None, 480: None})
+
+    def test_compact_formats(self) -> None:
+        info = {"formats": [{"format_id": "1", "ext": "mp4", "height": 720, "url": "x"}]}
+        fmt = compact_formats(info)[0]
+        self.assertEqual(fmt["format_id"], "1")
+        self.assertIsNone(fmt["acodec"])
+        self.assertNotIn("url", fmt)
+
+    def test_run_cmd_output(self) -> None:
+        stdout = asyncio.run(run_cmd([sys.executable, "-c", "print('done')"]))
+        self.assertEqual(stdout.strip(), "done")
+
+    def test_run_cmd_failure(self) -> None:
+        with self.assertRaises(UrlIngestError):
+            asyncio.run(run_cmd([sys.executable, "-c", "raise SystemExit(3)"]))
+
+    def test_upload_url_removes_the_directory_on_error(self) -> None:
+        info = {
+            "title": "url ingest cleanup test",
+            "thumbnail": "https://example.com/thumb.jpg",
+            "formats": [{"format_id": "1", "ext": "mp4", "height": 720}],
+        }
+
+        async def extract_info(_url: str) -> dict:
+            return info
+
+        def enqueue_job(**_kwargs) -> int:
+            raise RuntimeError("database is locked")
+
+        video_dir = app_module.to_video_dir(info["title"])
+        with mock.patch.object(app_module, "DISABLE_AUTH", True), mock.patch.object(
+            app_module, "extract_info", extract_info
+        ), mock.patch.object(app_module, "enqueue_job", enqueue_job):
+            client = TestClient(app_module.app, raise_server_exceptions=False)
+            resp = client.post("/upload_url", params={"url": "https://example.com/v"})
+        self.assertEqual(resp.status_code, 500)
+        gc.collect()  # the failed request's traceback holds the cleanup in a cycle
+        self.assertFalse(os.path.exists(video_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import time
+import unittest
+from unittest import mock
+
+from video_server import view_counter
+from video_server.catalog import current_generation, invalidate_catalog_for_views
+from video_server.models import CatalogState, Video
+from video_server.settings import VIEW_CATALOG_INTERVAL
+from video_server.view_counter import flush_views, record_view
+
+TITLE = "view counter test video"
+
+
+class ViewCounterTester(unittest.TestCase):
+    """Tester for the write-behind view counter."""
+
+    def setUp(self) -> None:
+        self.video = Video.create(
+            title=TITLE, url="http://localhost/v/view_counter", path="/tmp/view_counter.mp4"
+        )
+        view_counter._views_dirty = False
+        # The retry test leaves the last bump in the future.
+        CatalogState.update(views_bumped=0).where(CatalogState.id == 1).execute()
+
+    def tearDown(self) -> None:
+        Video.delete().where(Video.title == TITLE).execute()
+
+    def test_views_are_batched(self) -> None:
+        for _ in range(3):
+            record_view(self.video.id)
+        # Nothing is written until the flush.
+        self.assertEqual(Video.get_by_id(self.video.id).views, 0)
+        self.assertEqual(flush_views(), 1)
+        self.assertEqual(Video.get_by_id(self.video.id).views, 3)
+        self.assertEqual(flush_views(), 0)
+
+    def test_views_bump_the_catalog_at_most_once_per_interval(self) -> None:
+        invalidate_catalog_for_views(0)
+        generation = current_generation()
+        for _ in range(3):
+            record_view(self.video.id)
+            flush_views()
+        # The flush above was within VIEW_CATALOG_INTERVAL of the forced bump.
+        self.assertEqual(current_generation(), generation)
+        self.assertTrue(invalidate_catalog_for_views(0))
+        self.assertEqual(current_generation(), generation + 1)
+
+    def test_rate_limited_bump_is_retried_without_new_views(self) -> None:
+        invalidate_catalog_for_views(0)
+        generation = current_generation()
+        record_view(self.video.id)
+        self.assertEqual(flush_views(), 1)
+        self.assertEqual(flush_views(), 0)
+        self.assertEqual(current_generation(), generation)
+        # Playback stopped, the next flush after the window still publishes the counts.
+        later = time.time() + VIEW_CATALOG_INTERVAL + 1
+        with mock.patch("video_server.catalog.time.time", return_value=later):
+            self.assertEqual(flush_views(), 0)
+            self.assertEqual(current_generation(), generation + 1)
+            flush_views()
+        self.assertEqual(current_generation(), generation + 1)
+
+    def test_shutdown_flush_bumps(self) -> None:
+        invalidate_catalog_for_views(0)
+        generation = current_generation()
+        record_view(self.video.id)
+        flush_views(force_bump=True)
+        self.assertEqual(current_generation(), generation + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,21 +2,19 @@
     Fastapi server
 """
 
-# pylint: disable=fixme,broad-except,logging-fstring-interpolation,too-many-locals,redefined-builtin,invalid-name,too-many-branches,too-many-return-statements
+# pylint: disable=fixme,broad-except,logging-fstring-interpolation,too-many-locals,redefined-builtin,invalid-name,too-many-branches,too-many-return-statements,too-many-lines
 import asyncio
 import datetime
+import email.utils
 import hashlib
+import hmac
 import os
 import shutil
 import threading
 import time
 import traceback
 import subprocess
-import json
-import random
-from dataclasses import dataclass
-from tempfile import TemporaryDirectory
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional
 
 import uvicorn  # type: ignore
 import httpx
@@ -31,27 +29,90 @@ from fastapi.responses import (
 )
 from fastapi.security import HTTPBasic
 from fastapi.staticfiles import StaticFiles
-from filelock import FileLock, Timeout
-from PIL import Image  # type: ignore
+from filelock import Timeout
 from httpx import AsyncClient
 from keyvalue_sqlite import KeyValueSqlite  # type: ignore
 from starlette.background import BackgroundTask
-from video_server.asyncwrap import asyncwrap
+from video_server.assets import IMMUTABLE_CACHE_CONTROL, is_fingerprinted
+from video_server.asyncwrap import DEFAULT_EXECUTOR, asyncwrap
+from video_server.chunked_upload import (
+    ChunkError,
+    create_session,
+    delete_session,
+    expire_sessions,
+    finalize_session,
+    load_session,
+    missing_chunks,
+    session_status,
+    write_chunk,
+)
+from video_server.auth import (
+    SESSION_COOKIE,
+    issue_token,
+    get_login_limiter,
+    password_matches,
+    verify_token,
+)
+from video_server.blobs import prune_blobs
+from video_server.catalog import (
+    CatalogSnapshot,
+    build_json,
+    build_links,
+    build_rss,
+    feed_state,
+    get_catalog,
+    invalidate_catalog,
+    stream_json,
+    stream_rss,
+)
+from video_server.catalog_api import DEFAULT_LIMIT, QueryError, parse_query, stream_page
+from video_server.fileserve import is_not_modified, serve_file
 from video_server.db import (
-    db_list_all_files,
     path_to_url,
     to_video_dir,
-    can_login,
-    add_bad_login,
 )
-from video_server.generate_files import (
-    init_static_files,
-    create_metadata_files,
-    async_create_metadata_files,
+from video_server.generate_files import ensure_static_files
+from video_server.generate_files import executor as generate_files_executor
+from video_server.jobs import (
+    KIND_UPLOAD,
+    KIND_URL,
+    QUEUED,
+    enqueue_job,
+    get_job,
+    job_to_dict,
+    retry_job,
+    start_job_runner,
+    stop_job_runner,
 )
 from video_server.log import log
-from video_server.models import Video
-from video_server.rss import rss
+from video_server.manifest import (
+    forget_tree,
+    list_files,
+    start_manifest_keeper,
+    stop_manifest_keeper,
+)
+from video_server.metrics import (
+    BYTES_SERVED,
+    CONTENT_TYPE_LATEST,
+    MetricsMiddleware,
+    render_metrics,
+    start_metrics_sampler,
+    stop_metrics_sampler,
+)
+from video_server.log_tail import MAX_LOG_TAIL, LogFilter, parse_level
+from video_server.log_tail import follow as follow_log
+from video_server.log_tail import tail as log_tail
+from video_server.models import IngestJob, Video
+from video_server.prefork import init_data_root
+from video_server.streaming_upload import (
+    UploadFormatError,
+    UploadRejected,
+    UploadTooLarge,
+    receive_multipart,
+    receive_raw,
+)
+from video_server.torrent import StreamHasher
+from video_server.url_ingest import UrlIngestError, compact_formats, extract_info
 from video_server.settings import (  # STUN_SERVERS,; TRACKER_ANNOUNCE_LIST,
     APP_DB,
     DATA_ROOT,
@@ -60,36 +121,29 @@ from video_server.settings import (  # STUN_SERVERS,; TRACKER_ANNOUNCE_LIST,
     FILE_PORT,
     IS_TEST,
     LOGFILE,
+    MAX_CHUNK_SIZE,
+    MAX_UPLOAD_SIZE,
     PASSWORD,
     PROJECT_ROOT,
     SERVER_PORT,
-    STARTUP_LOCK,
-    STUN_SERVERS,
-    TRACKER_ANNOUNCE_LIST,
+    SESSION_TTL,
+    UPLOAD_SESSION_TTL,
+    USE_HTTP_SERVER,
     VIDEO_ROOT,
     WEBTORRENT_CHUNK_FACTOR,
     WWW_ROOT,
-    HEIGHTS,
-    ENCODING_CRF,
     NO_CLEANUP,
     ENABLE_CLEAR,
 )
 
 from video_server.util import (
     async_download,
-    async_encode,
     async_get_image_size,
-    async_get_video_height,
-    download_file,
     get_video_url,
-    has_audio,
-    add_audio,
-    make_thumbnail,
-    ytdlp_download,
-    get_video_height,
     Cleanup,
 )
 from video_server.version import VERSION
+from video_server.view_counter import record_view, start_view_flusher, stop_view_flusher
 
 # from fastapi.responses import StreamingResponse
 # from starlette.requests import Request
@@ -102,20 +156,27 @@ class RssResponse(Response):  # pylint: disable=too-few-public-methods
     charset = "utf-8"
 
 
-@dataclass
-class VidInfo:
-    """Video info to use while processing a video."""
+log.info("Starting fastapi webtorrent movie server")
 
-    filename: str
-    audio_exists: bool
+# Created on first use, most workers never need them.
+_http_server: Optional[AsyncClient] = None
+_app_state: Optional[KeyValueSqlite] = None
 
 
-HTTP_SERVER = AsyncClient(base_url=f"http://localhost:{FILE_PORT}/")
+def get_http_server() -> AsyncClient:
+    """Returns the client for the http-server sidecar."""
+    global _http_server  # pylint: disable=global-statement
+    if _http_server is None:
+        _http_server = AsyncClient(base_url=f"http://localhost:{FILE_PORT}/")
+    return _http_server
 
-log.info("Starting fastapi webtorrent movie server")
 
-app_state = KeyValueSqlite(APP_DB, "app")
-startup_lock = FileLock(STARTUP_LOCK)
+def get_app_state() -> KeyValueSqlite:
+    """Returns the app key value store."""
+    global _app_state  # pylint: disable=global-statement
+    if _app_state is None:
+        _app_state = KeyValueSqlite(APP_DB, "app")
+    return _app_state
 
 
 def app_description() -> str:
@@ -146,8 +207,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the time includes the other middleware.
+app.add_middleware(MetricsMiddleware)
 
 STARTUP_DATETIME = datetime.datetime.now()
+# Largest page of /list_all_files.
+MAX_LIST_FILES = 10000
 
 
 def get_current_thread_id() -> int:
@@ -162,17 +227,16 @@ def is_authorized(request: Request) -> bool:
     """Check if the user is authorized."""
     if DISABLE_AUTH:
         return True
-    cookie_password = request.cookies.get("password")
-    return digest_equals(cookie_password, PASSWORD)
+    return verify_token(request.cookies.get(SESSION_COOKIE))
 
 
 def digest_equals(password, password_compare) -> bool:
-    """Compare the password."""
+    """Compare the password in constant time."""
     if password is None:
         return False
-    return (
-        hashlib.sha256(password.encode()).hexdigest()
-        == hashlib.sha256(password_compare.encode()).hexdigest()
+    return hmac.compare_digest(
+        hashlib.sha256(password.encode()).digest(),
+        hashlib.sha256(password_compare.encode()).digest(),
     )
 
 
@@ -181,20 +245,39 @@ def startup_event():
     """Event handler for when the app starts up."""
     log.info("Startup event")
     try:
-        with startup_lock.acquire(timeout=10):
-            init_static_files(WWW_ROOT)
+        # A no-op unless video_server.prefork was skipped or the player changed.
+        ensure_static_files(WWW_ROOT)
     except Timeout:
         log.error("Startup lock timeout")
 
 
+@app.on_event("startup")
+async def start_jobs_event():
+    """
+    Starts the ingest job runner, the view counter flush, the file manifest
+    keeper and the metrics sampler.
+    """
+    start_job_runner()
+    start_view_flusher()
+    start_manifest_keeper()
+    start_metrics_sampler(
+        {"default": DEFAULT_EXECUTOR, "generate_files": generate_files_executor}
+    )
+
+
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     """Event handler for when the app shuts down."""
     log.info("Application shutdown")
+    await stop_job_runner()
+    await stop_view_flusher()
+    await stop_manifest_keeper()
+    await stop_metrics_sampler()
 
 
-# Mount all the static files.
-app.mount("/www", StaticFiles(directory=WWW_ROOT, html=True), "www")
+# Mount all the static files. The videos are links into BLOB_ROOT, outside of
+# WWW_ROOT, see video_server/blobs.py.
+app.mount("/www", StaticFiles(directory=WWW_ROOT, html=True, follow_symlink=True), "www")
 
 
 @app.get("/", include_in_schema=False)
@@ -215,18 +298,26 @@ def login(password: str) -> PlainTextResponse:
     """Use the login password to get a cookie."""
     if DISABLE_AUTH:
         return PlainTextResponse("Login ok - auth disabled so any password is ok")
-    if not can_login():
+    login_limiter = get_login_limiter()
+    if not login_limiter.allowed():
         return PlainTextResponse("Too many failed login attempts. Please try again later.")
     try:
-        if not digest_equals(password, PASSWORD):
-            log.info("password %s does not match %s", password, PASSWORD)
-            add_bad_login()
+        if not password_matches(password):
+            log.info("Bad login attempt")
+            login_limiter.record_failure()
             resp = PlainTextResponse("Bad login.")
-            resp.delete_cookie(key="password")
+            resp.delete_cookie(key=SESSION_COOKIE)
             return resp
-        # Set cookie for password
+        # Set the signed session cookie, the password itself never goes into a cookie.
         resp = PlainTextResponse("Login successful", status_code=200)
-        resp.set_cookie(key="password", value=PASSWORD, httponly=True)
+        resp.set_cookie(
+            key=SESSION_COOKIE,
+            value=issue_token(),
+            max_age=SESSION_TTL,
+            httponly=True,
+            samesite="lax",
+        )
+        resp.delete_cookie(key="password")
         return resp
     except Exception as exc:
         stack_trace = traceback.format_exc()
@@ -238,8 +329,9 @@ async def api_info(request: Request) -> JSONResponse:
     """Returns the current time and the number of seconds since the server started."""
     if not is_authorized(request):
         return JSONResponse({"error": "Not Authorized"}, status_code=401)
-    app_data = app_state.to_dict()
-    links = [get_video_url(video.url) for video in Video.select()]
+    app_data = get_app_state().to_dict()
+    links_body, _ = get_catalog().body("links", build_links)
+    links = links_body.decode("utf-8").split("\n") if links_body else []
     out = {
         "version": VERSION,
         "Launched at": str(STARTUP_DATETIME),
@@ -259,47 +351,165 @@ async def api_info(request: Request) -> JSONResponse:
     return JSONResponse(out)
 
 
+def catalog_response(
+    request: Request, name: str, build: Callable[[CatalogSnapshot], bytes], media_type: str
+) -> Response:
+    """Serves a cached catalog body, or a 304 if the client has the current one."""
+    snapshot = get_catalog()
+    body, etag = snapshot.body(name, build)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request.headers, etag, snapshot.built_at):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
 @app.get("/videos")
-async def list_videos() -> PlainTextResponse:
+async def list_videos(request: Request) -> Response:
     """Reveals the videos that are available."""
-    links = [get_video_url(video.url) for video in Video.select()]
-    return PlainTextResponse(content="\n".join(links))
+    return catalog_response(request, "links", build_links, "text/plain; charset=utf-8")
 
 
 @app.put("/add_view/{id}")
 async def add_view(
     id: int,  # pylint: disable=redefined-builtin,invalid-name
 ) -> PlainTextResponse:
-    """Adds a view to the app state."""
+    """Adds a view, the count is written to the database in batches."""
     try:
-        Video.update(views=Video.views + 1).where(Video.id == id).execute()
+        record_view(id)
         return PlainTextResponse("View added")
     except Exception as exc:
         return PlainTextResponse(f"Error adding view because {exc}")
 
 
+def parse_local_time(value: str) -> datetime.datetime:
+    """
+    Parses an iso date, raises ValueError. The log and the database hold naive
+    local times, so a time with an offset is converted to one.
+    """
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def feed_response(  # pylint: disable=too-many-arguments
+    request: Request,
+    name: str,
+    media_type: str,
+    limit: Optional[int],
+    since: Optional[str],
+    build: Callable[[CatalogSnapshot], bytes],
+    stream: Callable[[Optional[int], Optional[datetime.datetime]], AsyncIterator[str]],
+) -> Response:
+    """
+    Answers conditional requests from the catalog generation and max(Video.updated)
+    alone. The full feed comes from the catalog cache, limited feeds are streamed.
+    """
+    if limit is not None and limit < 1:
+        return PlainTextResponse("error: limit must be positive", status_code=400)
+    since_date: Optional[datetime.datetime] = None
+    if since is not None:
+        try:
+            since_date = parse_local_time(since)
+        except ValueError:
+            return PlainTextResponse("error: since must be an iso date", status_code=400)
+    generation, last_updated = feed_state()
+    etag = f'"{name}-{generation}-{limit or ""}-{since or ""}"'
+    last_modified = last_updated.timestamp()
+    headers = {
+        "ETag": etag,
+        "Last-Modified": email.utils.formatdate(last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    if limit is None and since_date is None:
+        body, _ = get_catalog().body(name, build)
+        return Response(content=body, media_type=media_type, headers=headers)
+    return StreamingResponse(stream(limit, since_date), media_type=media_type, headers=headers)
+
+
 @app.get("/rss")
-async def rss_feed() -> RssResponse:
-    """Returns an RSS feed of the videos."""
-    return RssResponse(rss(channel_name="Video Channel"))
+async def rss_feed(
+    request: Request, limit: Optional[int] = None, since: Optional[str] = None
+) -> Response:
+    """Returns an RSS feed of the videos, newest first, optionally only updated since."""
+    return feed_response(
+        request, "rss", RssResponse.media_type, limit, since, build_rss, stream_rss
+    )
 
 
 @app.get("/json")
-async def json_feed() -> JSONResponse:
-    """Returns an RSS feed of the videos."""
-    out = []
-    for video in Video.select():
-        out.append(video.asjson())
-    return JSONResponse(out)
+async def json_feed(
+    request: Request, limit: Optional[int] = None, since: Optional[str] = None
+) -> Response:
+    """Returns a json feed of the videos, limited feeds are newest first."""
+    return feed_response(
+        request, "json", JSONResponse.media_type, limit, since, build_json, stream_json
+    )
+
+
+@app.get("/api/videos")
+async def api_videos(  # pylint: disable=too-many-arguments
+    sort: str = "published",
+    order: str = "desc",
+    limit: int = DEFAULT_LIMIT,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    search: Optional[str] = None,
+    min_duration: Optional[float] = None,
+    max_duration: Optional[float] = None,
+    published_after: Optional[str] = None,
+    published_before: Optional[str] = None,
+) -> Response:
+    """
+    Returns one page of videos, follow next_cursor for the next page.
+    fields is a comma separated projection, e.g. fields=title,url,views.
+    """
+    try:
+        query = parse_query(
+            sort=sort,
+            order=order,
+            limit=limit,
+            fields=fields,
+            cursor=cursor,
+            search=search,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            published_after=published_after,
+            published_before=published_before,
+        )
+    except QueryError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    return StreamingResponse(stream_page(query), media_type="application/json")
 
 
 @app.get("/list_all_files")
-def list_all_files(request: Request) -> JSONResponse:
-    """List all files in a directory."""
+def list_all_files(
+    request: Request, cursor: Optional[str] = None, limit: int = 1000
+) -> JSONResponse:
+    """
+    Lists the files under the www directory from the manifest, ordered by path.
+    Pass the next_cursor of a page as cursor to get the next page.
+    """
     if not is_authorized(request):
         return JSONResponse({"error": "Not Authorized"}, status_code=401)
-    urls = [path_to_url(file) for file in db_list_all_files()]
-    return JSONResponse(urls)
+    if limit < 1 or limit > MAX_LIST_FILES:
+        return JSONResponse(
+            {"error": f"limit must be between 1 and {MAX_LIST_FILES}"}, status_code=400
+        )
+    entries = list_files(after=cursor, limit=limit + 1)
+    next_cursor = entries[limit - 1].path if len(entries) > limit else None
+    files = [
+        {
+            "url": path_to_url(os.path.join(WWW_ROOT, entry.path)),
+            "size": entry.size,
+            "mtime": entry.mtime_ns / 1e9,
+            "sha256": entry.sha256,
+        }
+        for entry in entries[:limit]
+    ]
+    return JSONResponse({"files": files, "next_cursor": next_cursor})
 
 
 @app.post("/upload")
@@ -311,37 +521,26 @@ async def upload(  # pylint: disable=too-many-branches,too-many-arguments,too-ma
     thumbnail: UploadFile = File(None),
     subtitles_zip: Optional[UploadFile] = File(None),
     do_encode: bool = False,
-) -> PlainTextResponse:
-    """Uploads a file to the server."""
+) -> Response:
+    """Uploads a file to the server, the ingest finishes in a background job."""
     if not is_authorized(request):
         return PlainTextResponse("error: Not Authorized", status_code=401)
     log.info("Adding ffmpeg/ffprobe to path if it does not exist")
-    # TODO: Use stream files, large files exhaust the ram.
-    # This can be fixed by applying the following fix:
-    # https://github.com/tiangolo/fastapi/issues/58
+    # NOTE: fastapi spools the whole body before this runs, large files should
+    # go through /upload_stream instead.
     # check to see if the video titles exists
     if Video.select().where(Video.title == title).exists():
         return PlainTextResponse(
             content=f'Video with title "{title}" already exists', status_code=409
         )
     # Check that the upload file is valid
-    file_ext = os.path.splitext(file.filename)  # type: ignore
-    if len(file_ext) != 2:
-        return PlainTextResponse(content=f"Invalid file extension for {file}", status_code=415)
-    ext = file_ext[1].lower()
-    # Check if the file is a valid type
-    if do_encode:
-        if ext not in [".mp4", ".mkv", ".webm"]:
-            return PlainTextResponse(
-                status_code=415,
-                content=f"Invalid file type, must be mp4, mkv or webm, instead it was {ext}",
-            )
-    else:
-        if ext != ".mp4":
-            return PlainTextResponse(
-                status_code=415,
-                content=f"Invalid file type, must be mp4, instead it was {ext}",
-            )
+    bad_ext_response = check_video_ext(file.filename or "", do_encode)
+    if bad_ext_response is not None:
+        return bad_ext_response
+    if thumbnail:
+        bad_ext_response = check_thumbnail_ext(thumbnail.filename or "")
+        if bad_ext_response is not None:
+            return bad_ext_response
     log.info(f"Uploading file: {file.filename}")  # type: ignore
     video_dir = to_video_dir(title)
     try:
@@ -354,42 +553,188 @@ async def upload(  # pylint: disable=too-many-branches,too-many-arguments,too-ma
         return PlainTextResponse(
             content=f'Video with title "{title}" already exists', status_code=409
         )
-    subtitle_dir = os.path.join(video_dir, "subtitles")
-    # final_path = os.path.join(video_dir, "vid.mp4")
-    with TemporaryDirectory() as temp_dir:
-        temp_path: str = os.path.join(temp_dir, "vid.mp4")
-        await async_download(file, temp_path)
-        height = await async_get_video_height(temp_path)
-        final_path: str = os.path.join(video_dir, f"{height}.mp4")
-        shutil.move(temp_path, final_path)
-
+    # Renamed to {height}.mp4 by the ingest job once the height is known.
+    upload_path: str = os.path.join(video_dir, "upload.mp4")
+    # Hash while receiving so that the torrent doesn't need to re-read the file.
+    hasher = StreamHasher(piece_length=1 << WEBTORRENT_CHUNK_FACTOR)
+    await async_download(file, upload_path, hasher=hasher)
+    subtitles_zip_path: Optional[str] = None
     if subtitles_zip is not None:
         log.info(f"Uploading subtitles: {subtitles_zip.filename}")
-        await async_download(subtitles_zip, os.path.join(video_dir, "subtitles.zip"))
+        subtitles_zip_path = os.path.join(video_dir, "subtitles.zip")
+        await async_download(subtitles_zip, subtitles_zip_path)
+    thumbnail_path: Optional[str] = None
+    if thumbnail:
+        log.info(f"Thumbnail: {thumbnail.filename}")
+        thumbnail_path = os.path.join(video_dir, "thumbnail.jpg")
+        await async_download(thumbnail, thumbnail_path)
+    response = await finish_upload(
+        title=title,
+        description=description,
+        do_encode=do_encode,
+        video_dir=video_dir,
+        upload_path=upload_path,
+        hasher=hasher,
+        subtitles_zip_path=subtitles_zip_path,
+        thumbnail_path=thumbnail_path,
+    )
+    if response.status_code == 202:
+        cleanup.cancel()
+    return response
 
-        @asyncwrap
-        def async_unpack_subtitles():
-            shutil.unpack_archive(os.path.join(video_dir, "subtitles.zip"), subtitle_dir)
-            os.remove(os.path.join(video_dir, "subtitles.zip"))
 
-        await async_unpack_subtitles()
+@app.post("/upload_stream")
+async def upload_stream(  # pylint: disable=too-many-arguments
+    request: Request,
+    title: str,
+    description: str = "",
+    do_encode: bool = False,
+    filename: Optional[str] = None,
+) -> Response:
+    """
+    Streams an upload straight into the video directory. The body is either
+    multipart/form-data with the same file, thumbnail and subtitles_zip fields as
+    /upload, or the raw video bytes with the name passed as filename.
+    """
+    if not is_authorized(request):
+        return PlainTextResponse("error: Not Authorized", status_code=401)
+    is_multipart = request.headers.get("content-type", "").startswith("multipart/")
+    if not is_multipart:
+        if not filename:
+            return PlainTextResponse("filename is required for a raw upload", status_code=400)
+        bad_ext_response = check_video_ext(filename, do_encode)
+        if bad_ext_response is not None:
+            return bad_ext_response
+    if Video.select().where(Video.title == title).exists():
+        return PlainTextResponse(
+            content=f'Video with title "{title}" already exists', status_code=409
+        )
+    video_dir = to_video_dir(title)
+    try:
+        os.makedirs(video_dir)
+        # pylint: disable-next=unused-variable
+        cleanup = Cleanup(cleanup_fcn=lambda: shutil.rmtree(video_dir))
+        if NO_CLEANUP:
+            cleanup.cancel()
+    except FileExistsError:
+        return PlainTextResponse(
+            content=f'Video with title "{title}" already exists', status_code=409
+        )
+    upload_path = os.path.join(video_dir, "upload.mp4")
+    subtitles_zip_path: Optional[str] = os.path.join(video_dir, "subtitles.zip")
+    thumbnail_path: Optional[str] = os.path.join(video_dir, "thumbnail.jpg")
+    hasher = StreamHasher(piece_length=1 << WEBTORRENT_CHUNK_FACTOR)
+
+    def check_part(field_name: str, filename: str) -> None:
+        bad_ext_response = None
+        if field_name == "file":
+            bad_ext_response = check_video_ext(filename, do_encode)
+        elif field_name == "thumbnail":
+            bad_ext_response = check_thumbnail_ext(filename)
+        if bad_ext_response is not None:
+            raise UploadRejected(bad_ext_response)
 
-    out_thumbnail = os.path.join(video_dir, "thumbnail.jpg")
-    if thumbnail:
-        log.info(f"Thumbnail: {thumbnail.filename}")
-        thumbnail_name_ext = os.path.splitext(thumbnail.filename)
-        if len(thumbnail_name_ext) != 2:
+    try:
+        if is_multipart:
+            received = await receive_multipart(
+                request,
+                destinations={
+                    "file": upload_path,
+                    "subtitles_zip": subtitles_zip_path,  # type: ignore
+                    "thumbnail": thumbnail_path,  # type: ignore
+                },
+                max_size=MAX_UPLOAD_SIZE,
+                hasher=hasher,
+                check_part=check_part,
+            )
+            if "file" not in received:
+                return PlainTextResponse("Missing the file field", status_code=400)
+            if "subtitles_zip" not in received:
+                subtitles_zip_path = None
+            if "thumbnail" not in received:
+                thumbnail_path = None
+        else:
+            await receive_raw(request, upload_path, max_size=MAX_UPLOAD_SIZE, hasher=hasher)
+            subtitles_zip_path = None
+            thumbnail_path = None
+    except UploadTooLarge as exc:
+        return PlainTextResponse(f"{exc}", status_code=413)
+    except UploadFormatError as exc:
+        return PlainTextResponse(f"{exc}", status_code=400)
+    except UploadRejected as exc:
+        return exc.response
+    response = await finish_upload(
+        title=title,
+        description=description,
+        do_encode=do_encode,
+        video_dir=video_dir,
+        upload_path=upload_path,
+        hasher=hasher,
+        subtitles_zip_path=subtitles_zip_path,
+        thumbnail_path=thumbnail_path,
+    )
+    if response.status_code == 202:
+        cleanup.cancel()
+    return response
+
+
+def check_video_ext(filename: str, do_encode: bool) -> Optional[PlainTextResponse]:
+    """Returns an error response if the video file type is not accepted."""
+    ext = os.path.splitext(filename)[1].lower()
+    # Check if the file is a valid type
+    if do_encode:
+        if ext not in [".mp4", ".mkv", ".webm"]:
             return PlainTextResponse(
-                content=f"Invalid file extension for {thumbnail}", status_code=415
+                status_code=415,
+                content=f"Invalid file type, must be mp4, mkv or webm, instead it was {ext}",
             )
-        thumbnail_ext = thumbnail_name_ext[1].lower()
-        if thumbnail_ext != ".jpg":
+    else:
+        if ext != ".mp4":
             return PlainTextResponse(
                 status_code=415,
-                content=f"Invalid thumbnail type, must be .jpg, instead it was {thumbnail_ext}",
+                content=f"Invalid file type, must be mp4, instead it was {ext}",
             )
-        await async_download(thumbnail, out_thumbnail)
-        thumbnail_width, thumbnail_height = await async_get_image_size(out_thumbnail)
+    return None
+
+
+def check_thumbnail_ext(filename: str) -> Optional[PlainTextResponse]:
+    """Returns an error response if the thumbnail file type is not accepted."""
+    thumbnail_ext = os.path.splitext(filename)[1].lower()
+    if thumbnail_ext != ".jpg":
+        return PlainTextResponse(
+            status_code=415,
+            content=f"Invalid thumbnail type, must be .jpg, instead it was {thumbnail_ext}",
+        )
+    return None
+
+
+async def finish_upload(  # pylint: disable=too-many-arguments
+    title: str,
+    description: str,
+    do_encode: bool,
+    video_dir: str,
+    upload_path: str,
+    hasher: Optional[StreamHasher],
+    subtitles_zip_path: Optional[str],
+    thumbnail_path: Optional[str],
+) -> Response:
+    """Unpacks the subtitles, checks the thumbnail and queues the ingest job."""
+    params = {"source": upload_path, "description": description, "do_encode": do_encode}
+    if hasher is not None:
+        hasher.save_pieces(upload_path)
+        params["content_digest"] = hasher.content_digest()
+    if subtitles_zip_path is not None:
+        subtitle_dir = os.path.join(video_dir, "subtitles")
+
+        @asyncwrap
+        def async_unpack_subtitles():
+            shutil.unpack_archive(subtitles_zip_path, subtitle_dir)
+            os.remove(subtitles_zip_path)
+
+        await async_unpack_subtitles()
+
+    if thumbnail_path is not None:
+        thumbnail_width, thumbnail_height = await async_get_image_size(thumbnail_path)
         if thumbnail_width > 1280 or thumbnail_height > 720:
             return PlainTextResponse(
                 status_code=415,
@@ -398,61 +743,154 @@ async def upload(  # pylint: disable=too-many-branches,too-many-arguments,too-ma
                     f"{thumbnail_width}x{thumbnail_height}"
                 ),
             )
-    else:
-        try:
-            await make_thumbnail(vidpath=final_path, out_thumbnail=out_thumbnail)
-        except ValueError as exc:
-            return PlainTextResponse(
-                status_code=415,
-                content=f"Error making thumbnail: {exc}",
-            )
 
-    relpath = os.path.relpath(final_path, WWW_ROOT)
-    url = path_to_url(os.path.dirname(relpath))
-    vid_id = Video.create(
-        title=title, url=url, description=description, path=final_path, iframe=url
-    ).id
-    native_size = await async_get_video_height(final_path)
-    vidfiles: list[str] = []
-    vidfiles.append(final_path)
-    if do_encode:
-        base_path = os.path.dirname(final_path)
-        for height in HEIGHTS:
-            if native_size != height and height < native_size:
-                outpath = os.path.join(base_path, f"{height}.mp4")
-                vidfiles.append(outpath)
-                await async_encode(
-                    videopath=final_path,
-                    crf=ENCODING_CRF,
-                    height=height,
-                    outpath=outpath,
-                )
-    await async_create_metadata_files(
-        vid_id=vid_id,
-        vid_title=title,
-        vidfiles=vidfiles,
-        domain_name=DOMAIN_NAME,
-        tracker_announce_list=TRACKER_ANNOUNCE_LIST,
-        stun_servers=STUN_SERVERS,
-        out_dir=video_dir,
-        chunk_factor=WEBTORRENT_CHUNK_FACTOR,
+    # Probing, thumbnailing, encoding and torrent generation happen in the background.
+    job_id = enqueue_job(title=title, kind=KIND_UPLOAD, video_dir=video_dir, params=params)
+    return job_accepted_response(job_id, video_dir)
+
+
+@app.post("/uploads")
+async def create_chunked_upload(  # pylint: disable=too-many-arguments
+    request: Request,
+    title: str,
+    filename: str,
+    size: int,
+    chunk_size: int = 8 * 1024 * 1024,
+    description: str = "",
+    do_encode: bool = False,
+) -> Response:
+    """
+    Starts a resumable upload. PUT the chunks to /uploads/{id}/chunks/{index} in
+    any order, GET /uploads/{id} for the missing ranges, then POST
+    /uploads/{id}/finalize.
+    """
+    if not is_authorized(request):
+        return PlainTextResponse("error: Not Authorized", status_code=401)
+    bad_ext_response = check_video_ext(filename, do_encode)
+    if bad_ext_response is not None:
+        return bad_ext_response
+    if size <= 0:
+        return PlainTextResponse("size must be positive", status_code=400)
+    if size > MAX_UPLOAD_SIZE:
+        return PlainTextResponse(f"size must be at most {MAX_UPLOAD_SIZE}", status_code=413)
+    if chunk_size <= 0 or chunk_size > MAX_CHUNK_SIZE:
+        return PlainTextResponse(
+            f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}", status_code=400
+        )
+    if Video.select().where(Video.title == title).exists() or os.path.exists(
+        to_video_dir(title)
+    ):
+        return PlainTextResponse(
+            content=f'Video with title "{title}" already exists', status_code=409
+        )
+    num_expired = await asyncio.to_thread(expire_sessions, UPLOAD_SESSION_TTL)
+    if num_expired:
+        log.info(f"Deleted {num_expired} abandoned upload sessions")
+    session = create_session(title, filename, size, chunk_size, description, do_encode)
+    log.info(f"Created upload session {session.id} for {title}")
+    return JSONResponse(session_status(session), status_code=201)
+
+
+@app.get("/uploads/{session_id}")
+async def chunked_upload_status(request: Request, session_id: str) -> JSONResponse:
+    """Returns the missing chunks of a resumable upload."""
+    if not is_authorized(request):
+        return JSONResponse({"error": "Not Authorized"}, status_code=401)
+    session = load_session(session_id)
+    if session is None:
+        return JSONResponse({"error": f"No upload {session_id}"}, status_code=404)
+    return JSONResponse(session_status(session))
+
+
+@app.put("/uploads/{session_id}/chunks/{chunk_index}")
+async def put_chunk(request: Request, session_id: str, chunk_index: int) -> JSONResponse:
+    """Writes one chunk of a resumable upload, chunks can be sent in parallel."""
+    if not is_authorized(request):
+        return JSONResponse({"error": "Not Authorized"}, status_code=401)
+    session = load_session(session_id)
+    if session is None:
+        return JSONResponse({"error": f"No upload {session_id}"}, status_code=404)
+    try:
+        await write_chunk(session, chunk_index, request.stream())
+    except ChunkError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    return JSONResponse({"id": session_id, "index": chunk_index, "received": True})
+
+
+@app.post("/uploads/{session_id}/finalize")
+async def finalize_chunked_upload(request: Request, session_id: str) -> Response:
+    """Assembles a complete resumable upload and queues its ingest job."""
+    if not is_authorized(request):
+        return PlainTextResponse("error: Not Authorized", status_code=401)
+    session = load_session(session_id)
+    if session is None:
+        return PlainTextResponse(f"No upload {session_id}", status_code=404)
+    if missing_chunks(session):
+        return JSONResponse(session_status(session), status_code=409)
+    video_dir = to_video_dir(session.title)
+    try:
+        os.makedirs(video_dir)
+        # pylint: disable-next=unused-variable
+        cleanup = Cleanup(cleanup_fcn=lambda: shutil.rmtree(video_dir))
+        if NO_CLEANUP:
+            cleanup.cancel()
+    except FileExistsError:
+        return PlainTextResponse(
+            content=f'Video with title "{session.title}" already exists', status_code=409
+        )
+    upload_path = os.path.join(video_dir, "upload.mp4")
+    await asyncio.to_thread(finalize_session, session, upload_path)
+    response = await finish_upload(
+        title=session.title,
+        description=session.description,
+        do_encode=session.do_encode,
+        video_dir=video_dir,
+        upload_path=upload_path,
+        hasher=None,
+        subtitles_zip_path=None,
+        thumbnail_path=None,
+    )
+    if response.status_code == 202:
+        cleanup.cancel()
+    return response
+
+
+@app.delete("/uploads/{session_id}")
+async def abort_chunked_upload(request: Request, session_id: str) -> PlainTextResponse:
+    """Aborts a resumable upload."""
+    if not is_authorized(request):
+        return PlainTextResponse("error: Not Authorized", status_code=401)
+    if load_session(session_id) is None:
+        return PlainTextResponse(f"No upload {session_id}", status_code=404)
+    await asyncio.to_thread(delete_session, session_id)
+    return PlainTextResponse("Upload aborted")
+
+
+def job_accepted_response(job_id: int, video_dir: str) -> JSONResponse:
+    """Returns the 202 response for a queued ingest job."""
+    url = path_to_url(os.path.relpath(video_dir, WWW_ROOT))
+    return JSONResponse(
+        {
+            "job_id": job_id,
+            "state": QUEUED,
+            "status_url": f"/jobs/{job_id}",
+            "url": get_video_url(url),
+        },
+        status_code=202,
     )
-    cleanup.cancel()
-    return PlainTextResponse(f"Created video at {get_video_url(url)}")
 
 
 @app.post("/upload_url")
-def upload_url(  # pylint: disable=too-many-statements
-    request: Request, url: str
-) -> PlainTextResponse:
-    """Uploads a file to the server."""
+async def upload_url(request: Request, url: str) -> Response:
+    """Queues the download of a video url, the download runs as a background job."""
     if not is_authorized(request):
         return PlainTextResponse("error: Not Authorized", status_code=401)
-    cmd = f"yt-dlp {url} -J"
-    log.info(f"Running command:\n  {cmd}")
-    stdout = subprocess.check_output(cmd, shell=True, universal_newlines=True)
-    info = json.loads(stdout)
-    formats = info.get("formats")
+    try:
+        info = await extract_info(url)
+    except UrlIngestError as exc:
+        log.error(f"{exc}")
+        return PlainTextResponse(f"Can't download video - {exc}", status_code=406)
+    formats = compact_formats(info)
     title = info.get("title")
     thumbnail = info.get("thumbnail")
     has_drm = info.get("__has_drm")
@@ -464,9 +902,14 @@ def upload_url(  # pylint: disable=too-many-statements
         return PlainTextResponse("Can't download video - No thumbnail found", status_code=406)
     if has_drm:
         return PlainTextResponse("Can't download video - DRM protected", status_code=406)
+    if not [fmt for fmt in formats if "mp4" in (fmt["ext"] or "")]:
+        return PlainTextResponse(
+            "Can't download video - No suitable formats found", status_code=501
+        )
     video_dir = to_video_dir(title)
     try:
         os.makedirs(video_dir)
+        # pylint: disable-next=unused-variable
         cleanup = Cleanup(cleanup_fcn=lambda: shutil.rmtree(video_dir))
         if NO_CLEANUP:
             cleanup.cancel()
@@ -474,148 +917,54 @@ def upload_url(  # pylint: disable=too-many-statements
         return PlainTextResponse(
             f"error: Video with title '{title}' already exists", status_code=409
         )
-    # Gather the mp4 format videos
-    vidinfos: list[list] = []
-    audiotracks: list[list] = []
-    downloaded_videos: dict[int, str] = {}
-    for fmts in formats:
-        ext = fmts.get("ext", "")
-        if "mp4" in ext:
-            height = fmts.get("height")  # This key exists and maps to None on bitchute
-            key = height or -1
-            tmp_id: str | None = fmts.get("format_id")
-            vidinfos.append([key, tmp_id])
-        elif "m4a" in ext:
-            m4a_key: str = str(fmts.get("abr", 0))
-            m4a_tmp_id: str | None = fmts.get("format_id")
-            if m4a_key and m4a_tmp_id:
-                item: list[str, str] = [m4a_key, m4a_tmp_id]  # type: ignore
-                audiotracks.append(item)
-    downloaded_files: list[VidInfo] = []
-    cleanup_files: list[str] = []
-
-    def cleanup_fcn() -> None:
-        for f in cleanup_files:
-            os.remove(f)
-
-    mandatory_cleanup = Cleanup(  # noqa: F841 # pylint: disable=unused-variable
-        cleanup_fcn=cleanup_fcn
-    )
-    for i, (key, tmp_id) in enumerate(vidinfos):
-        if key == -1:
-            log.warning(
-                "No height found for video, downloading temporary video and querying height"
-            )
-            # make a random name for the video
-            tmp_video_file = os.path.join(video_dir, f"{random.randint(0, 10000000000)}.mp4")
-            # Fallback behavior downloads the best video and audio and merges them, if necessary.
-            cmd = f'yt-dlp -f "bv*[ext=mp4]+ba/b" {url} -o {tmp_video_file}'
-            log.info("Running command:\n  %s", cmd)
-            stdout = subprocess.check_output(cmd, shell=True, universal_newlines=True)
-            log.info("Command output:\n  %s", stdout)
-            cleanup_files.append(tmp_video_file)
-            height = get_video_height(tmp_video_file)
-            vidinfos[i][0] = height  # Replace the video info with the temp file.
-            downloaded_videos[height] = tmp_video_file
-    # sort so that the largest is first
-    vidinfos.sort(key=lambda x: x[0])
-    sizemap: dict[int, str | None] = {key: None for key in HEIGHTS}
-    # Match the resolutions to the videos, rounding up when
-    # necessary.
-    sorted_heights = list(HEIGHTS)
-    sorted_heights.sort(reverse=True)
-    for key in sorted_heights:
-        for i, resolution in enumerate(vidinfos):
-            if resolution[0] >= key:
-                vid_data = vidinfos[i][1]
-                if vid_data in sizemap.values():
-                    continue
-                sizemap[key] = vid_data
-                break
-    if not [x for x in sizemap.values() if x]:
-        return PlainTextResponse(
-            "Can't download video - No suitable formats found", status_code=501
-        )
-    # Download videos and store their paths in the downloaded_files.
-    for resolution in sizemap.keys():  # type: ignore
-        id = sizemap[resolution]  # type: ignore
-        if id is not None:
-            filename = os.path.join(video_dir, f"{resolution}.mp4")
-            if resolution in downloaded_videos:
-                res: str = downloaded_videos[resolution]  # type: ignore
-                shutil.copy(res, filename)
-            else:
-                ytdlp_download(url, id, filename)
-            audio_exists = has_audio(filename)
-            log.info(stdout)
-            downloaded_files.append(VidInfo(filename=filename, audio_exists=audio_exists))
-            log.info(f"Downloaded {filename}")
-    all_videos_have_audio = True
-    for vidinfo in downloaded_files:
-        if not vidinfo.audio_exists:
-            all_videos_have_audio = False
-            break
-    if not all_videos_have_audio:
-        log.warning("Some videos don't have audio.")
-        # Download audio tracks and store their paths in the downloaded_files.
-        if not audiotracks:
-            log.warning("No audio tracks found.")
-        else:
-            id = audiotracks[0][1]
-            with TemporaryDirectory() as tmpdir:
-                tmpfile = os.path.join(tmpdir, "audio.m4a")
-                ytdlp_download(url, id, tmpfile)  # type: ignore
-                for vidinfo in downloaded_files:
-                    if not vidinfo.audio_exists:
-                        vidinfo.audio_exists = True
-                        add_audio(audiopath=tmpfile, videopath=vidinfo.filename)
-            ytdlp_download(url, id, tmpfile)  # type: ignore
-            for vidinfo in downloaded_files:
-                if not vidinfo.audio_exists:
-                    vidinfo.audio_exists = True
-                    add_audio(audiopath=tmpfile, videopath=vidinfo.filename)
-            log.info(f"Downloaded {filename}")
-    log.info(f"Done downloading: {url}")
-    subtitle_dir = os.path.join(  # noqa: F841  # pylint: disable=unused-variable
-        video_dir, "subtitles"
-    )
-    final_path = os.path.join(video_dir, "vid.mp4")
-    relpath = os.path.relpath(final_path, WWW_ROOT)
-    url = path_to_url(os.path.dirname(relpath))
-    thumbnail_ext = os.path.splitext(thumbnail)[1]
-    with TemporaryDirectory() as tmpdir:
-        tmpfile = os.path.join(tmpdir, f"thumbnail{thumbnail_ext}")
-        download_file(thumbnail, tmpfile)
-        if thumbnail_ext != ".jpg":
-            # convert to jpg
-            img = Image.open(tmpfile)
-            img.save(os.path.join(tmpdir, "thumbnail.jpg"), "JPEG")
-            shutil.copy(
-                os.path.join(tmpdir, "thumbnail.jpg"), os.path.join(video_dir, "thumbnail.jpg")
-            )
-        else:
-            shutil.copy(tmpfile, os.path.join(video_dir, "thumbnail.jpg"))
-
-    vid_id = Video.create(
+    job_id = enqueue_job(
         title=title,
-        url=url,
-        description="TODO - Implement description scraping",
-        path=final_path,
-        iframe=url,
-    ).id
-    videofiles = [vidinfo.filename for vidinfo in downloaded_files]
-    create_metadata_files(
-        vid_id=vid_id,
-        vid_title=title,
-        vidfiles=videofiles,
-        domain_name=DOMAIN_NAME,
-        tracker_announce_list=TRACKER_ANNOUNCE_LIST,
-        stun_servers=STUN_SERVERS,
-        out_dir=video_dir,
-        chunk_factor=WEBTORRENT_CHUNK_FACTOR,
+        kind=KIND_URL,
+        video_dir=video_dir,
+        params={
+            "url": url,
+            # The runner may be another worker, this spares it extracting the url again.
+            "info": info,
+            "formats": formats,
+            "thumbnail": thumbnail,
+            "path": os.path.join(video_dir, "vid.mp4"),
+            "description": "TODO - Implement description scraping",
+        },
     )
     cleanup.cancel()
-    return PlainTextResponse(f"Created video at {get_video_url(url)}")
+    return job_accepted_response(job_id, video_dir)
+
+
+@app.get("/jobs")
+async def list_jobs(request: Request, limit: int = 100) -> JSONResponse:
+    """Lists the most recent ingest jobs."""
+    if not is_authorized(request):
+        return JSONResponse({"error": "Not Authorized"}, status_code=401)
+    jobs = IngestJob.select().order_by(IngestJob.id.desc()).limit(limit)
+    return JSONResponse([job_to_dict(job) for job in jobs])
+
+
+@app.get("/jobs/{id}")
+async def job_status(request: Request, id: int) -> JSONResponse:
+    """Returns the state of an ingest job."""
+    if not is_authorized(request):
+        return JSONResponse({"error": "Not Authorized"}, status_code=401)
+    job = get_job(id)
+    if job is None:
+        return JSONResponse({"error": f"Job {id} does not exist"}, status_code=404)
+    return JSONResponse(job_to_dict(job))
+
+
+@app.post("/jobs/{id}/retry")
+async def job_retry(request: Request, id: int) -> JSONResponse:
+    """Requeues a failed ingest job."""
+    if not is_authorized(request):
+        return JSONResponse({"error": "Not Authorized"}, status_code=401)
+    if not retry_job(id):
+        return JSONResponse({"error": f"Job {id} is not in the failed state"}, status_code=409)
+    job = get_job(id)
+    assert job is not None
+    return JSONResponse(job_to_dict(job))
 
 
 @app.delete("/delete")
@@ -640,22 +989,81 @@ async def delete(password: str, title: str, background_tasks: BackgroundTasks) -
                 time.sleep(retry)
         else:
             log.error(f"Failed to delete {vid_dir} after {max_tries} tries.")
+        num_pruned = prune_blobs()
+        if num_pruned:
+            log.info(f"Removed {num_pruned} blobs that no title links to")
 
     if not Video.select().where(Video.title == title).exists():
         return PlainTextResponse(f"error: {title} does not exist", status_code=404)
     Video.delete().where(Video.title == title).execute()
+    invalidate_catalog()
+    forget_tree(vid_dir)
     background_tasks.add_task(delete_files_task)
     return PlainTextResponse(content="Deleted ok")
 
 
 @app.get("/log")
-async def log_file(request: Request):
-    """Returns the log file."""
+async def log_file(  # pylint: disable=too-many-arguments
+    request: Request,
+    tail: int = 1000,
+    level: Optional[str] = None,
+    since: Optional[str] = None,
+    grep: Optional[str] = None,
+    follow: bool = False,
+):
+    """
+    Returns the last tail lines of the log file that match the level (minimum),
+    since (iso time) and grep (substring) filters. With follow=1 the lines are
+    sent as server-sent events, followed by new lines as they are written.
+    """
     # authorize
     if not is_authorized(request):
         return JSONResponse({"error": "Not Authorized"}, status_code=401)
-    logfile = open(LOGFILE, encoding="utf-8", mode="r")  # pylint: disable=consider-using-with
-    return StreamingResponse(logfile, media_type="text/plain")
+    if tail < 0 or tail > MAX_LOG_TAIL:
+        return PlainTextResponse(f"error: tail must be 0-{MAX_LOG_TAIL}", status_code=400)
+    try:
+        log_filter = LogFilter(
+            level=parse_level(level) if level else None,
+            since=parse_local_time(since) if since else None,
+            grep=grep,
+        )
+    except ValueError as exc:
+        return PlainTextResponse(f"error: {exc}", status_code=400)
+    lines = await asyncio.to_thread(log_tail, LOGFILE, tail, log_filter)
+    if not follow:
+        return PlainTextResponse("".join(f"{line}\n" for line in lines))
+
+    async def events() -> AsyncIterator[str]:
+        for line in lines:
+            yield f"data: {line}\n\n"
+        async for line in follow_log(LOGFILE, log_filter):
+            if await request.is_disconnected():
+                break
+            yield f"data: {line}\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request) -> Response:
+    """
+    Prometheus metrics summed over all the workers. Scrapers authenticate with
+    an Authorization: Bearer <password> header instead of the session cookie.
+    """
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    bearer_ok = scheme.lower() == "bearer" and password_matches(credentials.strip())
+    if not bearer_ok and not is_authorized(request):
+        return JSONResponse({"error": "Not Authorized"}, status_code=401)
+    data = await asyncio.to_thread(render_metrics)
+    return Response(data, media_type=CONTENT_TYPE_LATEST)
+
+
+async def _count_proxied(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        BYTES_SERVED.labels("proxy").inc(len(chunk))
+        yield chunk
 
 
 if ENABLE_CLEAR:
@@ -666,38 +1074,57 @@ if ENABLE_CLEAR:
         if not DISABLE_AUTH and not digest_equals(password, PASSWORD):
             return PlainTextResponse("error: Not Authorized", status_code=401)
         Video.delete().execute()  # pylint: disable=no-value-for-parameter
+        IngestJob.delete().execute()  # pylint: disable=no-value-for-parameter
+        invalidate_catalog()
         await asyncio.to_thread(lambda: shutil.rmtree(VIDEO_ROOT, ignore_errors=True))
         os.makedirs(VIDEO_ROOT, exist_ok=True)
+        forget_tree(VIDEO_ROOT)
+        # No title links to anything anymore, so every blob goes regardless of age.
+        num_pruned = await asyncio.to_thread(prune_blobs, min_age=0)
+        log.info(f"Cleared the videos and pruned {num_pruned} blobs")
         return PlainTextResponse(content="Clear ok")
 
 
 async def _reverse_proxy(request: Request):
+    if not USE_HTTP_SERVER:
+        return await serve_file(request, WWW_ROOT)
     url = httpx.URL(path=request.url.path, port=FILE_PORT, query=request.url.query.encode("utf-8"))
-    rp_req = HTTP_SERVER.build_request(
+    http_server = get_http_server()
+    rp_req = http_server.build_request(
         request.method, url, headers=request.headers.raw, content=await request.body()
     )
-    rp_resp = await HTTP_SERVER.send(rp_req, stream=True)
+    rp_resp = await http_server.send(rp_req, stream=True)
+    headers = dict(rp_resp.headers)
+    if is_fingerprinted(request.url.path) and rp_resp.status_code in (200, 206, 304):
+        headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
     return StreamingResponse(
-        rp_resp.aiter_raw(),
+        _count_proxied(rp_resp.aiter_raw()),
         status_code=rp_resp.status_code,
-        headers=rp_resp.headers,
+        headers=headers,
         background=BackgroundTask(rp_resp.aclose),
     )
 
 
-# All the routes that aren't covered by app are forwareded to the
-# http web server.
-app.add_route("/{path:path}", _reverse_proxy, ["GET", "POST"])
+# All the routes that aren't covered by app are served from WWW_ROOT, either
+# in process or by forwarding to the http web server.
+app.add_route("/{path:path}", _reverse_proxy, ["GET", "HEAD", "POST"])
 
 
 def main():
     """Starts the server."""
     import webbrowser  # pylint: disable=import-outside-toplevel
 
+    init_data_root()
+
     webbrowser.open(f"http://localhost:{SERVER_PORT}")
-    cmd = f"http-server {DATA_ROOT}/www -p {FILE_PORT} --cors=* -c-1"
+    # The app is already imported, uvicorn's logging config would close the log file.
+    if not USE_HTTP_SERVER:
+        uvicorn.run(app, host="0.0.0.0", port=SERVER_PORT, log_config=None)
+        return
+    # --gzip and --brotli serve the precompressed variants of the player assets.
+    cmd = f"http-server {DATA_ROOT}/www -p {FILE_PORT} --cors=* -c-1 --gzip --brotli"
     with subprocess.Popen(cmd, shell=True):
-        uvicorn.run(app, host="0.0.0.0", port=SERVER_PORT)
+        uvicorn.run(app, host="0.0.0.0", port=SERVER_PORT, log_config=None)
 
 
 if __name__ == "__main__":
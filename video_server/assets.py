@@ -0,0 +1,121 @@
+"""
+Fingerprinted and precompressed copies of the player assets.
+
+The static sync writes every player script, stylesheet and icon a second time
+as name.<hash>.ext and rewrites the player pages to load those names. The
+content behind a fingerprinted url never changes, so it is served with
+Cache-Control: immutable and repeat viewers download nothing. Text files also
+get .gz and .br variants next to them, which the file server picks from
+Accept-Encoding, so nothing is compressed per request.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from typing import Optional
+
+FINGERPRINT_EXTS = {".js", ".css", ".svg"}
+COMPRESS_EXTS = {".js", ".css", ".svg", ".html"}
+# Smaller files don't get shorter by compressing them.
+MIN_COMPRESS_SIZE = 512
+HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Variants in order of preference, (content-encoding, suffix).
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+_FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{%d}\.[A-Za-z0-9]+$" % HASH_LENGTH)
+_REFERENCE_RE = re.compile(r'(\b(?:src|href)=")([^"#?:]+)(")')
+
+
+def fingerprinted_name(rel_path: str, data: bytes) -> str:
+    """Returns rel_path with the hash of data before the extension."""
+    stem, ext = os.path.splitext(rel_path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def is_fingerprinted(path: str) -> bool:
+    """True if the file or url path is a fingerprinted name."""
+    return _FINGERPRINT_RE.search(path) is not None
+
+
+def _brotli_compress(data: bytes) -> Optional[bytes]:
+    try:
+        import brotli  # type: ignore  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None  # Optional, only gzip variants are written without it.
+    return brotli.compress(data, quality=11)
+
+
+def write_file(path: str, data: bytes) -> bool:
+    """Writes data to path along with its compressed variants, unless it's already there."""
+    try:
+        with open(path, mode="rb") as filed:
+            if filed.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, data)
+    write_variants(path, data)
+    return True
+
+
+def write_variants(path: str, data: bytes) -> None:
+    """Writes the .gz and .br variants of a text file, removes them for other files."""
+    compress = os.path.splitext(path)[1] in COMPRESS_EXTS and len(data) >= MIN_COMPRESS_SIZE
+    variants = {
+        ".gz": gzip.compress(data, compresslevel=9, mtime=0) if compress else None,
+        ".br": _brotli_compress(data) if compress else None,
+    }
+    for suffix, compressed in variants.items():
+        if compressed is not None and len(compressed) < len(data):
+            _write_atomic(path + suffix, compressed)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode="wb") as filed:
+        filed.write(data)
+    os.replace(tmp_path, path)
+
+
+def rewrite_references(html: str, page_dir: str, names: dict[str, str]) -> str:
+    """
+    Points the relative src and href attributes of a page at the fingerprinted
+    names. page_dir and the keys and values of names are relative to the player.
+    """
+
+    def replace(match: re.Match) -> str:
+        target = os.path.normpath(os.path.join(page_dir, match.group(2))).replace("\\", "/")
+        if target not in names:
+            return match.group(0)
+        new_ref = os.path.relpath(names[target], page_dir or ".").replace("\\", "/")
+        return f"{match.group(1)}{new_ref}{match.group(3)}"
+
+    return _REFERENCE_RE.sub(replace, html)
+
+
+def find_variant(path: str, accept_encoding: str) -> Optional[tuple[str, str]]:
+    """Returns (content-encoding, path) of the best precompressed variant the client accepts."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding, suffix in ENCODINGS:
+        if (encoding in accepted or "*" in accepted) and os.path.exists(path + suffix):
+            return encoding, path + suffix
+    return None
+
+
+def has_variants(path: str) -> bool:
+    """
+    True if the response for path depends on Accept-Encoding. Only the types in
+    COMPRESS_EXTS get variants, so videos are answered without looking for them.
+    """
+    if os.path.splitext(path)[1] not in COMPRESS_EXTS:
+        return False
+    return any(os.path.exists(path + suffix) for _, suffix in ENCODINGS)
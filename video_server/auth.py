@@ -0,0 +1,159 @@
+"""
+Signed session tokens and the login rate limiter.
+
+/login hands out "{expires}.{nonce}.{signature}" tokens signed with an HMAC key
+that is derived once per process from PASSWORD and a random secret kept in
+DATA_ROOT, so checking a request costs one HMAC and no database round trip.
+Changing PASSWORD or deleting the secret file invalidates all sessions.
+
+Failed logins go into a ring buffer of the last MAX_BAD_LOGINS failure times in
+a memory mapped file that all the workers share. Logins are refused while the
+oldest of those failures is still inside the MAX_BAD_LOGINS_RESET_TIME window.
+"""
+
+import base64
+import hashlib
+import hmac
+import mmap
+import os
+import secrets
+import struct
+import threading
+import time
+from typing import Optional
+
+from filelock import FileLock
+
+from video_server.settings import (
+    DATA_ROOT,
+    MAX_BAD_LOGINS,
+    MAX_BAD_LOGINS_RESET_TIME,
+    PASSWORD,
+    SESSION_TTL,
+)
+
+SESSION_COOKIE = "session"
+SECRET_PATH = os.path.join(DATA_ROOT, "session_secret")
+LIMITER_PATH = os.path.join(DATA_ROOT, "login_limiter")
+_LIMITER_HEADER = struct.Struct("<Q")  # index of the oldest failure
+_LIMITER_SLOT = struct.Struct("<d")  # failure time
+# Both are created on first use so that importing this module does no io.
+_key: Optional[bytes] = None  # pylint: disable=invalid-name
+_login_limiter: Optional["LoginLimiter"] = None  # pylint: disable=invalid-name
+_lazy_lock = threading.Lock()
+
+
+def _load_secret() -> bytes:
+    """Reads the shared secret, the first worker to start creates it."""
+    if not os.path.exists(SECRET_PATH):
+        tmp_path = f"{SECRET_PATH}.{os.getpid()}"
+        with open(tmp_path, mode="wb") as filed:
+            filed.write(secrets.token_bytes(32))
+        os.chmod(tmp_path, 0o600)
+        try:
+            # Linking is atomic, so the other workers never read a partial secret.
+            os.link(tmp_path, SECRET_PATH)
+        except FileExistsError:
+            pass  # Another worker won the race, use its secret.
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_PATH, mode="rb") as filed:
+        return filed.read()
+
+
+def _get_key() -> bytes:
+    global _key  # pylint: disable=global-statement
+    with _lazy_lock:
+        if _key is None:
+            _key = hmac.new(_load_secret(), PASSWORD.encode("utf-8"), hashlib.sha256).digest()
+        return _key
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(_get_key(), payload.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def issue_token(ttl: float = SESSION_TTL) -> str:
+    """Returns a new signed session token."""
+    payload = f"{int(time.time() + ttl)}.{secrets.token_urlsafe(12)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: Optional[str]) -> bool:
+    """True if the token was signed by us and has not expired."""
+    if not token:
+        return False
+    payload, _, signature = token.rpartition(".")
+    expires, _, _ = payload.partition(".")
+    # Bytes, compare_digest refuses str with non-ascii characters.
+    if not hmac.compare_digest(_sign(payload).encode("utf-8"), signature.encode("utf-8")):
+        return False
+    try:
+        return int(expires) > time.time()
+    except ValueError:
+        return False
+
+
+def password_matches(password: Optional[str]) -> bool:
+    """Constant time comparison against PASSWORD."""
+    if password is None:
+        return False
+    return hmac.compare_digest(password.encode("utf-8"), PASSWORD.encode("utf-8"))
+
+
+class LoginLimiter:
+    """Sliding window of the last max_failures failed logins, shared through an mmap."""
+
+    def __init__(self, path: str, max_failures: int, window: float) -> None:
+        self.max_failures = max_failures
+        self.window = window
+        self.lock = FileLock(path + ".lock")
+        size = _LIMITER_HEADER.size + _LIMITER_SLOT.size * max_failures
+        with self.lock:
+            with open(path, mode="a+b") as filed:
+                if os.fstat(filed.fileno()).st_size != size:
+                    filed.truncate(0)
+                    filed.truncate(size)
+                self.mapped = mmap.mmap(filed.fileno(), size)
+
+    def _slot_offset(self, index: int) -> int:
+        return _LIMITER_HEADER.size + _LIMITER_SLOT.size * index
+
+    def allowed(self, now: Optional[float] = None) -> bool:
+        """True unless max_failures logins failed within the window."""
+        now = time.time() if now is None else now
+        with self.lock:
+            (oldest,) = _LIMITER_HEADER.unpack_from(self.mapped, 0)
+            (failed_at,) = _LIMITER_SLOT.unpack_from(self.mapped, self._slot_offset(oldest))
+        return failed_at <= now - self.window
+
+    def record_failure(self, now: Optional[float] = None) -> None:
+        """Replaces the oldest failure with this one."""
+        now = time.time() if now is None else now
+        with self.lock:
+            (oldest,) = _LIMITER_HEADER.unpack_from(self.mapped, 0)
+            _LIMITER_SLOT.pack_into(self.mapped, self._slot_offset(oldest), now)
+            _LIMITER_HEADER.pack_into(self.mapped, 0, (oldest + 1) % self.max_failures)
+
+    def reset(self) -> None:
+        """Forgets all failures."""
+        with self.lock:
+            self.mapped[:] = b"\0" * len(self.mapped)
+
+
+def get_login_limiter() -> LoginLimiter:
+    """Returns the login limiter shared by the workers, mapping it on first use."""
+    global _login_limiter  # pylint: disable=global-statement
+    with _lazy_lock:
+        if _login_limiter is None:
+            _login_limiter = LoginLimiter(
+                LIMITER_PATH, MAX_BAD_LOGINS, MAX_BAD_LOGINS_RESET_TIME
+            )
+        return _login_limiter
+
+
+def init_auth() -> None:
+    """Creates the session secret and the login limiter file ahead of the workers."""
+    _get_key()
+    get_login_limiter()
@@ -0,0 +1,148 @@
+"""
+Content addressed store for the uploaded sources and their encodes.
+
+Blobs live in BLOB_ROOT under a sha256 key: the content digest computed while
+the upload was received for sources, and a digest of (source digest, height,
+crf, preset) for encodes. The title directories only hold relative symlinks to
+the blobs, so ingesting the same file again under another title stores nothing
+new and reuses every encode, and DATA_ROOT can be mounted anywhere. Torrent
+pieces are cached next to the blobs by the torrent writer.
+
+Storing or linking a blob and pruning hold the same file lock, so a prune never
+removes a blob between an ingest finding it and linking to it.
+"""
+
+import hashlib
+import os
+import time
+from typing import Callable, Optional
+
+from filelock import FileLock
+
+from video_server.log import log
+from video_server.settings import BLOB_ROOT, VIDEO_ROOT
+from video_server.torrent import PIECES_SUFFIX, move_with_pieces
+
+# Unreferenced blobs younger than this may belong to an ingest that is still running.
+MIN_PRUNE_AGE = 60 * 60
+
+
+def blob_path(key: str, ext: str = ".mp4", root: str = BLOB_ROOT) -> str:
+    """Returns where the blob with the given key is stored."""
+    return os.path.join(root, key[:2], f"{key}{ext}")
+
+
+def rendition_key(
+    source_digest: str, height: int, crf: int, preset: str, extra_args: Optional[list[str]] = None
+) -> str:
+    """Returns the key of an encode of the source with the given settings."""
+    settings = f"{source_digest}:{height}:{crf}:{preset}"
+    if extra_args:  # e.g. the keyframe args of HLS, the keys without them stay the same
+        settings += ":" + " ".join(extra_args)
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()
+
+
+def store_blob(src: str, key: str, ext: str = ".mp4", root: str = BLOB_ROOT) -> str:
+    """
+    Moves src into the store under key and returns the blob path. If the blob
+    already exists src is a duplicate and is removed instead.
+    """
+    blob = blob_path(key, ext, root)
+    if os.path.realpath(src) == os.path.realpath(blob):
+        return blob  # src already links to the blob, e.g. on a retry.
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    if os.path.exists(blob):
+        log.info("%s is already stored as %s", src, blob)
+        os.remove(src)
+        if os.path.exists(src + PIECES_SUFFIX):
+            os.remove(src + PIECES_SUFFIX)
+    else:
+        move_with_pieces(src, blob)
+    return blob
+
+
+def _blob_lock(root: str) -> FileLock:
+    return FileLock(f"{os.path.abspath(root)}.lock")
+
+
+def link_blob(blob: str, link_path: str) -> None:
+    """Links link_path in a title directory to the blob, with a relative symlink."""
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    link_dir = os.path.dirname(os.path.abspath(link_path))
+    try:
+        target = os.path.relpath(os.path.abspath(blob), link_dir)
+    except ValueError:
+        target = os.path.abspath(blob)  # Another drive on win32.
+    # If this fails here on win32 then turn on "developer mode".
+    os.symlink(target, link_path)
+
+
+def store_and_link(src: str, key: str, link_path: str, root: str = BLOB_ROOT) -> str:
+    """store_blob and link_blob under the store lock, returns the blob path."""
+    with _blob_lock(root):
+        blob = store_blob(src, key, root=root)
+        link_blob(blob, link_path)
+    return blob
+
+
+def link_existing_blob(key: str, link_path: str, root: str = BLOB_ROOT) -> bool:
+    """Links link_path to the blob if it is stored, under the store lock. True if it was."""
+    with _blob_lock(root):
+        blob = blob_path(key, root=root)
+        if not os.path.exists(blob):
+            return False
+        link_blob(blob, link_path)
+    return True
+
+
+def convert_linked(
+    vidfile: str, transform: str, convert: Callable[[str], None], root: str = BLOB_ROOT
+) -> None:
+    """
+    Runs convert(vidfile), which rewrites the file in place. When vidfile links
+    to a blob the result is stored as a blob keyed by the source blob and the
+    transform, so the title keeps a link and the conversion is reused.
+    """
+    if not os.path.islink(vidfile):
+        convert(vidfile)
+        return
+    source_key = os.path.splitext(os.path.basename(os.path.realpath(vidfile)))[0]
+    key = hashlib.sha256(f"{source_key}:{transform}".encode("utf-8")).hexdigest()
+    if link_existing_blob(key, vidfile, root=root):
+        return
+    convert(vidfile)
+    if os.path.islink(vidfile):
+        return  # The conversion failed and left the link alone.
+    store_and_link(vidfile, key, vidfile, root=root)
+
+
+def prune_blobs(
+    video_root: str = VIDEO_ROOT, root: str = BLOB_ROOT, min_age: float = MIN_PRUNE_AGE
+) -> int:
+    """Removes the blobs no title links to anymore, returns how many were removed."""
+    with _blob_lock(root):
+        return _prune_blobs(video_root, root, min_age)
+
+
+def _prune_blobs(video_root: str, root: str, min_age: float) -> int:
+    linked = set()
+    for dir_name, _, file_list in os.walk(video_root):
+        for filename in file_list:
+            path = os.path.join(dir_name, filename)
+            if os.path.islink(path):
+                linked.add(os.path.realpath(path))
+    removed = 0
+    oldest_allowed = time.time() - min_age
+    for dir_name, _, file_list in os.walk(root):
+        for filename in file_list:
+            path = os.path.join(dir_name, filename)
+            if filename.endswith(PIECES_SUFFIX) or os.path.realpath(path) in linked:
+                continue
+            if os.path.getmtime(path) > oldest_allowed:
+                continue
+            os.remove(path)
+            if os.path.exists(path + PIECES_SUFFIX):
+                os.remove(path + PIECES_SUFFIX)
+            removed += 1
+    return removed
@@ -0,0 +1,191 @@
+"""
+Process local snapshot of the video catalog for /json, /rss, /videos and /info.
+
+Every write to Video calls invalidate_catalog(), which bumps the generation row
+in sqlite so that all uvicorn workers see the change. A request only reads that
+one row; the snapshot and the serialized response bodies are rebuilt the first
+time they are needed after the generation moved.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from peewee import fn  # type: ignore
+
+from video_server.models import CatalogState, Video
+from video_server.rss import RSS_FOOTER, rss, rss_header, rss_item
+from video_server.util import get_video_url
+
+RSS_CHANNEL_NAME = "Video Channel"
+FEED_BATCH_SIZE = 200
+
+
+class CatalogSnapshot:  # pylint: disable=too-few-public-methods
+    """The Video rows at one catalog generation plus the bodies built from them."""
+
+    def __init__(self, generation: int, videos: list[Video]) -> None:
+        self.generation = generation
+        self.videos = videos
+        self.built_at = time.time()
+        self.bodies: dict[str, tuple[bytes, str]] = {}
+        self.lock = threading.Lock()
+
+    def body(self, name: str, build: Callable[["CatalogSnapshot"], bytes]) -> tuple[bytes, str]:
+        """Returns the cached (body, etag) for name, building it on first use."""
+        cached = self.bodies.get(name)
+        if cached is not None:
+            return cached
+        with self.lock:
+            cached = self.bodies.get(name)
+            if cached is None:
+                data = build(self)
+                etag = f'"{hashlib.sha1(data).hexdigest()}"'
+                cached = (data, etag)
+                self.bodies[name] = cached
+        return cached
+
+
+_snapshot: Optional[CatalogSnapshot] = None  # pylint: disable=invalid-name
+_snapshot_lock = threading.Lock()
+
+
+def current_generation() -> int:
+    """Reads the catalog generation shared by all workers."""
+    return CatalogState.get_by_id(1).generation
+
+
+def invalidate_catalog() -> None:
+    """Marks the catalog as changed in every worker, call after writing Video."""
+    CatalogState.update(generation=CatalogState.generation + 1).where(
+        CatalogState.id == 1
+    ).execute()
+
+
+def invalidate_catalog_for_views(min_interval: float) -> bool:
+    """
+    Like invalidate_catalog(), but at most once per min_interval seconds across
+    all workers, so playback doesn't keep rebuilding the catalog. Returns True
+    if the generation moved.
+    """
+    now = time.time()
+    count = (
+        CatalogState.update(generation=CatalogState.generation + 1, views_bumped=now)
+        .where((CatalogState.id == 1) & (CatalogState.views_bumped <= now - min_interval))
+        .execute()
+    )
+    return count == 1
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Returns the snapshot for the current generation, rebuilding it if stale."""
+    global _snapshot  # pylint: disable=global-statement
+    generation = current_generation()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.generation == generation:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.generation != generation:
+            videos = Video.select().where(Video.ready).order_by(Video.id)
+            # pylint: disable-next=not-an-iterable
+            _snapshot = CatalogSnapshot(generation, list(videos))
+        return _snapshot
+
+
+def video_to_json(video: Video) -> dict:
+    """Same output as Video.asjson(), with the previews as nested json."""
+    out: dict = {}
+    # pylint: disable-next=protected-access,no-member
+    for field in Video._meta.sorted_fields:
+        if field.name == "ready":  # always true for the listed videos
+            continue
+        val = getattr(video, field.name)
+        if isinstance(val, datetime):
+            out[field.name] = val.isoformat()
+        else:
+            out[field.name] = str(val)
+    # Posters and the storyboard are nested json, not strings.
+    out.update(json.loads(out.pop("previews") or "{}"))
+    return out
+
+
+def build_json(snapshot: CatalogSnapshot) -> bytes:
+    """Body of /json."""
+    return json.dumps([video_to_json(video) for video in snapshot.videos]).encode("utf-8")
+
+
+def build_links(snapshot: CatalogSnapshot) -> bytes:
+    """Body of /videos, one link per line. /info decodes it for its Links."""
+    links = [get_video_url(video.url) for video in snapshot.videos]
+    return "\n".join(links).encode("utf-8")
+
+
+def build_rss(snapshot: CatalogSnapshot) -> bytes:
+    """Body of /rss, newest first."""
+    vids = sorted(snapshot.videos, key=lambda video: video.published, reverse=True)
+    return rss(channel_name=RSS_CHANNEL_NAME, vids=vids).encode("utf-8")
+
+
+def feed_state() -> tuple[int, datetime]:
+    """Returns the catalog generation and max(Video.updated), both are index lookups."""
+    # pylint: disable-next=no-value-for-parameter
+    last_updated = Video.select(fn.MAX(Video.updated)).where(Video.ready).scalar()
+    if isinstance(last_updated, str):  # aggregates skip the field conversion
+        last_updated = datetime.fromisoformat(last_updated)
+    return current_generation(), last_updated or datetime.fromtimestamp(0)
+
+
+def _feed_page(limit: int, since: Optional[datetime], after: Optional[Video]) -> list[Video]:
+    select = Video.select().where(Video.ready)
+    if since is not None:
+        select = select.where(Video.updated > since)
+    if after is not None:
+        select = select.where(
+            (Video.published < after.published)
+            | ((Video.published == after.published) & (Video.id < after.id))
+        )
+    return list(select.order_by(Video.published.desc(), Video.id.desc()).limit(limit))
+
+
+async def iter_feed_videos(
+    limit: Optional[int] = None, since: Optional[datetime] = None
+) -> AsyncIterator[Video]:
+    """Yields the videos newest first, fetched in keyset paginated batches off the loop."""
+    remaining = limit
+    after: Optional[Video] = None
+    while remaining is None or remaining > 0:
+        batch_size = FEED_BATCH_SIZE if remaining is None else min(remaining, FEED_BATCH_SIZE)
+        batch = await asyncio.to_thread(_feed_page, batch_size, since, after)
+        for video in batch:
+            yield video
+        if len(batch) < batch_size:
+            return
+        after = batch[-1]
+        if remaining is not None:
+            remaining -= len(batch)
+
+
+async def stream_rss(
+    limit: Optional[int] = None, since: Optional[datetime] = None
+) -> AsyncIterator[str]:
+    """Streams the rss feed."""
+    yield rss_header(RSS_CHANNEL_NAME)
+    async for video in iter_feed_videos(limit, since):
+        yield rss_item(video)
+    yield RSS_FOOTER
+
+
+async def stream_json(
+    limit: Optional[int] = None, since: Optional[datetime] = None
+) -> AsyncIterator[str]:
+    """Streams the json feed."""
+    yield "["
+    first = True
+    async for video in iter_feed_videos(limit, since):
+        yield ("" if first else ", ") + json.dumps(video_to_json(video))
+        first = False
+    yield "]"
@@ -0,0 +1,178 @@
+"""
+Paginated catalog queries for /api/videos.
+
+Pages are keyset paginated on (sort column, id) with the composite indexes on
+Video, so every page costs the same no matter how deep it is or how big the
+library grows. The cursor is the opaque position of the last row of a page.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator, Optional
+
+from video_server.models import Video
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+SORT_FIELDS = {
+    "published": Video.published,
+    "views": Video.views,
+    "duration": Video.duration,
+}
+# pylint: disable-next=protected-access,no-member
+FIELDS = {field.name: field for field in Video._meta.sorted_fields if field.name != "ready"}
+DEFAULT_FIELDS = ["id", "title", "url", "published", "views", "duration"]
+
+
+class QueryError(ValueError):
+    """Raised for invalid query parameters."""
+
+
+@dataclass
+class VideoQuery:  # pylint: disable=too-many-instance-attributes
+    """The validated parameters of a catalog page."""
+
+    sort: str = "published"
+    descending: bool = True
+    limit: int = DEFAULT_LIMIT
+    fields: list[str] = field(default_factory=lambda: list(DEFAULT_FIELDS))
+    after: Optional[tuple] = None  # (sort value, id) of the last row of the previous page
+    search: Optional[str] = None
+    min_duration: Optional[float] = None
+    max_duration: Optional[float] = None
+    published_after: Optional[datetime] = None
+    published_before: Optional[datetime] = None
+
+
+def encode_cursor(sort: str, value, vid_id: int) -> str:
+    """Returns the opaque cursor for the row with the given sort value and id."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, vid_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """Returns the (sort value, id) in the cursor, raises QueryError if it's invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, vid_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise QueryError("Invalid cursor") from exc
+    if cursor_sort != sort:
+        raise QueryError("The cursor belongs to a different sort order")
+    if sort == "published":
+        value = datetime.fromisoformat(value)
+    return value, int(vid_id)
+
+
+def _parse_date(name: str, value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise QueryError(f"{name} must be an iso date") from exc
+
+
+def parse_query(  # pylint: disable=too-many-arguments
+    sort: str = "published",
+    order: str = "desc",
+    limit: int = DEFAULT_LIMIT,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    search: Optional[str] = None,
+    min_duration: Optional[float] = None,
+    max_duration: Optional[float] = None,
+    published_after: Optional[str] = None,
+    published_before: Optional[str] = None,
+) -> VideoQuery:
+    """Validates the request parameters, raises QueryError with a message for the client."""
+    if sort not in SORT_FIELDS:
+        raise QueryError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+    if order not in ("asc", "desc"):
+        raise QueryError("order must be asc or desc")
+    if limit < 1 or limit > MAX_LIMIT:
+        raise QueryError(f"limit must be between 1 and {MAX_LIMIT}")
+    field_names = list(DEFAULT_FIELDS)
+    if fields:
+        field_names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in field_names if name not in FIELDS]
+        if unknown:
+            raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+    return VideoQuery(
+        sort=sort,
+        descending=order == "desc",
+        limit=limit,
+        fields=field_names,
+        after=decode_cursor(cursor, sort) if cursor else None,
+        search=search,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        published_after=_parse_date("published_after", published_after),
+        published_before=_parse_date("published_before", published_before),
+    )
+
+
+def select_page(query: VideoQuery):
+    """Returns the peewee query for one page plus one row to detect the next page."""
+    sort_field = SORT_FIELDS[query.sort]
+    columns = {name: FIELDS[name] for name in query.fields}
+    # The cursor needs the sort column and the id even when they are not projected.
+    columns.setdefault(query.sort, sort_field)
+    columns.setdefault("id", Video.id)
+    select = Video.select(*columns.values()).where(Video.ready)
+    if query.search:
+        select = select.where(Video.title.contains(query.search))
+    if query.min_duration is not None:
+        select = select.where(Video.duration >= query.min_duration)
+    if query.max_duration is not None:
+        select = select.where(Video.duration <= query.max_duration)
+    if query.published_after is not None:
+        select = select.where(Video.published >= query.published_after)
+    if query.published_before is not None:
+        select = select.where(Video.published < query.published_before)
+    if query.after is not None:
+        value, vid_id = query.after
+        if query.descending:
+            select = select.where(
+                (sort_field < value) | ((sort_field == value) & (Video.id < vid_id))
+            )
+        else:
+            select = select.where(
+                (sort_field > value) | ((sort_field == value) & (Video.id > vid_id))
+            )
+    if query.descending:
+        select = select.order_by(sort_field.desc(), Video.id.desc())
+    else:
+        select = select.order_by(sort_field.asc(), Video.id.asc())
+    return select.limit(query.limit + 1).dicts()
+
+
+def _to_json_value(name: str, value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if name == "previews":
+        return json.loads(value or "{}")
+    return value
+
+
+def stream_page(query: VideoQuery) -> Iterator[bytes]:
+    """Yields the json page one video at a time."""
+    yield b'{"videos": ['
+    last: Optional[dict] = None
+    has_more = False
+    for count, row in enumerate(select_page(query).iterator()):
+        if count == query.limit:
+            has_more = True
+            break
+        item = {name: _to_json_value(name, row[name]) for name in query.fields}
+        yield (b", " if count else b"") + json.dumps(item).encode("utf-8")
+        last = row
+    next_cursor = None
+    if has_more and last is not None:
+        next_cursor = encode_cursor(query.sort, last[query.sort], last["id"])
+    yield b'], "next_cursor": ' + json.dumps(next_cursor).encode("utf-8") + b"}"
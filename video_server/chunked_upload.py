@@ -0,0 +1,239 @@
+"""
+Resumable, parallel chunked uploads.
+
+A session lives in UPLOAD_SESSIONS_ROOT/{id}/ and survives restarts:
+  * session.json - the upload parameters.
+  * data - the file being assembled, chunks are written at their offsets.
+  * received - one byte per chunk, set to 1 once the chunk is fully written.
+Chunks can arrive in any order and from any worker. Sessions that stopped
+receiving chunks are deleted by expire_sessions.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Optional
+
+from video_server.settings import UPLOAD_SESSIONS_ROOT
+
+_O_BINARY = getattr(os, "O_BINARY", 0)
+SESSION_FILE = "session.json"
+DATA_FILE = "data"
+RECEIVED_FILE = "received"
+# Received pieces are collected up to this size and written off the event loop.
+WRITE_BUFFER_SIZE = 1024 * 1024 * 4
+
+
+class ChunkError(ValueError):
+    """Raised for a chunk that doesn't fit the session."""
+
+
+@dataclass
+class UploadSession:  # pylint: disable=too-many-instance-attributes
+    """Parameters of a chunked upload."""
+
+    id: str  # pylint: disable=invalid-name
+    title: str
+    filename: str
+    size: int
+    chunk_size: int
+    description: str = ""
+    do_encode: bool = False
+    created: float = 0.0
+
+    @property
+    def num_chunks(self) -> int:
+        """Number of chunks in the upload."""
+        return max((self.size + self.chunk_size - 1) // self.chunk_size, 1)
+
+    def chunk_length(self, index: int) -> int:
+        """Expected length of the chunk at index."""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+def _session_dir(session_id: str) -> str:
+    # Only accept ids we generated so the id can't be used to escape the root.
+    if not session_id.isalnum():
+        raise FileNotFoundError(session_id)
+    return os.path.join(UPLOAD_SESSIONS_ROOT, session_id)
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.write(fd, data)
+
+
+def _pread(fd: int, size: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def create_session(  # pylint: disable=too-many-arguments
+    title: str,
+    filename: str,
+    size: int,
+    chunk_size: int,
+    description: str = "",
+    do_encode: bool = False,
+) -> UploadSession:
+    """Creates the session directory with a preallocated data file."""
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        title=title,
+        filename=filename,
+        size=size,
+        chunk_size=chunk_size,
+        description=description,
+        do_encode=do_encode,
+        created=time.time(),
+    )
+    session_dir = _session_dir(session.id)
+    os.makedirs(session_dir)
+    with open(os.path.join(session_dir, DATA_FILE), mode="wb") as filed:
+        filed.truncate(size)
+    with open(os.path.join(session_dir, RECEIVED_FILE), mode="wb") as filed:
+        filed.write(b"\0" * session.num_chunks)
+    with open(os.path.join(session_dir, SESSION_FILE), encoding="utf-8", mode="w") as filed:
+        json.dump(asdict(session), filed)
+    return session
+
+
+def load_session(session_id: str) -> Optional[UploadSession]:
+    """Returns the session, None if it does not exist."""
+    try:
+        path = os.path.join(_session_dir(session_id), SESSION_FILE)
+        with open(path, encoding="utf-8", mode="r") as filed:
+            return UploadSession(**json.load(filed))
+    except FileNotFoundError:
+        return None
+
+
+async def write_chunk(session: UploadSession, index: int, body: AsyncIterator[bytes]) -> None:
+    """Writes a chunk at its offset as it streams in and then marks it as received."""
+    if index < 0 or index >= session.num_chunks:
+        raise ChunkError(f"Chunk {index} is out of range 0-{session.num_chunks - 1}")
+    expected = session.chunk_length(index)
+    offset = index * session.chunk_size
+    session_dir = _session_dir(session.id)
+    received = 0
+    buffer = bytearray()
+    fd = os.open(os.path.join(session_dir, DATA_FILE), os.O_WRONLY | _O_BINARY)
+    try:
+        async for data in body:
+            if received + len(buffer) + len(data) > expected:
+                raise ChunkError(f"Chunk {index} is larger than {expected} bytes")
+            buffer += data
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await asyncio.to_thread(_pwrite, fd, bytes(buffer), offset + received)
+                received += len(buffer)
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(_pwrite, fd, bytes(buffer), offset + received)
+            received += len(buffer)
+    finally:
+        os.close(fd)
+    if received != expected:
+        raise ChunkError(f"Chunk {index} has {received} bytes, expected {expected}")
+    fd = os.open(os.path.join(session_dir, RECEIVED_FILE), os.O_WRONLY | _O_BINARY)
+    try:
+        _pwrite(fd, b"\1", index)
+    finally:
+        os.close(fd)
+
+
+def missing_chunks(session: UploadSession) -> list[tuple[int, int]]:
+    """Returns the missing chunks as inclusive (first, last) index ranges."""
+    fd = os.open(os.path.join(_session_dir(session.id), RECEIVED_FILE), os.O_RDONLY | _O_BINARY)
+    try:
+        received = _pread(fd, session.num_chunks, 0)
+    finally:
+        os.close(fd)
+    out: list[tuple[int, int]] = []
+    start: Optional[int] = None
+    for index in range(session.num_chunks):
+        have = index < len(received) and received[index] == 1
+        if not have and start is None:
+            start = index
+        elif have and start is not None:
+            out.append((start, index - 1))
+            start = None
+    if start is not None:
+        out.append((start, session.num_chunks - 1))
+    return out
+
+
+def session_status(session: UploadSession) -> dict:
+    """Returns the session with its missing chunk and byte ranges."""
+    missing = missing_chunks(session)
+    missing_bytes = [
+        (first * session.chunk_size, min((last + 1) * session.chunk_size, session.size) - 1)
+        for first, last in missing
+    ]
+    out = asdict(session)
+    out.update(
+        num_chunks=session.num_chunks,
+        missing_chunks=missing,
+        missing_bytes=missing_bytes,
+        complete=not missing,
+    )
+    return out
+
+
+def finalize_session(session: UploadSession, dst: str) -> None:
+    """Moves the assembled file to dst and removes the session."""
+    if missing_chunks(session):
+        raise ChunkError("Upload is missing chunks")
+    session_dir = _session_dir(session.id)
+    shutil.move(os.path.join(session_dir, DATA_FILE), dst)
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def delete_session(session_id: str) -> None:
+    """Aborts an upload."""
+    shutil.rmtree(_session_dir(session_id), ignore_errors=True)
+
+
+def _last_activity(session_dir: str) -> float:
+    """The creation time of the session or the time of its last chunk, whichever is later."""
+    try:
+        with open(os.path.join(session_dir, SESSION_FILE), encoding="utf-8", mode="r") as filed:
+            created = float(json.load(filed).get("created", 0.0))
+    except (OSError, ValueError):
+        created = 0.0  # a session that was never fully created
+    try:
+        return max(created, os.path.getmtime(os.path.join(session_dir, RECEIVED_FILE)))
+    except OSError:
+        return max(created, os.path.getmtime(session_dir))
+
+
+def expire_sessions(max_age: float, now: Optional[float] = None) -> int:
+    """Deletes the sessions without activity for max_age seconds, returns how many."""
+    now = time.time() if now is None else now
+    try:
+        session_ids = os.listdir(UPLOAD_SESSIONS_ROOT)
+    except FileNotFoundError:
+        return 0
+    count = 0
+    for session_id in session_ids:
+        session_dir = os.path.join(UPLOAD_SESSIONS_ROOT, session_id)
+        try:
+            if not os.path.isdir(session_dir) or now - _last_activity(session_dir) < max_age:
+                continue
+        except FileNotFoundError:
+            continue  # finalized or aborted meanwhile
+        shutil.rmtree(session_dir, ignore_errors=True)
+        count += 1
+    return count
@@ -6,6 +6,8 @@ import sys
 
 def main() -> None:
     """Just launch video_server from the command line."""
+    # One time setup before uvicorn starts its workers.
+    os.system(f'"{sys.executable}" -m video_server.prefork')
     os.system("uvicorn video_server.app:app --no-use-colors --port 80 --host 0.0.0.0")
     sys.exit(0)
 
@@ -0,0 +1,189 @@
+"""
+In-process yt-dlp extractor service.
+
+yt-dlp runs through its python api on a small thread pool instead of a cli
+process per call. The extracted info dict is cached per url for YTDLP_INFO_TTL
+seconds and every format download of that url reuses it, so the page is
+extracted once per ingest instead of once per rendition.
+"""
+
+import asyncio
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from video_server.log import log
+from video_server.settings import URL_INGEST_CONCURRENCY, YTDLP_INFO_TTL
+
+MAX_CACHED_INFOS = 64
+
+_executor: Optional[ThreadPoolExecutor] = None  # pylint: disable=invalid-name
+_executor_lock = threading.Lock()
+_cache: dict[str, tuple[float, dict]] = {}
+_cache_lock = threading.Lock()
+
+
+class ExtractorError(Exception):
+    """Raised when yt-dlp fails to extract or download a url."""
+
+
+class DownloadCancelled(Exception):
+    """Raised from the progress hook to abort a download that was cancelled."""
+
+
+class _Logger:
+    """Routes the yt-dlp output to our log."""
+
+    def debug(self, msg: str) -> None:
+        """yt-dlp sends its regular output here."""
+        log.debug(msg)
+
+    def info(self, msg: str) -> None:
+        """Info messages."""
+        log.info(msg)
+
+    def warning(self, msg: str) -> None:
+        """Warnings."""
+        log.warning(msg)
+
+    def error(self, msg: str) -> None:
+        """Errors, yt-dlp also raises for these."""
+        log.error(msg)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=URL_INGEST_CONCURRENCY + 1, thread_name_prefix="yt-dlp"
+            )
+        return _executor
+
+
+def _options(**extra) -> dict:
+    options = {
+        "quiet": True,
+        "noprogress": True,
+        "nocheckcertificate": True,
+        "noplaylist": True,
+        "logger": _Logger(),
+    }
+    options.update(extra)
+    return options
+
+
+def _get_cached(url: str) -> Optional[dict]:
+    with _cache_lock:
+        entry = _cache.get(url)
+        if entry is None:
+            return None
+        expires, info = entry
+        if expires < time.monotonic():
+            del _cache[url]
+            return None
+        return info
+
+
+def _put_cached(url: str, info: dict) -> None:
+    now = time.monotonic()
+    with _cache_lock:
+        for key in [key for key, (expires, _) in _cache.items() if expires < now]:
+            del _cache[key]
+        while len(_cache) >= MAX_CACHED_INFOS:
+            del _cache[next(iter(_cache))]  # oldest entry first
+        _cache[url] = (now + YTDLP_INFO_TTL, info)
+
+
+def remember_info(url: str, info: dict) -> None:
+    """Caches an info dict that was extracted elsewhere, e.g. by another worker."""
+    _put_cached(url, info)
+
+
+def invalidate(url: str) -> None:
+    """Drops the cached info of url, e.g. because its format urls expired."""
+    with _cache_lock:
+        _cache.pop(url, None)
+
+
+def _extract(url: str) -> dict:
+    # yt-dlp takes a tenth of a second to import, only pay for it on the first url ingest.
+    from yt_dlp import YoutubeDL  # type: ignore  # pylint: disable=import-outside-toplevel
+    from yt_dlp.utils import YoutubeDLError  # type: ignore  # pylint: disable=import-outside-toplevel
+
+    with YoutubeDL(_options()) as ydl:
+        try:
+            info = ydl.extract_info(url, download=False)
+        except YoutubeDLError as exc:
+            raise ExtractorError(f"yt-dlp failed to extract {url}: {exc}") from exc
+        return ydl.sanitize_info(info)
+
+
+async def extract_info(url: str) -> dict:
+    """Returns the info dict of url, extracting it unless a fresh one is cached."""
+    info = _get_cached(url)
+    if info is not None:
+        return info
+    loop = asyncio.get_running_loop()
+    info = await loop.run_in_executor(_get_executor(), _extract, url)
+    _put_cached(url, info)
+    return info
+
+
+def _download(
+    info: dict,
+    format_spec: str,
+    outfile: str,
+    hook: Callable[[dict], None],
+) -> None:
+    from yt_dlp import YoutubeDL  # type: ignore  # pylint: disable=import-outside-toplevel
+    from yt_dlp.utils import YoutubeDLError  # type: ignore  # pylint: disable=import-outside-toplevel
+
+    options = _options(format=format_spec, outtmpl={"default": outfile}, progress_hooks=[hook])
+    with YoutubeDL(options) as ydl:
+        try:
+            ydl.process_ie_result(copy.deepcopy(info), download=True)
+        except YoutubeDLError as exc:
+            raise ExtractorError(f"yt-dlp failed to download {format_spec}: {exc}") from exc
+
+
+async def download(
+    url: str,
+    format_spec: str,
+    outfile: str,
+    on_percent: Optional[Callable[[float], None]] = None,
+) -> None:
+    """
+    Downloads format_spec of url to outfile using the cached info dict. The url
+    is extracted again once if the cached format urls no longer work.
+    """
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+
+    def hook(status: dict) -> None:
+        if cancelled.is_set():
+            raise DownloadCancelled(outfile)
+        total = status.get("total_bytes") or status.get("total_bytes_estimate")
+        if on_percent is not None and status.get("status") == "downloading" and total:
+            percent = 100.0 * status.get("downloaded_bytes", 0) / total
+            loop.call_soon_threadsafe(on_percent, percent)
+
+    for attempt in range(2):
+        info = await extract_info(url)
+        future = loop.run_in_executor(_get_executor(), _download, info, format_spec, outfile, hook)
+        try:
+            await future
+            break
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        except ExtractorError:
+            if attempt == 1:
+                raise
+            log.warning("Download of %s failed, extracting it again", url)
+            invalidate(url)
+    if on_percent is not None:
+        on_percent(100.0)
+    log.info("Downloaded %s", outfile)
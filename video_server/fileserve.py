@@ -0,0 +1,341 @@
+"""
+In-process static file server for WWW_ROOT. Supports single and multi-range
+requests, HEAD and conditional requests so that webseed chunks can be served
+without going through the http-server sidecar.
+"""
+
+# pylint: disable=too-many-arguments,too-many-return-statements,too-many-branches,too-many-instance-attributes
+
+import email.utils
+import mimetypes
+import os
+import secrets
+from typing import Optional
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, RedirectResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from video_server.assets import (
+    IMMUTABLE_CACHE_CONTROL,
+    find_variant,
+    has_variants,
+    is_fingerprinted,
+)
+from video_server.metrics import BYTES_SERVED
+
+READ_CHUNK_SIZE = 1024 * 256
+MAX_RANGES = 32  # More ranges than this and we just send the whole file.
+
+mimetypes.add_type("text/vtt", ".vtt")
+mimetypes.add_type("application/x-bittorrent", ".torrent")
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+mimetypes.add_type("image/webp", ".webp")
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """Returns the etag for a file, derived from the mtime and size."""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range_header(range_header: str, size: int) -> Optional[list[tuple[int, int]]]:
+    """
+    Parses a Range header into a list of (start, end) tuples with inclusive ends.
+    Returns None if the header is malformed or should be ignored, in which case
+    the whole file is sent. Returns an empty list if no range is satisfiable.
+    """
+    units, _, ranges_spec = range_header.partition("=")
+    if units.strip().lower() != "bytes" or not ranges_spec.strip():
+        return None
+    specs = [spec.strip() for spec in ranges_spec.split(",") if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    out: list[tuple[int, int]] = []
+    for spec in specs:
+        start_str, sep, end_str = spec.partition("-")
+        if not sep:
+            return None
+        start_str, end_str = start_str.strip(), end_str.strip()
+        try:
+            if not start_str:
+                # Suffix range, the last N bytes.
+                suffix = int(end_str)
+                if suffix < 0:
+                    return None
+                if suffix == 0:
+                    continue
+                out.append((max(size - suffix, 0), size - 1))
+                continue
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            continue  # Unsatisfiable, skip.
+        if start < 0 or end < start:
+            return None
+        out.append((start, min(end, size - 1)))
+    return out
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """Returns true if any of the tags in an If-Match style header match the etag."""
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if weak and tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    """Parses an http date into a timestamp, None if invalid."""
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    return parsed.timestamp()
+
+
+def is_not_modified(headers, etag: str, mtime: float) -> bool:
+    """Returns true if the conditional request headers allow a 304 response."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag, weak=True)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def if_range_matches(if_range: str, etag: str, last_modified: str) -> bool:
+    """Returns true if the If-Range validator still matches the file."""
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison is required for If-Range.
+        return if_range == etag
+    return if_range == last_modified
+
+
+def _read_chunk(fd: int, offset: int, size: int) -> bytes:
+    """Reads a chunk from the file descriptor at the given offset."""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class RangeFileResponse(Response):
+    """
+    Sends a file, or byte ranges of a file. Uses the zerocopysend asgi extension
+    when the server offers it and falls back to threaded reads otherwise.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        ranges: Optional[list[tuple[int, int]]] = None,
+        status_code: int = 200,
+        headers: Optional[dict[str, str]] = None,
+        media_type: Optional[str] = None,
+        send_body: bool = True,
+    ) -> None:
+        super().__init__(content=None, status_code=status_code, headers=headers)
+        self.path = path
+        self.stat_result = stat_result
+        self.ranges = ranges or []
+        self.file_media_type = media_type or "application/octet-stream"
+        self.send_body = send_body
+        self.boundary = secrets.token_hex(16)
+        self.parts: list[tuple[bytes, int, int]] = []
+        size = stat_result.st_size
+        if len(self.ranges) > 1:
+            content_length = 0
+            for start, end in self.ranges:
+                part_header = (
+                    f"--{self.boundary}\r\n"
+                    f"Content-Type: {self.file_media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                self.parts.append((part_header, start, end - start + 1))
+                content_length += len(part_header) + (end - start + 1) + 2
+            self.trailer = f"--{self.boundary}--\r\n".encode("latin-1")
+            content_length += len(self.trailer)
+            self.headers["content-type"] = f"multipart/byteranges; boundary={self.boundary}"
+        elif len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            self.parts.append((b"", start, end - start + 1))
+            content_length = end - start + 1
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-type"] = self.file_media_type
+        else:
+            self.parts.append((b"", 0, size))
+            content_length = size
+            self.headers["content-type"] = self.file_media_type
+        self.headers["content-length"] = str(content_length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Opened before the status is sent, so an unreadable file still gets an error status.
+        flags = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+        try:
+            fd = await anyio.to_thread.run_sync(os.open, self.path, flags)
+        except OSError as exc:
+            await error_response(exc)(scope, receive, send)
+            return
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if not self.send_body:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            multipart = len(self.parts) > 1
+            zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+            for part_header, offset, count in self.parts:
+                if part_header:
+                    await send(
+                        {"type": "http.response.body", "body": part_header, "more_body": True}
+                    )
+                if zerocopy:
+                    await send(
+                        {
+                            "type": "http.response.zerocopysend",
+                            "file": fd,
+                            "offset": offset,
+                            "count": count,
+                            "more_body": True,
+                        }
+                    )
+                else:
+                    await self._send_range(send, fd, offset, count)
+                if multipart:
+                    await send(
+                        {"type": "http.response.body", "body": b"\r\n", "more_body": True}
+                    )
+            trailer = self.trailer if multipart else b""
+            await send({"type": "http.response.body", "body": trailer, "more_body": False})
+            BYTES_SERVED.labels("file").inc(sum(count for _, _, count in self.parts))
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    async def _send_range(send: Send, fd: int, offset: int, count: int) -> None:
+        """Sends count bytes starting at offset by reading the file in a worker thread."""
+        remaining = count
+        while remaining > 0:
+            chunk = await anyio.to_thread.run_sync(
+                _read_chunk, fd, offset, min(READ_CHUNK_SIZE, remaining)
+            )
+            if not chunk:
+                break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+
+def error_response(exc: OSError) -> Response:
+    """403 for a file the server may not read, 404 for the other errors of stat and open."""
+    if isinstance(exc, PermissionError):
+        return PlainTextResponse("Forbidden", status_code=403)
+    return PlainTextResponse("Not Found", status_code=404)
+
+
+def resolve_path(root: str, url_path: str) -> Optional[str]:
+    """Maps the url path to a path under root, None if it escapes the root."""
+    root = os.path.abspath(root)
+    rel_path = url_path.lstrip("/")
+    full_path = os.path.normpath(os.path.join(root, rel_path))
+    if full_path != root and not full_path.startswith(root + os.sep):
+        return None
+    return full_path
+
+
+async def serve_file(request: Request, root: str) -> Response:
+    """Serves the requested path from the root directory, like http-server does."""
+    if request.method not in ("GET", "HEAD"):
+        return PlainTextResponse("Method Not Allowed", status_code=405)
+    path = resolve_path(root, request.url.path)
+    if path is None:
+        return PlainTextResponse("Not Found", status_code=404)
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, path)
+        if os.path.isdir(path):
+            if not request.url.path.endswith("/"):
+                return RedirectResponse(url=request.url.path + "/", status_code=301)
+            path = os.path.join(path, "index.html")
+            stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    except OSError as exc:
+        return error_response(exc)
+    headers: dict[str, str] = {}
+    if is_fingerprinted(path):
+        headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+    if not has_variants(path):
+        return file_response(request, path, stat_result, headers)
+    # Send the precompressed variant if the client takes one.
+    headers["vary"] = "Accept-Encoding"
+    media_type = mimetypes.guess_type(path)[0]
+    variant = find_variant(path, request.headers.get("accept-encoding", ""))
+    if variant is None:
+        return file_response(request, path, stat_result, headers)
+    encoding, variant_path = variant
+    try:
+        variant_stat = await anyio.to_thread.run_sync(os.stat, variant_path)
+    except OSError:
+        return file_response(request, path, stat_result, headers)
+    headers["content-encoding"] = encoding
+    return file_response(request, variant_path, variant_stat, headers, media_type=media_type)
+
+
+def file_response(
+    request: Request,
+    path: str,
+    stat_result: os.stat_result,
+    headers: Optional[dict[str, str]] = None,
+    media_type: Optional[str] = None,
+) -> Response:
+    """Builds the response for a file honoring the conditional and range headers."""
+    send_body = request.method != "HEAD"
+    etag = make_etag(stat_result)
+    last_modified = email.utils.formatdate(stat_result.st_mtime, usegmt=True)
+    base_headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": last_modified,
+    }
+    base_headers.update(headers or {})
+    if is_not_modified(request.headers, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=base_headers)
+    media_type = media_type or mimetypes.guess_type(path)[0]
+    size = stat_result.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    ranges: Optional[list[tuple[int, int]]] = None
+    if range_header is not None and (
+        if_range is None or if_range_matches(if_range, etag, last_modified)
+    ):
+        ranges = parse_range_header(range_header, size)
+        if ranges is not None and not ranges:
+            base_headers["content-range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=base_headers)
+    return RangeFileResponse(
+        path,
+        stat_result,
+        ranges=ranges,
+        status_code=206 if ranges else 200,
+        headers=base_headers,
+        media_type=media_type,
+        send_body=send_body,
+    )
@@ -19,19 +19,37 @@ import json
 import os
 import shutil
 import warnings
-from distutils.dir_util import copy_tree  # pylint: disable=deprecated-module
 from concurrent.futures import ThreadPoolExecutor
 
+from video_server import assets
 from video_server.asyncwrap import asyncwrap
+from video_server.assets import (
+    COMPRESS_EXTS,
+    FINGERPRINT_EXTS,
+    fingerprinted_name,
+    has_variants,
+    rewrite_references,
+    write_file,
+    write_variants,
+)
 
 from video_server.io import read_utf8, sanitize_path, write_utf8
 from video_server.lang import lang_label
 from video_server.settings import (
+    HLS_ENABLED,
+    HLS_SEGMENT_SECONDS,
     NUMBER_OF_ENCODING_THREADS,
     WEBTORRENT_ENABLED,
+    WWW_ROOT,
 )
+from video_server.blobs import convert_linked
+from video_server.hls import create_hls
+from video_server.manifest import record_tree, sync_file
+from video_server.once import run_once
+from video_server.previews import create_previews
 from video_server.util import mktorrent_task, get_encoder, convert_to_h264
 from video_server.log import log
+from video_server.version import VERSION
 
 # WORK IN PROGRESS
 HERE = os.path.dirname(os.path.abspath(__file__))
@@ -40,6 +58,7 @@ TESTS_DATA = os.path.join(PROJECT_ROOT, "tests", "test_data")
 PLAYER_DIR = os.path.join(HERE, "player")
 HTML_TEMPLATE = read_utf8(os.path.join(HERE, "template.html"))
 REDIRECT_HTML = os.path.join(HERE, "redirect.html")
+PLAYER_TEMPLATE = "index.template.html"
 
 executor = ThreadPoolExecutor(max_workers=NUMBER_OF_ENCODING_THREADS)
 
@@ -56,7 +75,7 @@ def filemd5(filename):
 def mklink(src: str, link_path: str) -> None:
     """Creates a symbolic link."""
     # If this fails here on win32 then turn on "developer mode".
-    if os.path.exists(link_path):
+    if os.path.lexists(link_path):
         os.remove(link_path)
     os.symlink(src, link_path, target_is_directory=os.path.isdir(src))
 
@@ -87,7 +106,8 @@ def create_metadata_files(
             log.warning(
                 "Converting %s from %s to h264 to support webtorrent",
                 vidfile, encoder_name)
-            convert_to_h264(vidfile, fps=30)  # fps=30 is needed to make webtorrent work.
+            # fps=30 is needed to make webtorrent work.
+            convert_linked(vidfile, "h264-30fps", lambda path: convert_to_h264(path, fps=30))
             if get_encoder(vidfile) != "h264":
                 log.error("Failed to convert %s to h264", vidfile)
         basename = os.path.splitext(os.path.basename(vidfile))[0]
@@ -103,6 +123,18 @@ def create_metadata_files(
         )
         tasks.append(task)
     completed_vids: list[dict] = [task.result() for task in tasks]
+    hls: dict | None = None
+    if HLS_ENABLED:
+        try:
+            master = create_hls(vidfiles, out_dir, segment_seconds=HLS_SEGMENT_SECONDS)
+            hls = {"master": f"{base_video_path}/{master}"}
+        except Exception as exc:  # pylint: disable=broad-except
+            log.error(f"Failed to create hls playlists for {vid_title}: {exc}")
+    previews: dict = {}
+    try:
+        previews = absolute_preview_urls(create_previews(vidfiles, out_dir), base_video_path)
+    except Exception as exc:  # pylint: disable=broad-except
+        log.error(f"Failed to create posters and storyboard for {vid_title}: {exc}")
     vidfolder = os.path.dirname(vid_title)
     subtitles_dir = os.path.join(vidfolder, "subtitles")
     log.info(f"Subtitles dir: {subtitles_dir}")
@@ -141,14 +173,33 @@ def create_metadata_files(
             "__comment": "TODO: pass stun_servers to webtorrent client"
         },
     }
+    if hls is not None:
+        video_json["hls"] = hls
+    video_json.update(previews)
     json_data = json.dumps(video_json, indent=4)
     write_utf8(os.path.join(out_dir, "video.json"), contents=json_data)
-    src_html = os.path.join(PLAYER_DIR, "index.template.html")
+    src_html = os.path.join(WWW_ROOT, "player", PLAYER_TEMPLATE)
+    if not os.path.exists(src_html):
+        src_html = os.path.join(PLAYER_DIR, PLAYER_TEMPLATE)
     dst_html = os.path.join(out_dir, "index.html")
     sync_source_file(src_html, dst_html)
     return html_path
 
 
+def absolute_preview_urls(previews: dict, base_url: str) -> dict:
+    """Prefixes the relative paths returned by create_previews with base_url."""
+    posters = {
+        name: {
+            **poster,
+            "jpg": f"{base_url}/{poster['jpg']}",
+            "webp": f"{base_url}/{poster['webp']}",
+        }
+        for name, poster in previews["posters"].items()
+    }
+    storyboard = {**previews["storyboard"], "vtt": f"{base_url}/{previews['storyboard']['vtt']}"}
+    return {"posters": posters, "storyboard": storyboard}
+
+
 @asyncwrap
 def async_create_metadata_files(
     vid_id: int,
@@ -184,18 +235,95 @@ def sync_source_file(file: str, out_file: str) -> bool:
     return False
 
 
+def build_player(src_dir: str, dst_dir: str, root: str) -> str:
+    """
+    Copies the player to dst_dir along with fingerprinted and compressed copies
+    of its assets, and points the pages at them. Returns the path of the
+    rendered index.template.html.
+    """
+    names: dict[str, str] = {}  # asset path -> fingerprinted path, relative to the player
+    pages: list[str] = []
+    for dir_name, _, file_list in os.walk(src_dir):
+        for filename in file_list:
+            src = os.path.join(dir_name, filename)
+            rel_path = os.path.relpath(src, src_dir).replace("\\", "/")
+            ext = os.path.splitext(filename)[1]
+            if ext == ".html":
+                pages.append(rel_path)
+                continue
+            dst = os.path.join(dst_dir, rel_path)
+            copied = sync_file(src, dst, root=root)
+            if ext not in COMPRESS_EXTS:
+                continue
+            with open(src, mode="rb") as filed:
+                data = filed.read()
+            if copied or not has_variants(dst):
+                write_variants(dst, data)
+            if ext in FINGERPRINT_EXTS:
+                names[rel_path] = fingerprinted_name(rel_path, data)
+                write_file(os.path.join(dst_dir, names[rel_path]), data)
+    index_name = "index.html"
+    for rel_path in pages:
+        if rel_path == PLAYER_TEMPLATE:
+            continue
+        html = read_utf8(os.path.join(src_dir, rel_path))
+        data = rewrite_references(html, os.path.dirname(rel_path), names).encode("utf-8")
+        write_file(os.path.join(dst_dir, rel_path), data)
+        if rel_path == "index.html":
+            index_name = fingerprinted_name(rel_path, data)
+            write_file(os.path.join(dst_dir, index_name), data)
+    # The video pages load the player through its fingerprinted url.
+    template = read_utf8(os.path.join(src_dir, PLAYER_TEMPLATE))
+    template = template.replace('"/player/index.html', f'"/player/{index_name}')
+    template_path = os.path.join(dst_dir, PLAYER_TEMPLATE)
+    write_file(template_path, template.encode("utf-8"))
+    record_tree(dst_dir, root=root)
+    return template_path
+
+
 def init_static_files(out_dir: str) -> None:
-    """Initializes the static files."""
+    """Initializes the static files, only the ones that changed since the last sync are copied."""
     assert os.path.exists(out_dir)
-    sync_source_file(REDIRECT_HTML, os.path.join(out_dir, "index.html"))
-    copy_tree(PLAYER_DIR, f"{out_dir}/player")
+    sync_file(REDIRECT_HTML, os.path.join(out_dir, "index.html"), root=out_dir)
+    template_path = build_player(PLAYER_DIR, f"{out_dir}/player", root=out_dir)
+    # Existing videos pick up the new player too.
+    video_root = os.path.join(out_dir, "v")
+    if os.path.isdir(video_root):
+        for entry in os.scandir(video_root):
+            if os.path.exists(os.path.join(entry.path, "video.json")):
+                sync_source_file(template_path, os.path.join(entry.path, "index.html"))
     demo_dir = os.path.join(out_dir, "demo")
     os.makedirs(demo_dir, exist_ok=True)
-    # shutil.copy clobbers files if they already exist.
     for file in ["test.mp4"]:
         src = os.path.join(TESTS_DATA, file)
         dst = os.path.join(demo_dir, file)
         if os.path.exists(src):
-            shutil.copy(src, dst)
+            sync_file(src, dst, root=out_dir)
         else:
             warnings.warn(f"Missing {src}")
+
+
+def static_files_fingerprint(out_dir: str) -> str:
+    """Changes when a source of the static files changes or out_dir is replaced."""
+    # This file and the assets module cover changes to how the player is built.
+    sources = [REDIRECT_HTML, os.path.join(TESTS_DATA, "test.mp4"), __file__, assets.__file__]
+    for dir_name, _, file_list in os.walk(PLAYER_DIR):
+        sources.extend(os.path.join(dir_name, filename) for filename in file_list)
+    hasher = hashlib.sha1(f"{VERSION}:{os.path.abspath(out_dir)}".encode("utf-8"))
+    for path in [out_dir, *sorted(sources)]:
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stamp = f"{path}:{stat_result.st_ino}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+        hasher.update(stamp.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def ensure_static_files(out_dir: str) -> bool:
+    """Syncs the static files unless they are up to date, returns True if it synced."""
+    return run_once(
+        "static_files",
+        lambda: static_files_fingerprint(out_dir),
+        lambda: init_static_files(out_dir),
+    )
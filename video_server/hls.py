@@ -0,0 +1,164 @@
+"""
+Packages the progressive mp4 renditions into CMAF (fmp4) HLS segments with a
+master playlist so that players can switch quality without re-buffering. The
+encodes force a keyframe at every segment boundary, see util.keyframe_args, so
+the segments of the encoded renditions line up.
+"""
+
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+
+from video_server.log import log
+from video_server.probe import ProbeResult, probe
+
+HLS_DIR = "hls"
+MASTER_PLAYLIST = "master.m3u8"
+# RFC 6381 profile_idc and constraint flags of the h264 profiles ffprobe reports.
+AVC_PROFILES = {
+    "Constrained Baseline": "42E0",
+    "Baseline": "4200",
+    "Main": "4D40",
+    "Extended": "5800",
+    "High": "6400",
+    "High 10": "6E00",
+    "High 4:2:2": "7A00",
+    "High 4:4:4 Predictive": "F400",
+}
+# Object types of the aac profiles, LC is what the encodes produce.
+AAC_OBJECT_TYPES = {"LC": 2, "HE-AAC": 5, "HE-AACv2": 29}
+DEFAULT_VIDEO_CODEC = "avc1.640028"  # High profile, level 4.0
+DEFAULT_AUDIO_CODEC = "mp4a.40.2"  # AAC-LC
+
+
+@dataclass
+class Rendition:
+    """One variant stream of the master playlist."""
+
+    path: str  # of the media playlist, relative to the master playlist
+    peak_bandwidth: int  # bits per second of the largest segment
+    average_bandwidth: int
+    width: int
+    height: int
+    codecs: str
+
+
+def package_rendition(vidfile: str, out_dir: str, segment_seconds: int) -> str:
+    """Segments one h264 mp4 into fmp4 HLS without re-encoding, returns the playlist path."""
+    os.makedirs(out_dir, exist_ok=True)
+    playlist = os.path.join(out_dir, "index.m3u8")
+    cmd = [
+        "static_ffmpeg",
+        "-hide_banner",
+        "-y",
+        "-i",
+        vidfile,
+        "-c",
+        "copy",
+        "-f",
+        "hls",
+        "-hls_time",
+        str(segment_seconds),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_type",
+        "fmp4",
+        "-hls_fmp4_init_filename",
+        "init.mp4",
+        "-hls_segment_filename",
+        os.path.join(out_dir, "seg_%05d.m4s"),
+        playlist,
+    ]
+    log.info("Running:\n  %s", subprocess.list2cmdline(cmd))
+    subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    return playlist
+
+
+def codecs(info: ProbeResult) -> str:
+    """
+    Returns the CODECS attribute of a rendition from its probe data, with the
+    defaults for what ffprobe didn't report.
+    """
+    video, audio = DEFAULT_VIDEO_CODEC, None
+    for stream in info.raw.get("streams", []):
+        if stream.get("codec_type") == "video" and stream.get("codec_name") == "h264":
+            profile = AVC_PROFILES.get(stream.get("profile", ""))
+            level = stream.get("level")
+            if profile is not None and isinstance(level, int) and 0 < level < 256:
+                video = f"avc1.{profile}{level:02X}"
+            break
+    if info.has_audio:
+        audio = DEFAULT_AUDIO_CODEC
+        for stream in info.raw.get("streams", []):
+            if stream.get("codec_type") == "audio" and stream.get("codec_name") == "aac":
+                object_type = AAC_OBJECT_TYPES.get(stream.get("profile", ""), 2)
+                audio = f"mp4a.40.{object_type}"
+                break
+    return video if audio is None else f"{video},{audio}"
+
+
+def segment_bandwidths(playlist: str) -> tuple[int, int]:
+    """Returns the peak and the average bits per second of the segments of a media playlist."""
+    segments: list[tuple[float, int]] = []
+    duration = None
+    with open(playlist, encoding="utf-8", mode="r") as filed:
+        for line in filed:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:") :].split(",", 1)[0])
+            elif line and not line.startswith("#") and duration is not None:
+                size = os.path.getsize(os.path.join(os.path.dirname(playlist), line))
+                segments.append((duration, size))
+                duration = None
+    if not segments:
+        raise ValueError(f"No segments in {playlist}")
+    peak = max(size * 8 / max(seconds, 0.001) for seconds, size in segments)
+    total_seconds = sum(seconds for seconds, _ in segments)
+    average = sum(size for _, size in segments) * 8 / max(total_seconds, 0.001)
+    return int(peak), int(average)
+
+
+def master_playlist(renditions: list[Rendition]) -> str:
+    """Returns the master playlist of the renditions, highest quality first."""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for rendition in sorted(renditions, key=lambda r: -r.height):
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={rendition.peak_bandwidth},"
+            f"AVERAGE-BANDWIDTH={rendition.average_bandwidth},"
+            f"RESOLUTION={rendition.width}x{rendition.height},"
+            f'CODECS="{rendition.codecs}"'
+        )
+        lines.append(rendition.path)
+    return "\n".join(lines) + "\n"
+
+
+def create_hls(vidfiles: list[str], out_dir: str, segment_seconds: int) -> str:
+    """
+    Writes out_dir/hls/{height}/ for every rendition plus out_dir/hls/master.m3u8.
+    Returns the path of the master playlist relative to out_dir.
+    """
+    hls_root = os.path.join(out_dir, HLS_DIR)
+    shutil.rmtree(hls_root, ignore_errors=True)
+    renditions: list[Rendition] = []
+    for vidfile in vidfiles:
+        info = probe(vidfile)
+        assert info.height is not None and info.width is not None, f"No video in {vidfile}"
+        playlist = package_rendition(
+            vidfile, os.path.join(hls_root, str(info.height)), segment_seconds
+        )
+        peak, average = segment_bandwidths(playlist)
+        renditions.append(
+            Rendition(
+                path=f"{info.height}/index.m3u8",
+                peak_bandwidth=peak,
+                average_bandwidth=average,
+                width=info.width,
+                height=info.height,
+                codecs=codecs(info),
+            )
+        )
+    with open(os.path.join(hls_root, MASTER_PLAYLIST), encoding="utf-8", mode="w") as filed:
+        filed.write(master_playlist(renditions))
+    log.info("Created hls playlists in %s", hls_root)
+    return f"{HLS_DIR}/{MASTER_PLAYLIST}"
@@ -0,0 +1,360 @@
+"""
+Persistent background ingest jobs.
+
+Uploads put their bytes on disk and then enqueue an IngestJob. A single job
+runner per host (whichever uvicorn worker holds JOB_RUNNER_LOCK) claims the
+queued jobs and runs at most MAX_CONCURRENT_JOBS of them at once.
+
+Job states: queued -> downloading (url jobs) or encoding (uploads) -> hashing
+-> done, or failed once MAX_JOB_ATTEMPTS is exhausted. Jobs left in a running
+state by a runner that died are put back in the queue when the next runner
+takes the lock.
+"""
+
+# pylint: disable=broad-except,logging-fstring-interpolation,too-many-locals
+
+import asyncio
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Optional
+
+from filelock import FileLock, Timeout
+
+from video_server.blobs import blob_path, link_existing_blob, rendition_key, store_and_link
+from video_server.catalog import invalidate_catalog
+from video_server.db import path_to_url
+from video_server.generate_files import async_create_metadata_files
+from video_server.log import log
+from video_server.manifest import file_sha256, forget_tree, record_tree
+from video_server.models import IngestJob, Video
+from video_server.settings import (
+    DOMAIN_NAME,
+    ENCODER_PRESET,
+    ENCODING_CRF,
+    HEIGHTS,
+    JOB_POLL_INTERVAL,
+    JOB_RUNNER_LOCK,
+    MAX_CONCURRENT_JOBS,
+    MAX_JOB_ATTEMPTS,
+    NO_CLEANUP,
+    SINGLE_PASS_ENCODE,
+    STUN_SERVERS,
+    TRACKER_ANNOUNCE_LIST,
+    WEBTORRENT_CHUNK_FACTOR,
+    WWW_ROOT,
+)
+from video_server.url_ingest import ingest_url
+from video_server.util import (
+    async_encode,
+    async_encode_ladder,
+    async_get_video_height,
+    keyframe_args,
+    make_thumbnail,
+)
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+ENCODING = "encoding"
+HASHING = "hashing"
+DONE = "done"
+FAILED = "failed"
+RUNNING_STATES = [DOWNLOADING, ENCODING, HASHING]
+
+KIND_UPLOAD = "upload"  # A single uploaded file that needs probing and maybe encoding.
+KIND_URL = "url"  # A video url from /upload_url, downloaded with yt-dlp.
+
+_runner_task: Optional[asyncio.Task] = None  # pylint: disable=invalid-name
+
+
+def enqueue_job(title: str, kind: str, video_dir: str, params: dict) -> int:
+    """Adds a job to the queue and returns its id."""
+    job = IngestJob.create(
+        title=title, kind=kind, video_dir=video_dir, params=json.dumps(params)
+    )
+    log.info(f"Queued {kind} job {job.id} for {title}")
+    return job.id
+
+
+def job_to_dict(job: IngestJob) -> dict:
+    """Returns the public status of a job."""
+    return {
+        "id": job.id,
+        "title": job.title,
+        "kind": job.kind,
+        "state": job.state,
+        "vid_id": job.vid_id,
+        "attempts": job.attempts,
+        "error": job.error,
+        "progress": json.loads(job.progress or "{}"),
+        "created": job.created.isoformat(),
+        "updated": job.updated.isoformat(),
+    }
+
+
+def get_job(job_id: int) -> Optional[IngestJob]:
+    """Returns the job or None if it does not exist."""
+    return IngestJob.get_or_none(IngestJob.id == job_id)
+
+
+def retry_job(job_id: int) -> bool:
+    """Puts a failed job back into the queue, returns false if it was not failed."""
+    count = (
+        IngestJob.update(state=QUEUED, attempts=0, error="", updated=datetime.now())
+        .where((IngestJob.id == job_id) & (IngestJob.state == FAILED))
+        .execute()
+    )
+    return count == 1
+
+
+def _set_state(job: IngestJob, state: str, **fields) -> None:
+    job.state = state
+    IngestJob.update(state=state, updated=datetime.now(), **fields).where(
+        IngestJob.id == job.id
+    ).execute()
+
+
+def _claim(job: IngestJob) -> bool:
+    """Atomically moves a queued job into the first running state."""
+    if job.kind == KIND_UPLOAD:
+        state = ENCODING
+    elif "vidfiles" not in json.loads(job.params):
+        state = DOWNLOADING
+    else:
+        state = HASHING
+    count = (
+        IngestJob.update(state=state, attempts=IngestJob.attempts + 1, updated=datetime.now())
+        .where((IngestJob.id == job.id) & (IngestJob.state == QUEUED))
+        .execute()
+    )
+    if count == 1:
+        job.state = state
+        job.attempts += 1
+    return count == 1
+
+
+def _get_or_create_video(title: str, description: str, final_path: str) -> int:
+    """
+    Creates the Video row, or returns the existing one if a previous attempt made it.
+    The row stays out of the listings until the job is done, see _publish.
+    """
+    existing = Video.get_or_none(Video.title == title)
+    if existing is not None:
+        return existing.id
+    relpath = os.path.relpath(final_path, WWW_ROOT)
+    url = path_to_url(os.path.dirname(relpath))
+    vid_id = Video.create(
+        title=title, url=url, description=description, path=final_path, iframe=url, ready=False
+    ).id
+    return vid_id
+
+
+async def _run_upload(job: IngestJob, params: dict) -> tuple[int, list[str]]:
+    """Probes, thumbnails and encodes an uploaded file."""
+    video_dir = job.video_dir
+    source = params["source"]
+    height = await async_get_video_height(source)
+    final_path = os.path.join(video_dir, f"{height}.mp4")
+    digest = params.get("content_digest") or ""
+    if not digest:
+        digest = await asyncio.to_thread(file_sha256, source)
+    await asyncio.to_thread(store_and_link, source, digest, final_path)
+    if source != final_path or "content_digest" not in params:
+        # Remember the link so that a retry picks up the stored file.
+        params.update(source=final_path, content_digest=digest)
+        IngestJob.update(params=json.dumps(params)).where(IngestJob.id == job.id).execute()
+    out_thumbnail = os.path.join(video_dir, "thumbnail.jpg")
+    if not os.path.exists(out_thumbnail):
+        await make_thumbnail(vidpath=final_path, out_thumbnail=out_thumbnail)
+    vid_id = _get_or_create_video(job.title, params.get("description", ""), final_path)
+    _set_state(job, ENCODING, vid_id=vid_id)
+    vidfiles: list[str] = [final_path]
+    if not params.get("do_encode"):
+        return vid_id, vidfiles
+    enc_heights = [h for h in HEIGHTS if height != h and h < height]
+    outpaths = {h: os.path.join(video_dir, f"{h}.mp4") for h in enc_heights}
+    vidfiles.extend(outpaths.values())
+    keys = {
+        h: rendition_key(digest, h, ENCODING_CRF, ENCODER_PRESET, keyframe_args())
+        for h in enc_heights
+    }
+    # Encodes of the same source with the same settings are reused from the blob
+    # store. They are linked now, so that a prune during the encode keeps them.
+    missing = []
+    for enc_height in enc_heights:
+        if not await asyncio.to_thread(link_existing_blob, keys[enc_height], outpaths[enc_height]):
+            missing.append(enc_height)
+    if missing and SINGLE_PASS_ENCODE:
+        await async_encode_ladder(
+            videopath=final_path,
+            crf=ENCODING_CRF,
+            heights=missing,
+            outpaths=[outpaths[h] for h in missing],
+        )
+    elif missing:
+        for enc_height in missing:
+            await async_encode(
+                videopath=final_path,
+                crf=ENCODING_CRF,
+                height=enc_height,
+                outpath=outpaths[enc_height],
+            )
+    for enc_height in missing:
+        outpath = outpaths[enc_height]
+        await asyncio.to_thread(store_and_link, outpath, keys[enc_height], outpath)
+    return vid_id, vidfiles
+
+
+async def _run_url(job: IngestJob, params: dict) -> tuple[int, list[str]]:
+    """Downloads the renditions of a url, unless a previous attempt already did."""
+    if "vidfiles" not in params:
+
+        def report(progress: dict) -> None:
+            IngestJob.update(progress=json.dumps(progress), updated=datetime.now()).where(
+                IngestJob.id == job.id
+            ).execute()
+
+        params["vidfiles"] = await ingest_url(
+            url=params["url"],
+            formats=params["formats"],
+            thumbnail_url=params["thumbnail"],
+            video_dir=job.video_dir,
+            report=report,
+            info=params.get("info"),
+        )
+        # The info dict is large and only needed until the downloads are done.
+        params.pop("info", None)
+        IngestJob.update(params=json.dumps(params)).where(IngestJob.id == job.id).execute()
+    vid_id = _get_or_create_video(job.title, params.get("description", ""), params["path"])
+    return vid_id, params["vidfiles"]
+
+
+def _publish(vid_id: int, video_dir: str) -> None:
+    """
+    Copies the poster and storyboard urls from video.json to the Video row for /json
+    and lists the video.
+    """
+    with open(os.path.join(video_dir, "video.json"), encoding="utf-8", mode="r") as filed:
+        video_json = json.load(filed)
+    previews = {key: video_json[key] for key in ["posters", "storyboard"] if key in video_json}
+    Video.update(previews=json.dumps(previews), ready=True, updated=datetime.now()).where(
+        Video.id == vid_id
+    ).execute()
+    invalidate_catalog()
+
+
+def _known_digests(params: dict) -> dict[str, str]:
+    """The sha256 computed while the upload was received, so the manifest doesn't hash it again."""
+    source, digest = params.get("source"), params.get("content_digest")
+    if not source or not digest:
+        return {}
+    # The link may point at a converted copy by now, see blobs.convert_linked.
+    if os.path.realpath(source) != os.path.realpath(blob_path(digest)):
+        return {}
+    return {source: digest}
+
+
+async def run_job(job: IngestJob) -> None:
+    """Runs a claimed job to completion, requeueing or failing it on error."""
+    params = json.loads(job.params)
+    try:
+        if job.kind == KIND_UPLOAD:
+            vid_id, vidfiles = await _run_upload(job, params)
+        else:
+            vid_id, vidfiles = await _run_url(job, params)
+        _set_state(job, HASHING, vid_id=vid_id)
+        await async_create_metadata_files(
+            vid_id=vid_id,
+            vid_title=job.title,
+            vidfiles=vidfiles,
+            domain_name=DOMAIN_NAME,
+            tracker_announce_list=TRACKER_ANNOUNCE_LIST,
+            stun_servers=STUN_SERVERS,
+            out_dir=job.video_dir,
+            chunk_factor=WEBTORRENT_CHUNK_FACTOR,
+        )
+        await asyncio.to_thread(record_tree, job.video_dir, _known_digests(params))
+        _publish(vid_id, job.video_dir)
+        _set_state(job, DONE)
+        log.info(f"Job {job.id} for {job.title} is done")
+    except asyncio.CancelledError:
+        # Shutting down, the next runner will resume the job.
+        _set_state(job, QUEUED)
+        raise
+    except Exception as exc:
+        log.error(f"Job {job.id} for {job.title} failed on attempt {job.attempts}: {exc}")
+        if job.attempts < MAX_JOB_ATTEMPTS:
+            _set_state(job, QUEUED, error=str(exc))
+            return
+        _set_state(job, FAILED, error=str(exc))
+        Video.delete().where(Video.title == job.title).execute()
+        invalidate_catalog()
+        if not NO_CLEANUP:
+            forget_tree(job.video_dir)
+            shutil.rmtree(job.video_dir, ignore_errors=True)
+
+
+def requeue_orphaned_jobs() -> int:
+    """Puts jobs that were running when the last runner died back into the queue."""
+    return (
+        IngestJob.update(state=QUEUED, updated=datetime.now())
+        .where(IngestJob.state.in_(RUNNING_STATES))
+        .execute()
+    )
+
+
+async def job_runner() -> None:
+    """Waits to become the runner for this host, then processes the job queue forever."""
+    runner_lock = FileLock(JOB_RUNNER_LOCK)
+    while True:
+        try:
+            runner_lock.acquire(timeout=0)
+            break
+        except Timeout:
+            await asyncio.sleep(JOB_POLL_INTERVAL * 10)
+    running: set[asyncio.Task] = set()
+    try:
+        num_requeued = requeue_orphaned_jobs()
+        if num_requeued:
+            log.warning(f"Resuming {num_requeued} interrupted ingest jobs")
+        while True:
+            free_slots = MAX_CONCURRENT_JOBS - len(running)
+            if free_slots > 0:
+                queued = (
+                    IngestJob.select()
+                    .where(IngestJob.state == QUEUED)
+                    .order_by(IngestJob.id)
+                    .limit(free_slots)
+                )
+                for job in queued:  # pylint: disable=not-an-iterable
+                    if _claim(job):
+                        task = asyncio.create_task(run_job(job))
+                        running.add(task)
+                        task.add_done_callback(running.discard)
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+    finally:
+        for task in list(running):
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        runner_lock.release()
+
+
+def start_job_runner() -> None:
+    """Starts the job runner on the current event loop."""
+    global _runner_task  # pylint: disable=global-statement
+    if _runner_task is None:
+        _runner_task = asyncio.create_task(job_runner())
+
+
+async def stop_job_runner() -> None:
+    """Stops the job runner, running jobs are resumed by the next runner."""
+    global _runner_task  # pylint: disable=global-statement
+    if _runner_task is None:
+        return
+    _runner_task.cancel()
+    try:
+        await _runner_task
+    except asyncio.CancelledError:
+        pass
+    _runner_task = None
@@ -1,35 +1,40 @@
 """
 Instantiates a logging object that can be used to log messages to the console and to a file.
+
+Logging calls only put the record on a queue. A listener thread per process
+writes the records to stdout and appends them to the log file with O_APPEND,
+so workers never wait on each other. Rotation by size and age is done by
+whichever process takes the rotation lock first, the others notice the new
+file and reopen it.
 """
 
-import sys
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import sys
+import time
+from datetime import datetime
+from typing import Optional
 
 from filelock import FileLock, Timeout
-from video_server.settings import LOGFILE, LOGFILELOCK
+from video_server.log_tail import tail
+from video_server.settings import (
+    LOG_BACKUP_COUNT,
+    LOG_JSON,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_SECONDS,
+    LOGFILE,
+)
 
 
 LOGGING_FMT = (
     "%(levelname)s %(asctime)s %(filename)s:%(lineno)s->%(funcName)s - %(message)s"
 )
-LOG_FILE_MUTEX = FileLock(LOGFILELOCK)
-
-
-def _log_init():
-    retries = 10
-    while True:
-        try:
-            with LOG_FILE_MUTEX.acquire(timeout=1):
-                with open(LOGFILE, encoding="utf-8", mode="a") as log_file:
-                    log_file.write(f"pid {os.getpid()} starting up log file\n")
-            return
-        except Timeout:
-            retries -= 1
-            if retries <= 0:
-                sys.stderr.write("COULD NOT ACQUIRE LOCK ON LOG FILE!!\n")
-                return
-
+# Seconds between the listener's checks for rotation.
+ROTATE_CHECK_INTERVAL = 1.0
 
 INFO = logging.INFO
 DEBUG = logging.DEBUG
@@ -38,64 +43,153 @@ ERROR = logging.ERROR
 CRITICAL = logging.CRITICAL
 
 
-def log_write_impl(message: str) -> None:
-    """Write a log message."""
-    sys.stdout.write(message)
-    try:
-        with LOG_FILE_MUTEX.acquire(timeout=0.1):
-            with open(LOGFILE, encoding="utf-8", mode="a") as log_file:
-                log_file.write(message)
-    except Timeout:
-        sys.stderr.write(
-            "Could not acquire lock on log file for write, message:\n{message}\n"
-        )
-    try:
-        # truncate the file if it is larger than 256k
-        if os.path.getsize(LOGFILE) > 1024 * 256:
-            with LOG_FILE_MUTEX.acquire(timeout=0):
-                with open(LOGFILE, encoding="utf-8", mode="r") as log_file:
-                    lines = log_file.readlines()
-                with open(LOGFILE, encoding="utf-8", mode="w") as log_file:
-                    log_file.writelines(lines[-100:])
-    except Timeout:
-        pass
-
-
-def log_read_tail() -> str:
-    """Read the last 100 lines of the log file."""
-    with LOG_FILE_MUTEX.acquire(timeout=0.1):
-        with open(LOGFILE, encoding="utf-8", mode="r") as log_file:
-            lines = [line.strip() for line in log_file.readlines()[-1000:]]
-            # reverse
-            lines = lines[::-1]
-            return "\n".join(lines)
-
+class JsonFormatter(logging.Formatter):
+    """Formats records as one json object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "func": record.funcName,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out)
+
+
+class RotatingAppendHandler(logging.Handler):  # pylint: disable=too-many-instance-attributes
+    """
+    Appends to the log file without a lock, shared by all the processes.
+    Only runs on the listener thread.
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int, backup_count: int, rotate_seconds: int
+    ) -> None:
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_seconds = rotate_seconds
+        self.rotate_lock = FileLock(f"{path}.lock")
+        self.marker = f"{path}.rotated"
+        self.fd: Optional[int] = None
+        self.inode = 0
+        self.next_check = 0.0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._open()
+
+    def _open(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.inode = os.fstat(self.fd).st_ino
+        if not os.path.exists(self.marker):
+            with open(self.marker, mode="a", encoding="utf-8"):
+                pass
+
+    def _should_rotate(self) -> bool:
+        assert self.fd is not None
+        if self.max_bytes and os.fstat(self.fd).st_size >= self.max_bytes:
+            return True
+        if self.rotate_seconds:
+            try:
+                return time.time() - os.path.getmtime(self.marker) >= self.rotate_seconds
+            except FileNotFoundError:
+                return False
+        return False
+
+    def _rotate(self) -> None:
+        try:
+            with self.rotate_lock.acquire(timeout=0):
+                if os.stat(self.path).st_ino != self.inode:
+                    return  # Another process rotated already.
+                for index in range(self.backup_count - 1, 0, -1):
+                    src = f"{self.path}.{index}"
+                    if os.path.exists(src):
+                        os.replace(src, f"{self.path}.{index + 1}")
+                if self.backup_count:
+                    os.replace(self.path, f"{self.path}.1")
+                else:
+                    os.truncate(self.path, 0)
+                os.utime(self.marker)
+        except (Timeout, OSError):
+            pass  # Someone else is rotating, or the platform can't rename open files.
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + ROTATE_CHECK_INTERVAL
+        if self._should_rotate():
+            self._rotate()
+        try:
+            reopen = os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            reopen = True
+        if reopen:
+            self._open()
 
-class CustomStreamHandler:
-    """A stream for logging."""
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            message = self.format(record) + "\n"
+            sys.stdout.write(message)
+            if self.fd is None:
+                # Closed by logging.config.dictConfig, which closes every existing
+                # handler, while the listener still owns this one.
+                self._open()
+            self._check()
+            assert self.fd is not None
+            os.write(self.fd, message.encode("utf-8"))
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        super().close()
 
-    def write(self, message: str) -> None:
-        """Write the message to the logger."""
-        log_write_impl(message)
 
-    def flush(self) -> None:
-        """Flush the stream."""
+def log_read_tail() -> str:
+    """Read the last 1000 lines of the log file, newest first."""
+    lines = [line.strip() for line in tail(LOGFILE, 1000)]
+    # reverse
+    lines = lines[::-1]
+    return "\n".join(lines)
 
 
 def _create_logger() -> logging.Logger:
     """Create a logger with the given name."""
-    # create logger with 'spam_application'
-    _log_init()
     out = logging.getLogger("system")
     out.setLevel(DEBUG)
-    # create console handler with a higher log level
-    strmhandler = logging.StreamHandler(CustomStreamHandler())
-    strmhandler.setLevel(INFO)
+    file_handler = RotatingAppendHandler(
+        LOGFILE,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+        rotate_seconds=LOG_ROTATE_SECONDS,
+    )
+    file_handler.setLevel(INFO)
     # create formatter and add it to the handlers
-    formatter = logging.Formatter(LOGGING_FMT)
-    strmhandler.setFormatter(formatter)
-    # add the handlers to the logger
-    out.addHandler(strmhandler)
+    formatter = JsonFormatter() if LOG_JSON else logging.Formatter(LOGGING_FMT)
+    file_handler.setFormatter(formatter)
+    # The logging call only enqueues, the listener thread does the io.
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setLevel(INFO)
+    out.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    out.info("pid %s starting up log file", os.getpid())
     return out
 
 
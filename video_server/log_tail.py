@@ -0,0 +1,147 @@
+"""
+Reads the end of the log file without reading the whole file.
+
+Lines are read backwards from the end in blocks and filtered by level, time and
+a substring until enough lines matched, so the cost depends on the size of the
+answer and not on the size of the log. follow() streams the lines written
+after the tail.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Iterator, Optional
+
+BLOCK_SIZE = 64 * 1024
+MAX_LOG_TAIL = 100000
+FOLLOW_POLL_INTERVAL = 0.5
+
+
+@dataclass
+class LogFilter:
+    """Which lines to return, None means no filter."""
+
+    level: Optional[int] = None  # minimum level, e.g. logging.WARNING
+    since: Optional[datetime] = None
+    grep: Optional[str] = None
+
+    def matches(self, line: str) -> bool:
+        """True if the line passes every filter."""
+        if self.grep is not None and self.grep not in line:
+            return False
+        if self.level is None and self.since is None:
+            return True
+        level, created = parse_line(line)
+        if self.level is not None and (level is None or level < self.level):
+            return False
+        if self.since is not None and (created is None or created < self.since):
+            return False
+        return True
+
+
+def parse_level(name: str) -> int:
+    """Returns the level number for a name like "warning", raises ValueError."""
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level {name}")
+    return level
+
+
+def parse_line(line: str) -> tuple[Optional[int], Optional[datetime]]:
+    """Returns the level and time of a text or json log line, None for what's missing."""
+    if line.startswith("{"):
+        try:
+            data = json.loads(line)
+            return logging.getLevelName(data["level"]), datetime.fromisoformat(data["time"])
+        except (ValueError, KeyError, TypeError):
+            return None, None
+    # "LEVEL yyyy-mm-dd hh:mm:ss,mmm file:line->func - message"
+    parts = line.split(" ", 3)
+    if len(parts) < 3:
+        return None, None
+    level = logging.getLevelName(parts[0])
+    try:
+        created: Optional[datetime] = datetime.strptime(
+            f"{parts[1]} {parts[2]}", "%Y-%m-%d %H:%M:%S,%f"
+        )
+    except ValueError:
+        created = None
+    return (level if isinstance(level, int) else None), created
+
+
+def read_lines_backwards(path: str, block_size: int = BLOCK_SIZE) -> Iterator[str]:
+    """Yields the lines of the file from the last to the first."""
+    with open(path, mode="rb") as filed:
+        position = filed.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            filed.seek(position)
+            block = filed.read(read_size) + remainder
+            lines = block.split(b"\n")
+            # The first piece may be the end of a line that starts in the previous block.
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode("utf-8", errors="replace")
+        if remainder:
+            yield remainder.decode("utf-8", errors="replace")
+
+
+def tail(path: str, count: int, log_filter: Optional[LogFilter] = None) -> list[str]:
+    """Returns the last count lines that pass the filter, oldest first."""
+    log_filter = log_filter or LogFilter()
+    out: list[str] = []
+    if count <= 0 or not os.path.exists(path):
+        return out
+    for line in read_lines_backwards(path):
+        if log_filter.since is not None:
+            _, created = parse_line(line)
+            if created is not None and created < log_filter.since:
+                break  # Everything before this line is older too.
+        if log_filter.matches(line):
+            out.append(line)
+            if len(out) >= count:
+                break
+    out.reverse()
+    return out
+
+
+async def follow(
+    path: str, log_filter: Optional[LogFilter] = None, poll_interval: float = FOLLOW_POLL_INTERVAL
+) -> AsyncIterator[str]:
+    """Yields the lines appended to the file from now on, following rotations."""
+    log_filter = log_filter or LogFilter()
+    filed = open(path, mode="rb")  # pylint: disable=consider-using-with
+    try:
+        filed.seek(0, os.SEEK_END)
+        inode = os.fstat(filed.fileno()).st_ino
+        partial = b""
+        while True:
+            data = filed.read()
+            if not data:
+                try:
+                    rotated = os.stat(path).st_ino != inode
+                except FileNotFoundError:
+                    rotated = False
+                if not rotated:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                # The old file is fully read, continue with the new one.
+                filed.close()
+                filed = open(path, mode="rb")  # pylint: disable=consider-using-with
+                inode = os.fstat(filed.fileno()).st_ino
+                partial = b""
+                continue
+            lines = (partial + data).split(b"\n")
+            partial = lines.pop()
+            for raw_line in lines:
+                line = raw_line.decode("utf-8", errors="replace")
+                if line and log_filter.matches(line):
+                    yield line
+    finally:
+        filed.close()
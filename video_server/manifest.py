@@ -0,0 +1,211 @@
+"""
+Manifest of the files under WWW_ROOT.
+
+Ingest, delete and the static sync record the files they change in the
+FileEntry table, with their size, mtime and sha256, so listing the library is
+an indexed query instead of a walk of the whole tree. A file is only hashed
+again when its size or mtime changed.
+
+One worker per host (whichever holds MANIFEST_LOCK) reconciles the table with
+the disk at startup and, with MANIFEST_WATCH=1, applies the changes made
+outside the server as they happen.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+from typing import Iterable, Optional
+
+from filelock import FileLock, Timeout
+
+from video_server.log import log
+from video_server.models import FileEntry, db_proxy
+from video_server.settings import MANIFEST_LOCK, MANIFEST_WATCH, WWW_ROOT
+
+HASH_BLOCK_SIZE = 1024 * 1024
+LOCK_POLL_INTERVAL = 10
+_keeper_task: Optional[asyncio.Task] = None  # pylint: disable=invalid-name
+
+
+def to_manifest_path(path: str, root: str = WWW_ROOT) -> str:
+    """Returns the path relative to root with forward slashes, as stored in the manifest."""
+    return os.path.relpath(os.path.abspath(path), root).replace("\\", "/")
+
+
+def file_sha256(path: str) -> str:
+    """Returns the sha256 of the file."""
+    hasher = hashlib.sha256()
+    with open(path, mode="rb") as filed:
+        for block in iter(lambda: filed.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def record_files(
+    paths: Iterable[str], digests: Optional[dict[str, str]] = None, root: str = WWW_ROOT
+) -> int:
+    """
+    Adds or updates the files in the manifest, returns how many changed.
+    digests maps paths to an already known sha256, to skip hashing them again.
+    """
+    digests = digests or {}
+    changed = 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        rel_path = to_manifest_path(path, root)
+        row = FileEntry.get_or_none(FileEntry.path == rel_path)
+        if row is not None and row.size == stat.st_size and row.mtime_ns == stat.st_mtime_ns:
+            continue
+        sha256 = digests.get(path) or file_sha256(path)
+        FileEntry.insert(
+            path=rel_path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256
+        ).on_conflict(
+            conflict_target=[FileEntry.path],
+            preserve=[FileEntry.size, FileEntry.mtime_ns, FileEntry.sha256],
+        ).execute()
+        changed += 1
+    return changed
+
+
+def _walk(top: str) -> Iterable[str]:
+    for dir_name, _, file_list in os.walk(top):
+        for filename in file_list:
+            yield os.path.join(dir_name, filename)
+
+
+def record_tree(
+    top: str, digests: Optional[dict[str, str]] = None, root: str = WWW_ROOT
+) -> int:
+    """Records every file under top, returns how many changed. digests as for record_files."""
+    return record_files(_walk(top), digests=digests, root=root)
+
+
+def _under(rel_path: str):
+    """Where clause for the entry and everything below it, as a range so the index is used."""
+    if rel_path in ("", "."):
+        return FileEntry.path.is_null(False)
+    # "0" is the character after "/", so this is every path that starts with "rel_path/".
+    return (FileEntry.path == rel_path) | (
+        (FileEntry.path > f"{rel_path}/") & (FileEntry.path < f"{rel_path}0")
+    )
+
+
+def forget_tree(top: str, root: str = WWW_ROOT) -> int:
+    """Removes the file or directory top and everything below it, returns the number of rows."""
+    return FileEntry.delete().where(_under(to_manifest_path(top, root))).execute()
+
+
+def reconcile(top: str = WWW_ROOT, root: str = WWW_ROOT) -> tuple[int, int]:
+    """Makes the manifest match the disk below top, returns (changed, removed)."""
+    seen = set()
+    changed = 0
+    for path in _walk(top):
+        seen.add(to_manifest_path(path, root))
+        changed += record_files([path], root=root)
+    stored = FileEntry.select(FileEntry.path).where(_under(to_manifest_path(top, root)))
+    missing = [row.path for row in stored.iterator() if row.path not in seen]
+    with db_proxy.atomic():
+        for rel_path in missing:
+            FileEntry.delete().where(FileEntry.path == rel_path).execute()
+    return changed, len(missing)
+
+
+def sync_file(src: str, dst: str, root: str = WWW_ROOT) -> bool:
+    """
+    Copies src to dst unless the manifest says dst is already a copy of it,
+    returns True if it copied. The copy keeps the mtime of src, so the next
+    sync only has to stat src.
+    """
+    src_stat = os.stat(src)
+    row = FileEntry.get_or_none(FileEntry.path == to_manifest_path(dst, root))
+    if (
+        row is not None
+        and row.size == src_stat.st_size
+        and row.mtime_ns == src_stat.st_mtime_ns
+        and os.path.exists(dst)
+    ):
+        return False
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copy2(src, dst)
+    record_files([dst], root=root)
+    return True
+
+
+def sync_tree(src_dir: str, dst_dir: str, root: str = WWW_ROOT) -> int:
+    """Syncs every file of src_dir to dst_dir, returns how many were copied."""
+    copied = 0
+    for src in _walk(src_dir):
+        copied += sync_file(src, os.path.join(dst_dir, os.path.relpath(src, src_dir)), root)
+    return copied
+
+
+def list_files(after: Optional[str] = None, limit: int = 1000) -> list[FileEntry]:
+    """Returns up to limit entries ordered by path, starting after the given path."""
+    select = FileEntry.select()
+    if after is not None:
+        select = select.where(FileEntry.path > after)
+    return list(select.order_by(FileEntry.path).limit(limit))
+
+
+def _apply_changes(changes: set) -> None:
+    for _, path in changes:
+        if os.path.isfile(path):
+            record_files([path])
+        elif not os.path.exists(path):
+            forget_tree(path)
+
+
+async def _watch(root: str) -> None:
+    """Applies the changes below root to the manifest as they happen."""
+    from watchfiles import awatch  # pylint: disable=import-outside-toplevel
+
+    async for changes in awatch(root):
+        try:
+            await asyncio.to_thread(_apply_changes, changes)
+        except Exception as exc:  # pylint: disable=broad-except
+            log.error("Failed to update the file manifest: %s", exc)
+
+
+async def manifest_keeper() -> None:
+    """Waits to become the keeper for this host, then reconciles and optionally watches."""
+    keeper_lock = FileLock(MANIFEST_LOCK)
+    while True:
+        try:
+            keeper_lock.acquire(timeout=0)
+            break
+        except Timeout:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+    try:
+        changed, removed = await asyncio.to_thread(reconcile)
+        log.info("File manifest reconciled, %s changed and %s removed", changed, removed)
+        if MANIFEST_WATCH:
+            await _watch(WWW_ROOT)
+        else:
+            # Keep the lock so that the other workers don't reconcile again.
+            await asyncio.Event().wait()
+    finally:
+        keeper_lock.release()
+
+
+def start_manifest_keeper() -> None:
+    """Starts the manifest keeper on the current event loop."""
+    global _keeper_task  # pylint: disable=global-statement
+    if _keeper_task is None:
+        _keeper_task = asyncio.create_task(manifest_keeper())
+
+
+async def stop_manifest_keeper() -> None:
+    """Stops the manifest keeper."""
+    global _keeper_task  # pylint: disable=global-statement
+    if _keeper_task is None:
+        return
+    _keeper_task.cancel()
+    try:
+        await _keeper_task
+    except asyncio.CancelledError:
+        pass
+    _keeper_task = None
@@ -0,0 +1,205 @@
+"""
+Prometheus metrics served by /metrics.
+
+Every uvicorn worker writes its samples to mmap files in METRICS_DIR, the
+prometheus_client multiprocess mode, and /metrics adds up the files of all the
+workers, so whichever worker answers the scrape reports the whole host. The
+environment variable has to be set before prometheus_client is imported, so
+import it through this module. Every metric has labels, so that importing this
+module doesn't create files before make_data_dirs created METRICS_DIR.
+"""
+
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from video_server.settings import METRICS_DIR, METRICS_SAMPLE_INTERVAL
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", METRICS_DIR)
+
+# pylint: disable=wrong-import-position,wrong-import-order
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess  # noqa: E402
+
+__all__ = ["CONTENT_TYPE_LATEST"]
+
+# Subprocess stages take from milliseconds (probe) to hours (veryslow encodes).
+STAGE_BUCKETS = (0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200, float("inf"))
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, float("inf"))
+_METRICS_FILE_RE = re.compile(r"_(\d+)\.db$")
+_sampler_task: Optional[asyncio.Task] = None  # pylint: disable=invalid-name
+
+REQUEST_LATENCY = Histogram(
+    "video_server_request_duration_seconds",
+    "Time to answer an http request, by route.",
+    ["method", "route"],
+)
+REQUESTS = Counter(
+    "video_server_requests_total",
+    "Answered http requests, by route and status.",
+    ["method", "route", "status"],
+)
+BYTES_SERVED = Counter(
+    "video_server_served_bytes_total",
+    "Bytes of static files sent, by the in process file server or the http-server proxy.",
+    ["source"],
+)
+ACTIVE_UPLOADS = Gauge(
+    "video_server_active_uploads",
+    "Upload requests in progress, by method.",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+STAGE_DURATION = Histogram(
+    "video_server_stage_duration_seconds",
+    "Time spent in an ingest subprocess stage, by rendition.",
+    ["stage", "rendition"],
+    buckets=STAGE_BUCKETS,
+)
+EXECUTOR_QUEUE = Gauge(
+    "video_server_executor_queue_depth",
+    "Work items waiting for a thread in an executor.",
+    ["executor"],
+    multiprocess_mode="livesum",
+)
+SQL_DURATION = Histogram(
+    "video_server_sql_duration_seconds",
+    "Time to execute an sqlite statement, by statement type.",
+    ["statement"],
+    buckets=SQL_BUCKETS,
+)
+
+
+@contextmanager
+def time_stage(stage: str, rendition: object = "") -> Iterator[None]:
+    """Records how long the block took as an ingest stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, rendition, time.perf_counter() - start)
+
+
+def observe_stage(stage: str, rendition: object, seconds: float) -> None:
+    """Records an ingest stage whose rendition is only known once it finished."""
+    STAGE_DURATION.labels(stage, str(rendition)).observe(seconds)
+
+
+def observe_sql(sql: str, seconds: float) -> None:
+    """Records the execution time of an sql statement."""
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "OTHER"
+    if statement not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        statement = "OTHER"
+    SQL_DURATION.labels(statement).observe(seconds)
+
+
+def render_metrics() -> bytes:
+    """Returns the metrics of all the workers in the Prometheus text format."""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def remove_dead_process_files(metrics_dir: str = METRICS_DIR) -> int:
+    """Removes the files left by workers that are gone, returns how many were removed."""
+    removed = 0
+    for filename in os.listdir(metrics_dir):
+        match = _METRICS_FILE_RE.search(filename)
+        if match is None or _is_alive(int(match.group(1))):
+            continue
+        try:
+            os.remove(os.path.join(metrics_dir, filename))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """Times every http request and counts the uploads in progress."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        is_upload = method in ("POST", "PUT") and scope["path"].startswith("/upload")
+        if is_upload:
+            ACTIVE_UPLOADS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if is_upload:
+                ACTIVE_UPLOADS.labels(method).dec()
+            # The route template, not the path, keeps the number of series bounded.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            REQUESTS.labels(method, route, str(status[0])).inc()
+
+
+def sample_executors(executors: dict[str, ThreadPoolExecutor]) -> None:
+    """Records the queue depth of the executors."""
+    for name, executor in executors.items():
+        depth = executor._work_queue.qsize()  # pylint: disable=protected-access
+        EXECUTOR_QUEUE.labels(name).set(depth)
+
+
+async def metrics_sampler(executors: dict[str, ThreadPoolExecutor]) -> None:
+    """Samples the executor queue depths forever."""
+    while True:
+        sample_executors(executors)
+        await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+
+
+def start_metrics_sampler(executors: dict[str, ThreadPoolExecutor]) -> None:
+    """Starts sampling on the current event loop."""
+    global _sampler_task  # pylint: disable=global-statement
+    if _sampler_task is None:
+        _sampler_task = asyncio.create_task(metrics_sampler(executors))
+
+
+async def stop_metrics_sampler() -> None:
+    """Stops sampling and drops the live gauges of this worker."""
+    global _sampler_task  # pylint: disable=global-statement
+    if _sampler_task is not None:
+        _sampler_task.cancel()
+        try:
+            await _sampler_task
+        except asyncio.CancelledError:
+            pass
+        _sampler_task = None
+    multiprocess.mark_process_dead(os.getpid())
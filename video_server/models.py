@@ -3,24 +3,32 @@ Models for the database ORM
 """
 
 import atexit
+import hashlib
+import json
 import os
+import time
 from datetime import datetime
-from filelock import FileLock
 
 from peewee import DatabaseProxy  # type: ignore
 from peewee import (
+    BigIntegerField,
+    BooleanField,
     CharField,
     DateTimeField,
     IntegerField,  # type: ignore
     Model,
     AutoField,
     FloatField,
+    TextField,
 )
+from playhouse.migrate import SqliteMigrator, migrate  # type: ignore
 from playhouse.shortcuts import model_to_dict  # type: ignore
 from playhouse.sqlite_ext import SqliteExtDatabase  # type: ignore
 
 from video_server.log import log
-from video_server.settings import DATA_ROOT, STARTUP_LOCK
+from video_server.metrics import observe_sql
+from video_server.once import run_once
+from video_server.settings import DATA_ROOT, make_data_dirs
 
 __all__ = ["db_proxy"]  # type: ignore
 
@@ -29,11 +37,6 @@ DB_TIMEOUT = 10
 
 db_proxy: DatabaseProxy = DatabaseProxy()
 
-db_dir = os.path.dirname(DB_PATH)
-# if dir doesn't exist
-if not os.path.exists(db_dir):
-    log.info("Creating db directory %s", db_dir)
-    os.makedirs(db_dir, exist_ok=True)
 pragmas = (
     ("cache_size", -1024 * 16),  # 16MB page-cache.
     ("journal_mode", "wal2"),
@@ -41,13 +44,26 @@ pragmas = (
     ("synchronous", 1),
 )
 log.info("Using database %s", DB_PATH)
-sqlite_db = SqliteExtDatabase(
+
+
+class TimedSqliteDatabase(SqliteExtDatabase):  # pylint: disable=abstract-method
+    """SqliteExtDatabase that records how long every statement takes."""
+
+    def execute_sql(self, sql, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            observe_sql(sql, time.perf_counter() - start)
+
+
+sqlite_db = TimedSqliteDatabase(
     str(DB_PATH),
     timeout=DB_TIMEOUT,
     pragmas=pragmas,
     check_same_thread=False,  # Allows multiple threads to access the database.
 )
-sqlite_db.connect()
+# The connection is opened on the first query, not when the worker imports this.
 atexit.register(sqlite_db.close)
 db_proxy.initialize(sqlite_db)
 
@@ -89,13 +105,104 @@ class Video(BaseModel):
     views = IntegerField(default=0)
     iframe = CharField(null=False, default="")
     duration = FloatField(default=0)
+    previews = TextField(null=False, default="{}")  # json, posters and storyboard urls
+    # False while the ingest job still runs, such videos are left out of the listings.
+    ready = BooleanField(null=False, default=True)
+
+    class Meta:  # pylint: disable=too-few-public-methods
+        """Composite indexes for the keyset pagination of /api/videos."""
 
+        indexes = (
+            (("published", "id"), False),
+            (("views", "id"), False),
+            (("duration", "id"), False),
+        )
 
-class BadLogin(BaseModel):
-    """Login model."""
 
+class IngestJob(BaseModel):
+    """Background ingest job, see video_server/jobs.py for the state machine."""
+
+    id = AutoField()
+    title = CharField(null=False, index=True)
+    kind = CharField(null=False)
+    state = CharField(null=False, index=True, default="queued")
+    video_dir = CharField(null=False)
+    params = TextField(null=False, default="{}")  # json
+    vid_id = IntegerField(null=True)
+    attempts = IntegerField(default=0)
+    error = TextField(null=False, default="")
+    progress = TextField(null=False, default="{}")  # json, percent per file
     created = DateTimeField(index=True, default=datetime.now)
+    updated = DateTimeField(default=datetime.now)
+
+
+class ProbeCache(BaseModel):
+    """Cached ffprobe output, valid while the size and mtime of the file are unchanged."""
+
+    path = CharField(null=False, unique=True, index=True)
+    size = BigIntegerField(null=False)
+    mtime_ns = BigIntegerField(null=False)
+    data = TextField(null=False)  # json from ffprobe
+
+
+class FileEntry(BaseModel):
+    """A file under WWW_ROOT, kept up to date by video_server/manifest.py."""
+
+    path = CharField(null=False, unique=True, index=True)  # relative to WWW_ROOT, "/" separated
+    size = BigIntegerField(null=False)
+    mtime_ns = BigIntegerField(null=False)
+    sha256 = CharField(null=False, index=True)
+
+
+def add_missing_columns(models: list) -> None:
+    """Adds columns that were added to the models after their table was created."""
+    migrator = SqliteMigrator(sqlite_db)
+    for model in models:
+        table = model._meta.table_name  # pylint: disable=protected-access
+        existing = {column.name for column in sqlite_db.get_columns(table)}
+        fields = model._meta.sorted_fields  # pylint: disable=protected-access
+        missing = [field for field in fields if field.column_name not in existing]
+        for field in missing:
+            log.info("Adding column %s.%s", table, field.column_name)
+            migrate(migrator.add_column(table, field.column_name, field))
+
+
+class CatalogState(BaseModel):
+    """Single row with the catalog generation, bumped on every change to Video."""
+
+    id = AutoField()
+    generation = BigIntegerField(null=False, default=0)
+    # Unix time of the last bump for view counts, which are rate limited.
+    views_bumped = FloatField(null=False, default=0)
+
+
+ALL_MODELS = [Video, IngestJob, ProbeCache, CatalogState, FileEntry]
+# Tables of models that were removed, dropped from existing databases.
+DROPPED_TABLES = ["badlogin"]
+
+
+def init_db() -> None:
+    """Creates the data directories and the tables and adds the new columns."""
+    make_data_dirs()
+    db_proxy.create_tables(ALL_MODELS, safe=True)
+    add_missing_columns(ALL_MODELS)
+    for table in DROPPED_TABLES:
+        sqlite_db.execute_sql(f'DROP TABLE IF EXISTS "{table}"')
+    CatalogState.insert(id=1, generation=0).on_conflict_ignore().execute()
+
+
+def schema_fingerprint() -> str:
+    """Changes when a model changes or the database file is replaced."""
+    try:
+        inode = os.stat(DB_PATH).st_ino
+    except FileNotFoundError:
+        inode = 0
+    schema = []
+    for model in ALL_MODELS:
+        meta = model._meta  # pylint: disable=protected-access,no-member
+        schema.append([meta.table_name, [field.column_name for field in meta.sorted_fields]])
+    return hashlib.sha1(json.dumps([inode, schema]).encode("utf-8")).hexdigest()
 
 
-with FileLock(STARTUP_LOCK).acquire(timeout=10):
-    db_proxy.create_tables([Video, BadLogin], safe=True)
+# Only the first worker to start after a schema change touches the database here.
+run_once("database", schema_fingerprint, init_db)
@@ -0,0 +1,45 @@
+"""
+Setup steps that run once per DATA_ROOT instead of once per worker.
+
+A step leaves a stamp file with the fingerprint of what it set up. Workers that
+find a matching stamp skip the step without taking any lock, otherwise the
+first of them runs it under STARTUP_LOCK and the others wait for it.
+"""
+
+import os
+from typing import Callable, Optional
+
+from filelock import FileLock
+
+from video_server.settings import DATA_ROOT, STARTUP_LOCK
+
+STARTUP_LOCK_TIMEOUT = 120
+
+
+def _stamp_path(name: str) -> str:
+    return os.path.join(DATA_ROOT, f"{name}.stamp")
+
+
+def _read_stamp(name: str) -> Optional[str]:
+    try:
+        with open(_stamp_path(name), encoding="utf-8", mode="r") as filed:
+            return filed.read()
+    except FileNotFoundError:
+        return None
+
+
+def run_once(name: str, fingerprint: Callable[[], str], func: Callable[[], None]) -> bool:
+    """Runs func unless it already ran for the current fingerprint, returns True if it ran."""
+    if _read_stamp(name) == fingerprint():
+        return False
+    os.makedirs(DATA_ROOT, exist_ok=True)
+    with FileLock(STARTUP_LOCK).acquire(timeout=STARTUP_LOCK_TIMEOUT):
+        if _read_stamp(name) == fingerprint():
+            return False  # Another worker did it while we waited.
+        func()
+        tmp_path = f"{_stamp_path(name)}.{os.getpid()}"
+        with open(tmp_path, encoding="utf-8", mode="w") as filed:
+            # The fingerprint may include what func created, so compute it again.
+            filed.write(fingerprint())
+        os.replace(tmp_path, _stamp_path(name))
+    return True
@@ -11,6 +11,14 @@ fetch(videoJson, { method: 'GET' })
             console.log("\n")
             const $player = document.getElementById("player");
             const videos = videoJson.videos;
+            // Browsers with native hls (Safari, iOS) get adaptive bitrate switching,
+            // everyone else falls through to the progressive mp4 sources.
+            if (videoJson.hls && $player.canPlayType('application/vnd.apple.mpegurl')) {
+                const $hlsElement = document.createElement('source');
+                $hlsElement.setAttribute('src', videoJson.hls.master);
+                $hlsElement.setAttribute('type', 'application/vnd.apple.mpegurl');
+                $player.appendChild($hlsElement);
+            }
             for (const video of videos) {
                 const $sourceElement = document.createElement('source');
                 $sourceElement.setAttribute('src', video.file_url);
@@ -47,7 +55,15 @@ fetch(videoJson, { method: 'GET' })
             // Change the second argument to your options:
             // https://github.com/sampotts/plyr/#options
             // Expose player so it can be used from the console
-            globalThis.player = new Plyr('video', { captions: { active: true } });
+            const options = { captions: { active: true } }
+            if (videoJson.storyboard) {
+                // Scrub previews from the sprite storyboard.
+                options.previewThumbnails = { enabled: true, src: videoJson.storyboard.vtt }
+            }
+            if (videoJson.posters) {
+                $player.setAttribute("poster", videoJson.posters.large.jpg)
+            }
+            globalThis.player = new Plyr('video', options);
         })
     })
     .catch((error) => {
@@ -3,10 +3,17 @@ function initMobileVideo(videoJson) {
     const $videoSource = document.getElementById("video-source")
     const videos = videoJson.videos;
     const video = videos[0]
-    $videoSource.src = video.file_url
+    if (videoJson.hls) {
+        // video.js plays hls on all browsers and switches quality adaptively.
+        $videoSource.src = videoJson.hls.master
+        $videoSource.type = "application/x-mpegURL"
+    } else {
+        $videoSource.src = video.file_url
+    }
     // Add videoJson to the dom.
     const $vid = document.getElementById('vid1');
-    $vid.setAttribute("poster", videoJson.poster)
+    // Phones get the medium poster instead of the full size thumbnail.
+    $vid.setAttribute("poster", videoJson.posters ? videoJson.posters.medium.jpg : videoJson.poster)
     let isFirst = true
     const subtitles = videoJson.subtitles || []
     for (const subtitle of subtitles) {
@@ -0,0 +1,47 @@
+"""
+One time setup of DATA_ROOT, run before uvicorn forks its workers:
+
+    python -m video_server.prefork
+    uvicorn --workers 100 video_server.app:app
+
+Creates the directories, tables and session secret, removes the metrics files
+of dead workers and syncs the static files. Every step leaves a stamp in
+DATA_ROOT, so the workers start without touching the database or the file
+system beyond reading the stamps. When this was not run the first worker does
+the same work under STARTUP_LOCK instead.
+"""
+
+import time
+
+from video_server import models  # noqa: F401  # pylint: disable=unused-import
+from video_server.auth import init_auth
+from video_server.generate_files import ensure_static_files
+from video_server.log import log
+from video_server.metrics import remove_dead_process_files
+from video_server.settings import WWW_ROOT, make_data_dirs
+
+
+def init_data_root() -> None:
+    """Runs the setup steps that are not up to date yet."""
+    start = time.monotonic()
+    # Importing models already brought the database up to date. The directories
+    # are made again in case METRICS_DIR is on a tmpfs that was cleared.
+    make_data_dirs()
+    init_auth()
+    # Samples of workers from an earlier run would be summed with the new ones.
+    remove_dead_process_files()
+    synced = ensure_static_files(WWW_ROOT)
+    log.info(
+        "Data root ready in %.2f seconds, static files %s",
+        time.monotonic() - start,
+        "synced" if synced else "up to date",
+    )
+
+
+def main() -> None:
+    """Entry point for python -m video_server.prefork."""
+    init_data_root()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Poster sizes and the seek preview storyboard.
+
+One ffmpeg decode of the smallest rendition writes the tiled storyboard sprites,
+plus the poster frame when there is no thumbnail.jpg yet. The poster sizes are
+then resized from thumbnail.jpg, so uploaded thumbnails are kept.
+
+Layout in the video dir:
+  thumbnail.jpg - the full size poster, as before.
+  posters/{small,medium,large}.{jpg,webp}
+  storyboard/sprite_001.jpg ... - TILE_COLUMNS x TILE_ROWS tiles per sheet.
+  storyboard/storyboard.vtt - WebVTT thumbnail track with #xywh= cues.
+"""
+
+import math
+import os
+import shutil
+import subprocess
+from typing import Optional
+
+from PIL import Image  # type: ignore
+
+from video_server.log import log
+from video_server.probe import probe
+
+POSTER_DIR = "posters"
+STORYBOARD_DIR = "storyboard"
+STORYBOARD_VTT = "storyboard.vtt"
+POSTER_WIDTHS = {"small": 320, "medium": 640, "large": 1280}
+TILE_WIDTH = 160
+TILE_COLUMNS = 10
+TILE_ROWS = 10
+MIN_TILE_INTERVAL = 2.0  # seconds
+MAX_TILES = 300
+
+
+def tile_interval(duration: float) -> float:
+    """Seconds between storyboard tiles, long videos get sparser tiles."""
+    return max(MIN_TILE_INTERVAL, duration / MAX_TILES)
+
+
+def _timestamp(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+
+def storyboard_vtt(
+    duration: float, interval: float, tile_width: int, tile_height: int
+) -> str:
+    """Returns the WebVTT thumbnail track for sprites written by make_storyboard."""
+    per_sheet = TILE_COLUMNS * TILE_ROWS
+    lines = ["WEBVTT", ""]
+    for index in range(max(math.ceil(duration / interval), 1)):
+        start = index * interval
+        end = min(start + interval, duration)
+        sheet, tile = divmod(index, per_sheet)
+        row, column = divmod(tile, TILE_COLUMNS)
+        xywh = f"{column * tile_width},{row * tile_height},{tile_width},{tile_height}"
+        lines.append(f"{_timestamp(start)} --> {_timestamp(end)}")
+        lines.append(f"sprite_{sheet + 1:03d}.jpg#xywh={xywh}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def make_storyboard(vidfile: str, out_dir: str, out_thumbnail: Optional[str] = None) -> dict:
+    """
+    Writes the storyboard sprites and vtt for vidfile into out_dir/storyboard,
+    and the first frame to out_thumbnail if given, in a single ffmpeg pass.
+    """
+    info = probe(vidfile)
+    assert info.width and info.height and info.duration, f"Can't probe {vidfile}"
+    interval = tile_interval(info.duration)
+    tile_height = max(2, round(TILE_WIDTH * info.height / info.width / 2) * 2)
+    storyboard_dir = os.path.join(out_dir, STORYBOARD_DIR)
+    shutil.rmtree(storyboard_dir, ignore_errors=True)
+    os.makedirs(storyboard_dir)
+    sprites = (
+        f"fps=1/{interval},scale={TILE_WIDTH}:{tile_height},"
+        f"tile={TILE_COLUMNS}x{TILE_ROWS}"
+    )
+    cmd = ["static_ffmpeg", "-hide_banner", "-y", "-i", vidfile]
+    if out_thumbnail is not None:
+        cmd += ["-filter_complex", f"[0:v]split=2[poster][tiles];[tiles]{sprites}[sprites]"]
+        cmd += ["-map", "[poster]", "-frames:v", "1", "-q:v", "3", out_thumbnail]
+    else:
+        cmd += ["-filter_complex", f"[0:v]{sprites}[sprites]"]
+    cmd += ["-map", "[sprites]", "-q:v", "5", os.path.join(storyboard_dir, "sprite_%03d.jpg")]
+    log.info("Running:\n  %s", subprocess.list2cmdline(cmd))
+    subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    vtt = storyboard_vtt(info.duration, interval, TILE_WIDTH, tile_height)
+    with open(os.path.join(storyboard_dir, STORYBOARD_VTT), encoding="utf-8", mode="w") as filed:
+        filed.write(vtt)
+    return {
+        "vtt": f"{STORYBOARD_DIR}/{STORYBOARD_VTT}",
+        "interval": interval,
+        "tile_width": TILE_WIDTH,
+        "tile_height": tile_height,
+    }
+
+
+def make_posters(thumbnail: str, out_dir: str) -> dict:
+    """Writes the jpg and webp poster sizes of thumbnail, never upscaling."""
+    poster_dir = os.path.join(out_dir, POSTER_DIR)
+    os.makedirs(poster_dir, exist_ok=True)
+    out: dict = {}
+    with Image.open(thumbnail) as source:
+        img = source.convert("RGB")
+        for name, width in POSTER_WIDTHS.items():
+            width = min(width, img.width)
+            height = max(1, round(img.height * width / img.width))
+            resized = img.resize((width, height), Image.Resampling.LANCZOS)
+            resized.save(os.path.join(poster_dir, f"{name}.jpg"), "JPEG", quality=82)
+            resized.save(os.path.join(poster_dir, f"{name}.webp"), "WEBP", quality=80)
+            out[name] = {
+                "jpg": f"{POSTER_DIR}/{name}.jpg",
+                "webp": f"{POSTER_DIR}/{name}.webp",
+                "width": width,
+                "height": height,
+            }
+    return out
+
+
+def create_previews(vidfiles: list[str], out_dir: str) -> dict:
+    """
+    Makes the posters and the storyboard from the smallest rendition. Returns
+    {"posters": ..., "storyboard": ...} with paths relative to out_dir.
+    """
+    vidfile = min(vidfiles, key=lambda path: probe(path).height or 0)
+    thumbnail = os.path.join(out_dir, "thumbnail.jpg")
+    missing_thumbnail = not os.path.exists(thumbnail)
+    storyboard = make_storyboard(vidfile, out_dir, thumbnail if missing_thumbnail else None)
+    posters = make_posters(thumbnail, out_dir)
+    log.info("Created posters and storyboard in %s", out_dir)
+    return {"posters": posters, "storyboard": storyboard}
@@ -0,0 +1,94 @@
+"""
+Single ffprobe call per file with an in memory and sqlite backed cache.
+"""
+
+import json
+import os
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+from video_server.log import log
+from video_server.models import ProbeCache
+
+MAX_MEMORY_ENTRIES = 1024
+
+_cache: dict[tuple[str, int, int], "ProbeResult"] = {}
+_cache_lock = threading.Lock()
+
+
+@dataclass
+class ProbeResult:
+    """The parts of the ffprobe output that the server uses."""
+
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[float] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    raw: dict = field(default_factory=dict)
+
+    @property
+    def has_audio(self) -> bool:
+        """True if the file has an audio stream."""
+        return self.audio_codec is not None
+
+
+def parse_probe(data: dict) -> ProbeResult:
+    """Builds a ProbeResult from the json output of ffprobe."""
+    out = ProbeResult(raw=data)
+    for stream in data.get("streams", []):
+        codec_type = stream.get("codec_type")
+        if codec_type == "video" and out.video_codec is None:
+            out.video_codec = stream.get("codec_name")
+            out.width = stream.get("width")
+            out.height = stream.get("height")
+        elif codec_type == "audio" and out.audio_codec is None:
+            out.audio_codec = stream.get("codec_name")
+    duration = data.get("format", {}).get("duration")
+    if duration is not None:
+        out.duration = float(duration)
+    return out
+
+
+def run_ffprobe(path: str) -> dict:
+    """Runs ffprobe once and returns the streams and format as a dict."""
+    cmd = [
+        "static_ffprobe",
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_streams",
+        "-show_format",
+        path,
+    ]
+    log.info("Running:\n  %s", subprocess.list2cmdline(cmd))
+    stdout = subprocess.check_output(cmd)
+    return json.loads(stdout)
+
+
+def probe(path: str) -> ProbeResult:
+    """Returns the probe result for the file, only running ffprobe on a cache miss."""
+    path = os.path.abspath(path)
+    stat_result = os.stat(path)
+    key = (path, stat_result.st_size, stat_result.st_mtime_ns)
+    with _cache_lock:
+        result = _cache.get(key)
+    if result is not None:
+        return result
+    row = ProbeCache.get_or_none(ProbeCache.path == path)
+    if row is not None and row.size == key[1] and row.mtime_ns == key[2]:
+        result = parse_probe(json.loads(row.data))
+    else:
+        data = run_ffprobe(path)
+        ProbeCache.insert(
+            path=path, size=key[1], mtime_ns=key[2], data=json.dumps(data)
+        ).on_conflict_replace().execute()
+        result = parse_probe(data)
+    with _cache_lock:
+        if len(_cache) >= MAX_MEMORY_ENTRIES:
+            _cache.clear()
+        _cache[key] = result
+    return result
@@ -2,11 +2,13 @@
 Generates an RSS feed from the video library.
 """
 
-from peewee import ModelSelect  # type: ignore
+from typing import Iterable, Iterator, Optional
+
 from video_server.models import Video
 
 
-def _rss_item(vid: Video) -> str:
+def rss_item(vid: Video) -> str:
+    """Returns the feed item of one video."""
     views = "0" if vid.views == "?" else vid.views
 
     def cdata(inner: str) -> str:
@@ -30,19 +32,28 @@ def _rss_item(vid: Video) -> str:
 """
 
 
-def rss(channel_name: str) -> str:
+def rss_header(channel_name: str) -> str:
+    """The part of the feed before the items."""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>{channel_name}</title>"""
+
+
+RSS_FOOTER = "  </channel>\n</rss>"
+
+
+def rss_items(vids: Iterable[Video]) -> Iterator[str]:
+    """Yields the feed items one video at a time."""
+    for video in vids:
+        yield rss_item(video)
+
+
+def rss(channel_name: str, vids: Optional[Iterable[Video]] = None) -> str:
     """
-    Returns a list of RSS items as a string.
+    Returns a list of RSS items as a string. The videos are queried unless given,
+    newest first.
     """
-    out = """<?xml version="1.0" encoding="UTF-8"?>
-<rss version="2.0">
-"""
-    out += "  <channel>\n"
-    out += f"    <title>{channel_name}</title>"
-
-    vids: ModelSelect = Video.select().order_by(Video.published.desc())
-    for video in vids:  # pylint: disable=not-an-iterable
-        out += _rss_item(video)
-    out += "  </channel>\n"
-    out += "</rss>"
-    return out
+    if vids is None:
+        vids = Video.select().where(Video.ready).order_by(Video.published.desc())
+    return "".join([rss_header(channel_name), *rss_items(vids), RSS_FOOTER])
@@ -25,9 +25,21 @@ WWW_ROOT = os.path.join(DATA_ROOT, "www")
 VIDEO_ROOT = os.path.join(WWW_ROOT, "v")
 APP_DB = os.path.join(DATA_ROOT, "app.sqlite")
 LOGFILE = os.path.join(DATA_ROOT, "log.txt")
+UPLOAD_SESSIONS_ROOT = os.path.join(DATA_ROOT, "uploads")
+# Content addressed store of the uploaded sources and their encodes, the title
+# directories link to it. Must be on the same file system as WWW_ROOT.
+BLOB_ROOT = os.path.join(DATA_ROOT, "blobs")
+# prometheus_client multiprocess files of the workers, summed by /metrics.
+METRICS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", os.path.join(DATA_ROOT, "metrics"))
+
+DATA_DIRS = [DATA_ROOT, WWW_ROOT, VIDEO_ROOT, UPLOAD_SESSIONS_ROOT, BLOB_ROOT, METRICS_DIR]
+
+
+def make_data_dirs() -> None:
+    """Creates the data directories, done once by video_server/prefork.py."""
+    for mydir in DATA_DIRS:
+        os.makedirs(mydir, exist_ok=True)
 
-for mydir in [DATA_ROOT, WWW_ROOT, VIDEO_ROOT]:
-    os.makedirs(mydir, exist_ok=True)
 
 ENCODING_HEIGHTS = [
     int(v) for v in os.environ.get("ENCODING_HEIGHTS", "1080,720,480").split(",")
@@ -35,12 +47,22 @@ ENCODING_HEIGHTS = [
 ENCODING_CRF = int(os.environ.get("ENCODING_CRF", 28))
 NUMBER_OF_ENCODING_THREADS: int = int(os.environ.get("NUMBER_OF_THREADS", 4))
 ENCODER_PRESET = os.environ.get("ENCODER_PRESET", "veryslow")
+# Decode the source once and write every height in one ffmpeg run.
+SINGLE_PASS_ENCODE = os.environ.get("SINGLE_PASS_ENCODE", "1") == "1"
 IS_TEST = os.environ.get("IS_TEST", "0") == "1"
 STARTUP_LOCK = os.path.join(DATA_ROOT, "startup.lock")
 LOGFILE = os.path.join(DATA_ROOT, "log.txt")
 LOGFILELOCK = os.path.join(DATA_ROOT, "log.txt.lock")
+# log.txt is rotated when it passes LOG_MAX_BYTES or is older than LOG_ROTATE_SECONDS,
+# keeping LOG_BACKUP_COUNT old files. LOG_JSON=1 writes json lines instead of text.
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_SECONDS = int(os.environ.get("LOG_ROTATE_SECONDS", str(60 * 60 * 24)))
+LOG_JSON = os.environ.get("LOG_JSON", "0") == "1"
 MAX_BAD_LOGINS_RESET_TIME = 60 * 10  # 10 minutes
 MAX_BAD_LOGINS = 10
+# Lifetime of the session cookie issued by /login, 30 days by default.
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(60 * 60 * 24 * 30)))
 PASSWORD = os.environ.get(
     "PASSWORD",
     "68fe2a982d12423ca59b699758684def",
@@ -52,6 +74,37 @@ WEBTORRENT_ENABLED = (
 NO_CLEANUP = os.environ.get("NO_CLEANUP", "0") == "1"
 WEBTORRENT_CHUNK_FACTOR = int(os.environ.get("WEBTORRENT_CHUNK_FACTOR", "17"))
 FILE_PORT = int(os.environ.get("FILE_PORT", "7777"))
+# Set to 1 to proxy static files through the node http-server sidecar on FILE_PORT
+# instead of serving them in process.
+USE_HTTP_SERVER = os.environ.get("USE_HTTP_SERVER", "0") == "1"
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "8888"))
 HEIGHTS = [1080, 720, 480]
+# Largest body accepted by /upload_stream, 32 GiB by default.
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", str(32 * 1024**3)))
+# Largest chunk accepted by the chunked upload api, 64 MiB by default.
+MAX_CHUNK_SIZE = int(os.environ.get("MAX_CHUNK_SIZE", str(64 * 1024**2)))
+# Chunked uploads that received no chunk for this many seconds are deleted, a day by default.
+UPLOAD_SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", str(24 * 3600)))
+# Also package the renditions as CMAF/fmp4 HLS with a master playlist.
+HLS_ENABLED = os.environ.get("HLS_ENABLED", "0") == "1"
+HLS_SEGMENT_SECONDS = int(os.environ.get("HLS_SEGMENT_SECONDS", "6"))
+# Background ingest jobs, at most this many run at once per host.
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "2"))
+MAX_JOB_ATTEMPTS = int(os.environ.get("MAX_JOB_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+JOB_RUNNER_LOCK = os.path.join(DATA_ROOT, "jobs.lock")
+# View counts are buffered per worker and written at most this many seconds late.
+VIEW_FLUSH_INTERVAL = float(os.environ.get("VIEW_FLUSH_INTERVAL", "5"))
+# View counts move the catalog generation, and with it the feed etags, at most this often.
+VIEW_CATALOG_INTERVAL = float(os.environ.get("VIEW_CATALOG_INTERVAL", "300"))
+# Parallel yt-dlp/ffmpeg processes per /upload_url ingest.
+URL_INGEST_CONCURRENCY = int(os.environ.get("URL_INGEST_CONCURRENCY", "3"))
+# Seconds an extracted yt-dlp info dict is reused for, format urls expire eventually.
+YTDLP_INFO_TTL = float(os.environ.get("YTDLP_INFO_TTL", "600"))
+# The file manifest is reconciled with WWW_ROOT by one worker per host at startup,
+# MANIFEST_WATCH=1 also applies changes made outside the server as they happen.
+MANIFEST_WATCH = os.environ.get("MANIFEST_WATCH", "0") == "1"
+MANIFEST_LOCK = os.path.join(DATA_ROOT, "manifest.lock")
+# Seconds between samples of the executor queue depths.
+METRICS_SAMPLE_INTERVAL = float(os.environ.get("METRICS_SAMPLE_INTERVAL", "5"))
 ENABLE_CLEAR = IS_TEST or os.environ.get("ENABLE_CLEAR", "0") == "1"
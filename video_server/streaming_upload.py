@@ -0,0 +1,232 @@
+"""
+Receives upload bodies straight from the ASGI stream into their final files.
+
+Unlike fastapi's UploadFile, nothing is spooled to memory or the temp dir first,
+so memory use is constant and uploads can be bigger than free RAM plus /tmp.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import IO, Any, Callable, Optional
+
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import Response
+
+from video_server.torrent import StreamHasher
+
+try:
+    from python_multipart import MultipartParser  # type: ignore
+    from python_multipart.multipart import parse_options_header  # type: ignore
+except ModuleNotFoundError:  # older python-multipart
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+
+WRITE_BUFFER_SIZE = 1024 * 1024 * 4
+
+
+class UploadTooLarge(Exception):
+    """Raised when the request body is larger than the allowed size."""
+
+
+class UploadFormatError(ValueError):
+    """Raised when the request body can't be parsed or the client went away."""
+
+
+class UploadRejected(Exception):
+    """Raised by a check_part callback to stop reading the body, with the response to send."""
+
+    def __init__(self, response: Response) -> None:
+        super().__init__(f"Upload rejected with {response.status_code}")
+        self.response = response
+
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@dataclass
+class ReceivedFile:
+    """A file part that was written to disk."""
+
+    field_name: str
+    filename: str
+    path: str
+    size: int = 0
+
+
+async def _iter_limited(request: Request, max_size: int):
+    """
+    Yields the request body chunks, raising UploadTooLarge past max_size and
+    UploadFormatError for an invalid Content-Length.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError as exc:
+            raise UploadFormatError(f"Invalid Content-Length {content_length!r}") from exc
+        if declared > max_size:
+            raise UploadTooLarge(f"Upload of {content_length} bytes exceeds {max_size}")
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_size:
+            raise UploadTooLarge(f"Upload exceeds {max_size} bytes")
+        yield chunk
+
+
+async def receive_raw(
+    request: Request,
+    dst: str,
+    max_size: int,
+    hasher: Optional[StreamHasher] = None,
+) -> int:
+    """
+    Writes the raw request body to dst, returns the number of bytes written. dst
+    is removed again if the body is cut short.
+    """
+    size = 0
+    try:
+        with open(dst, mode="wb", buffering=WRITE_BUFFER_SIZE) as filed:
+            async for chunk in _iter_limited(request, max_size):
+                filed.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                size += len(chunk)
+    except ClientDisconnect as exc:
+        _remove(dst)
+        raise UploadFormatError(f"Client disconnected after {size} bytes") from exc
+    except BaseException:
+        _remove(dst)
+        raise
+    return size
+
+
+class _MultipartWriter:  # pylint: disable=too-many-instance-attributes
+    """Callbacks for the multipart parser that write the file parts to their destinations."""
+
+    def __init__(
+        self,
+        destinations: dict[str, str],
+        hasher: Optional[StreamHasher],
+        hashed_field: str,
+        check_part: Optional[Callable[[str, str], None]] = None,
+    ) -> None:
+        self.destinations = destinations
+        self.hasher = hasher
+        self.hashed_field = hashed_field
+        self.check_part = check_part
+        self.received: dict[str, ReceivedFile] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.headers: dict[bytes, bytes] = {}
+        self.current: Optional[ReceivedFile] = None
+        self.filed: Optional[IO[bytes]] = None
+
+    def callbacks(self) -> Any:
+        """Returns the callbacks for MultipartParser."""
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        """A new part starts."""
+        self.headers = {}
+        self.current = None
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        """Part of a header name."""
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        """Part of a header value."""
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        """A header of the part is complete."""
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        """All headers are in, open the destination if this is a file we want."""
+        disposition = self.headers.get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        name = options.get(b"name", b"").decode("utf-8")
+        filename = options.get(b"filename", b"").decode("utf-8")
+        if not filename or name not in self.destinations or name in self.received:
+            return
+        if self.check_part is not None:
+            self.check_part(name, filename)  # raises UploadRejected before anything is written
+        self.current = ReceivedFile(
+            field_name=name, filename=filename, path=self.destinations[name]
+        )
+        # pylint: disable-next=consider-using-with
+        self.filed = open(self.current.path, mode="wb", buffering=WRITE_BUFFER_SIZE)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        """Body bytes of the current part."""
+        if self.current is None or self.filed is None:
+            return
+        chunk = data[start:end]
+        self.filed.write(chunk)
+        self.current.size += len(chunk)
+        if self.hasher is not None and self.current.field_name == self.hashed_field:
+            self.hasher.update(chunk)
+
+    def on_part_end(self) -> None:
+        """The current part is done."""
+        if self.current is not None and self.filed is not None:
+            self.filed.close()
+            self.received[self.current.field_name] = self.current
+        self.current = None
+        self.filed = None
+
+    def close(self) -> None:
+        """Closes and removes the file left partially written by a truncated body."""
+        if self.filed is not None:
+            self.filed.close()
+            self.filed = None
+        if self.current is not None:
+            _remove(self.current.path)
+            self.current = None
+
+
+async def receive_multipart(  # pylint: disable=too-many-arguments
+    request: Request,
+    destinations: dict[str, str],
+    max_size: int,
+    hasher: Optional[StreamHasher] = None,
+    hashed_field: str = "file",
+    check_part: Optional[Callable[[str, str], None]] = None,
+) -> dict[str, ReceivedFile]:
+    """
+    Parses a multipart/form-data body, writing each file field named in
+    destinations to its path. Other fields are skipped. check_part is called with
+    the field name and the filename of every file part before its body is read
+    and may raise UploadRejected to stop the upload.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadFormatError("Expected a multipart/form-data body with a boundary")
+    writer = _MultipartWriter(destinations, hasher, hashed_field, check_part)
+    parser = MultipartParser(options[b"boundary"], writer.callbacks())
+    try:
+        async for chunk in _iter_limited(request, max_size):
+            parser.write(chunk)
+        parser.finalize()
+    except (UploadTooLarge, UploadFormatError, UploadRejected):
+        raise
+    except ClientDisconnect as exc:
+        raise UploadFormatError("Client disconnected") from exc
+    except Exception as exc:  # pylint: disable=broad-except
+        raise UploadFormatError(f"Malformed multipart body: {exc}") from exc
+    finally:
+        writer.close()
+    return writer.received
@@ -0,0 +1,255 @@
+"""
+Pure python torrent writer, replaces the mktorrent binary.
+
+Piece hashing is done over mmap'ed files in a process pool. This module only
+imports the standard library so that the pool processes start quickly.
+"""
+
+import atexit
+import hashlib
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Union
+
+CREATED_BY = "video-server"
+# Files with fewer pieces than this are hashed in the calling thread.
+MIN_PIECES_FOR_POOL = 64
+# Number of pieces hashed by one pool task.
+PIECES_PER_TASK = 256
+# Sidecar file with piece hashes computed while the file was received.
+PIECES_SUFFIX = ".pieces"
+_PIECES_HEADER = struct.Struct(">QQQ")  # piece length, file size, mtime_ns
+
+_pool: Optional[ProcessPoolExecutor] = None  # pylint: disable=invalid-name
+_pool_lock = threading.Lock()
+
+Bencodable = Union[int, str, bytes, list, dict]
+
+
+def bencode(value: Bencodable) -> bytes:
+    """Bencodes ints, strings, bytes, lists and dicts."""
+    if isinstance(value, bool):
+        raise TypeError("Cannot bencode a bool")
+    if isinstance(value, int):
+        return b"i%de" % value
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if isinstance(value, bytes):
+        return b"%d:%s" % (len(value), value)
+    if isinstance(value, list):
+        return b"l" + b"".join(bencode(item) for item in value) + b"e"
+    if isinstance(value, dict):
+        items = []
+        # Keys are sorted as raw bytes.
+        keys = sorted((k.encode("utf-8") if isinstance(k, str) else k, k) for k in value)
+        for raw_key, key in keys:
+            items.append(bencode(raw_key) + bencode(value[key]))
+        return b"d" + b"".join(items) + b"e"
+    raise TypeError(f"Cannot bencode {type(value)}")
+
+
+def _get_pool(max_workers: Optional[int]) -> ProcessPoolExecutor:
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            # spawn avoids forking the threads of the uvicorn worker.
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+@atexit.register
+def close_pool() -> None:
+    """Shuts down the hashing processes."""
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def hash_pieces(path: str, piece_length: int, offset: int, length: int) -> bytes:
+    """Returns the concatenated sha1 digests of the pieces in [offset, offset + length)."""
+    if length <= 0:
+        return b""
+    with open(path, mode="rb") as filed:
+        with mmap.mmap(filed.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                digests = [
+                    hashlib.sha1(view[pos : min(pos + piece_length, offset + length)]).digest()
+                    for pos in range(offset, offset + length, piece_length)
+                ]
+            finally:
+                view.release()
+    return b"".join(digests)
+
+
+def hash_file(path: str, piece_length: int, max_workers: Optional[int] = None) -> bytes:
+    """Returns the sha1 piece hashes for the whole file, using the process pool if it is big."""
+    size = os.path.getsize(path)
+    num_pieces = (size + piece_length - 1) // piece_length
+    if num_pieces < MIN_PIECES_FOR_POOL:
+        return hash_pieces(path, piece_length, 0, size)
+    pool = _get_pool(max_workers)
+    task_size = piece_length * PIECES_PER_TASK
+    futures = [
+        pool.submit(hash_pieces, path, piece_length, start, min(task_size, size - start))
+        for start in range(0, size, task_size)
+    ]
+    return b"".join(future.result() for future in futures)
+
+
+class PieceHasher:
+    """Incrementally computes the sha1 piece hashes of a stream."""
+
+    def __init__(self, piece_length: int) -> None:
+        self.piece_length = piece_length
+        self.digests: list[bytes] = []
+        self.current = hashlib.sha1()
+        self.current_size = 0
+
+    def update(self, data: bytes) -> None:
+        """Feeds the next bytes of the stream."""
+        view = memoryview(data)
+        while view:
+            take = min(self.piece_length - self.current_size, len(view))
+            self.current.update(view[:take])
+            self.current_size += take
+            view = view[take:]
+            if self.current_size == self.piece_length:
+                self.digests.append(self.current.digest())
+                self.current = hashlib.sha1()
+                self.current_size = 0
+
+    def pieces(self) -> bytes:
+        """Returns the concatenated piece hashes, including the trailing partial piece."""
+        tail = [self.current.digest()] if self.current_size else []
+        return b"".join(self.digests + tail)
+
+
+class StreamHasher:
+    """Computes the torrent pieces and a sha256 content digest while a file is written."""
+
+    def __init__(self, piece_length: int) -> None:
+        self.piece_hasher = PieceHasher(piece_length)
+        self.content = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        """Feeds the next bytes of the stream."""
+        self.piece_hasher.update(data)
+        self.content.update(data)
+        self.size += len(data)
+
+    def content_digest(self) -> str:
+        """Returns the hex sha256 of everything fed so far."""
+        return self.content.hexdigest()
+
+    def save_pieces(self, path: str) -> None:
+        """Writes the pieces sidecar for the finished file at path."""
+        assert os.path.getsize(path) == self.size, f"{path} does not match the hashed stream"
+        save_pieces(path, self.piece_hasher.piece_length, self.piece_hasher.pieces())
+
+
+def save_pieces(path: str, piece_length: int, pieces: bytes) -> None:
+    """Writes the pieces sidecar for the file at path."""
+    stat_result = os.stat(path)
+    header = _PIECES_HEADER.pack(piece_length, stat_result.st_size, stat_result.st_mtime_ns)
+    tmp_path = f"{path}{PIECES_SUFFIX}.{os.getpid()}"
+    with open(tmp_path, mode="wb") as filed:
+        filed.write(header + pieces)
+    os.replace(tmp_path, path + PIECES_SUFFIX)
+
+
+def load_pieces(path: str, piece_length: int) -> Optional[bytes]:
+    """Returns the precomputed pieces for path, None if missing or stale."""
+    try:
+        with open(path + PIECES_SUFFIX, mode="rb") as filed:
+            data = filed.read()
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if len(data) < _PIECES_HEADER.size:
+        return None
+    header = _PIECES_HEADER.unpack_from(data)
+    if header != (piece_length, stat_result.st_size, stat_result.st_mtime_ns):
+        return None
+    return data[_PIECES_HEADER.size :]
+
+
+def move_with_pieces(src: str, dst: str) -> None:
+    """Moves a file along with its pieces sidecar, if it has one."""
+    shutil.move(src, dst)
+    if os.path.exists(src + PIECES_SUFFIX):
+        shutil.move(src + PIECES_SUFFIX, dst + PIECES_SUFFIX)
+
+
+def build_torrent(  # pylint: disable=too-many-arguments
+    name: str,
+    length: int,
+    pieces: bytes,
+    piece_length: int,
+    tracker_announce_list: list[str],
+    webseed: Optional[str] = None,
+) -> bytes:
+    """Returns the bencoded single file torrent, laid out like mktorrent does."""
+    torrent: dict = {
+        "created by": CREATED_BY,
+        "creation date": int(time.time()),
+        "info": {
+            "length": length,
+            "name": name,
+            "piece length": piece_length,
+            "pieces": pieces,
+        },
+    }
+    if tracker_announce_list:
+        torrent["announce"] = tracker_announce_list[0]
+        # Every tracker is its own tier, same as passing -a multiple times to mktorrent.
+        torrent["announce-list"] = [[tracker] for tracker in tracker_announce_list]
+    if webseed:
+        torrent["url-list"] = [webseed]
+    return bencode(torrent)
+
+
+def make_torrent(  # pylint: disable=too-many-arguments
+    vidfile: str,
+    torrent_path: str,
+    tracker_announce_list: list[str],
+    chunk_factor: int,
+    webseed: Optional[str] = None,
+    max_workers: Optional[int] = None,
+) -> None:
+    """
+    Writes the torrent for vidfile. The piece length is 2^chunk_factor, like
+    mktorrent -l. Pieces hashed while the file was uploaded are used when they
+    are still valid, otherwise the file is read and hashed. When vidfile links
+    into the blob store the pieces are kept next to the blob, so every title
+    that shares the file reuses them.
+    """
+    piece_length = 1 << chunk_factor
+    source = os.path.realpath(vidfile) if os.path.islink(vidfile) else vidfile
+    pieces = load_pieces(source, piece_length)
+    if pieces is None:
+        pieces = hash_file(source, piece_length, max_workers=max_workers)
+        if source != vidfile:
+            save_pieces(source, piece_length, pieces)
+    if source == vidfile and os.path.exists(vidfile + PIECES_SUFFIX):
+        os.remove(vidfile + PIECES_SUFFIX)
+    data = build_torrent(
+        name=os.path.basename(vidfile),
+        length=os.path.getsize(vidfile),
+        pieces=pieces,
+        piece_length=piece_length,
+        tracker_announce_list=tracker_announce_list,
+        webseed=webseed,
+    )
+    tmp_path = f"{torrent_path}.tmp"
+    with open(tmp_path, mode="wb") as filed:
+        filed.write(data)
+    os.replace(tmp_path, torrent_path)
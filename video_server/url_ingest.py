@@ -0,0 +1,276 @@
+"""
+Non-blocking ingest of a video url with yt-dlp.
+
+yt-dlp runs in process through video_server/extractor.py, ffmpeg runs as asyncio
+subprocesses. The renditions and the audio track download concurrently, capped
+at URL_INGEST_CONCURRENCY per ingest. The audio track is downloaded at most once
+and muxed into every silent rendition in parallel.
+"""
+
+# pylint: disable=logging-fstring-interpolation,too-many-locals
+
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import time
+from typing import Callable, Optional
+
+from PIL import Image  # type: ignore
+
+from video_server import extractor
+from video_server.log import log
+from video_server.settings import HEIGHTS, URL_INGEST_CONCURRENCY
+from video_server.util import download_file, get_video_height, has_audio
+
+PROGRESS_INTERVAL = 1.0  # seconds between progress reports
+
+ProgressCallback = Callable[[dict], None]
+
+
+class UrlIngestError(Exception):
+    """Raised when the url can't be ingested."""
+
+
+def compact_formats(info: dict) -> list[dict]:
+    """Returns the parts of the yt-dlp formats that the ingest needs."""
+    keys = ["format_id", "ext", "height", "abr", "acodec", "vcodec"]
+    return [{key: fmt.get(key) for key in keys} for fmt in info.get("formats") or []]
+
+
+async def run_cmd(cmd: list[str]) -> str:
+    """Runs a command as an asyncio subprocess and returns stdout, raises on failure."""
+    log.info("Running command:\n  %s", subprocess.list2cmdline(cmd))
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    try:
+        output, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    stdout = output.decode("utf-8", errors="replace")
+    if proc.returncode != 0:
+        raise UrlIngestError(f"{cmd[0]} failed with {proc.returncode}:\n{stdout[-2000:]}")
+    return stdout
+
+
+async def extract_info(url: str) -> dict:
+    """Returns the yt-dlp info dict of the url, cached by the extractor service."""
+    try:
+        return await extractor.extract_info(url)
+    except extractor.ExtractorError as exc:
+        raise UrlIngestError(str(exc)) from exc
+
+
+async def ytdlp_download(
+    url: str, format_spec: str, outfile: str, on_percent: Callable[[float], None]
+) -> None:
+    """Downloads one format with yt-dlp, reporting the percentage as it goes."""
+    try:
+        await extractor.download(url, format_spec, outfile, on_percent)
+    except extractor.ExtractorError as exc:
+        raise UrlIngestError(str(exc)) from exc
+
+
+async def async_add_audio(audiopath: str, videopath: str) -> None:
+    """Muxes the audio track into the video, replacing the video file."""
+    log.info("Adding audio to %s", videopath)
+    tmp_path = os.path.join(os.path.dirname(videopath), f".mux.{os.path.basename(videopath)}")
+    cmd = [
+        "static_ffmpeg",
+        "-y",
+        "-i",
+        videopath,
+        "-i",
+        audiopath,
+        "-c:v",
+        "copy",
+        "-c:a",
+        "aac",
+        "-strict",
+        "experimental",
+        tmp_path,
+    ]
+    await run_cmd(cmd)
+    os.replace(tmp_path, videopath)
+
+
+def match_formats(vidinfos: list[tuple[int, str]]) -> dict[int, Optional[str]]:
+    """
+    Matches the (height, format_id) videos to the HEIGHTS, rounding up when
+    necessary, largest height first.
+    """
+    vidinfos = sorted(vidinfos, key=lambda x: x[0])
+    sizemap: dict[int, Optional[str]] = {key: None for key in HEIGHTS}
+    for key in sorted(HEIGHTS, reverse=True):
+        for height, format_id in vidinfos:
+            if height >= key:
+                if format_id in sizemap.values():
+                    continue
+                sizemap[key] = format_id
+                break
+    return sizemap
+
+
+def save_thumbnail(thumbnail_url: str, video_dir: str) -> None:
+    """Downloads the thumbnail and stores it as thumbnail.jpg."""
+    thumbnail_ext = os.path.splitext(thumbnail_url)[1]
+    tmpfile = os.path.join(video_dir, f".thumbnail{thumbnail_ext}")
+    download_file(thumbnail_url, tmpfile)
+    out_thumbnail = os.path.join(video_dir, "thumbnail.jpg")
+    if thumbnail_ext != ".jpg":
+        # convert to jpg
+        with Image.open(tmpfile) as img:
+            img.convert("RGB").save(out_thumbnail, "JPEG")
+        os.remove(tmpfile)
+    else:
+        os.replace(tmpfile, out_thumbnail)
+
+
+class _Progress:
+    """Collects the per-file download progress and reports it at most once a second."""
+
+    def __init__(self, report: Optional[ProgressCallback]) -> None:
+        self.report = report
+        self.state: dict[str, float] = {}
+        self.last_report = 0.0
+
+    def updater(self, name: str) -> Callable[[float], None]:
+        """Returns the percent callback for one download."""
+        self.state[name] = 0.0
+
+        def update(percent: float) -> None:
+            self.state[name] = percent
+            self.flush(force=percent >= 100.0)
+
+        return update
+
+    def flush(self, force: bool = False) -> None:
+        """Reports the progress if enough time has passed."""
+        now = time.monotonic()
+        if self.report is None or (not force and now - self.last_report < PROGRESS_INTERVAL):
+            return
+        self.last_report = now
+        self.report(dict(self.state))
+
+
+async def ingest_url(  # pylint: disable=too-many-arguments,too-many-branches,too-many-statements
+    url: str,
+    formats: list[dict],
+    thumbnail_url: str,
+    video_dir: str,
+    report: Optional[ProgressCallback] = None,
+    info: Optional[dict] = None,
+) -> list[str]:
+    """
+    Downloads the renditions, thumbnail and audio of url into video_dir. info is
+    the yt-dlp info dict that /upload_url extracted, the url is extracted again
+    without it.
+    """
+    semaphore = asyncio.Semaphore(URL_INGEST_CONCURRENCY)
+    progress = _Progress(report)
+    # All the downloads below reuse the cached info.
+    if info is not None:
+        extractor.remember_info(url, info)
+    else:
+        await extract_info(url)
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    thumbnail_task = asyncio.create_task(
+        asyncio.to_thread(save_thumbnail, thumbnail_url, video_dir)
+    )
+    vidinfos: list[tuple[int, str]] = []
+    video_only: set[str] = set()
+    audiotracks: list[tuple[str, str]] = []
+    unknown_height: list[str] = []
+    for fmt in formats:
+        ext = fmt.get("ext") or ""
+        format_id = fmt.get("format_id")
+        if not format_id:
+            continue
+        if "mp4" in ext:
+            height = fmt.get("height")  # This key exists and maps to None on bitchute
+            if height:
+                vidinfos.append((height, format_id))
+            else:
+                unknown_height.append(format_id)
+            if fmt.get("acodec") == "none":
+                video_only.add(format_id)
+        elif "m4a" in ext:
+            audiotracks.append((str(fmt.get("abr", 0)), format_id))
+    downloaded_videos: dict[int, str] = {}
+    if unknown_height:
+        log.warning("No height found for video, downloading temporary video and querying height")
+        # Fallback behavior downloads the best video and audio and merges them, if necessary.
+        tmp_video_file = os.path.join(video_dir, f"{random.randint(0, 10000000000)}.mp4")
+        await ytdlp_download(
+            url, "bv*[ext=mp4]+ba/b", tmp_video_file, progress.updater("fallback")
+        )
+        fallback_height = await asyncio.to_thread(get_video_height, tmp_video_file)
+        assert fallback_height is not None, f"No video stream in {tmp_video_file}"
+        vidinfos.extend((fallback_height, format_id) for format_id in unknown_height)
+        downloaded_videos[fallback_height] = tmp_video_file
+    sizemap = match_formats(vidinfos)
+    selected = {height: fid for height, fid in sizemap.items() if fid is not None}
+    if not selected:
+        raise UrlIngestError("Can't download video - No suitable formats found")
+
+    # Start the audio download right away if we already know that a rendition is silent.
+    tmp_audio = os.path.join(video_dir, ".audio.m4a")
+    audio_task: Optional[asyncio.Task] = None
+
+    def start_audio() -> Optional[asyncio.Task]:
+        if not audiotracks:
+            log.warning("No audio tracks found.")
+            return None
+        return asyncio.create_task(
+            limited(ytdlp_download(url, audiotracks[0][1], tmp_audio, progress.updater("audio")))
+        )
+
+    if any(fid in video_only for fid in selected.values()):
+        audio_task = start_audio()
+
+    async def fetch(resolution: int, format_id: str) -> str:
+        filename = os.path.join(video_dir, f"{resolution}.mp4")
+        if resolution in downloaded_videos:
+            await asyncio.to_thread(shutil.copy, downloaded_videos[resolution], filename)
+        else:
+            await limited(
+                ytdlp_download(url, format_id, filename, progress.updater(f"{resolution}.mp4"))
+            )
+        return filename
+
+    try:
+        vidfiles = await asyncio.gather(
+            *[fetch(resolution, fid) for resolution, fid in selected.items()]
+        )
+        silent = [
+            vidfile
+            for vidfile in vidfiles
+            if not await asyncio.to_thread(has_audio, vidfile)
+        ]
+        if silent:
+            log.warning("Some videos don't have audio.")
+            if audio_task is None:
+                audio_task = start_audio()
+            if audio_task is not None:
+                await audio_task
+                await asyncio.gather(
+                    *[limited(async_add_audio(tmp_audio, vidfile)) for vidfile in silent]
+                )
+        await thumbnail_task
+    finally:
+        for task in [audio_task, thumbnail_task]:
+            if task is not None and not task.done():
+                task.cancel()
+        for tmpfile in [tmp_audio, *downloaded_videos.values()]:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+    progress.flush(force=True)
+    log.info(f"Done downloading: {url}")
+    return list(vidfiles)
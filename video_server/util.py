@@ -5,17 +5,28 @@ import asyncio
 import os
 import shutil
 import subprocess
+import time
 import urllib.parse
 from tempfile import TemporaryDirectory
-from typing import Tuple, Callable
+from typing import Callable, Optional, Tuple
 
 import requests  # type: ignore
 from PIL import Image  # type: ignore
 
 from fastapi import UploadFile
-from video_server.settings import SERVER_PORT, ENCODER_PRESET, ENCODING_CRF
+from video_server.settings import (
+    SERVER_PORT,
+    ENCODER_PRESET,
+    ENCODING_CRF,
+    HLS_ENABLED,
+    HLS_SEGMENT_SECONDS,
+    NUMBER_OF_ENCODING_THREADS,
+)
 from video_server.log import log
+from video_server.metrics import observe_stage, time_stage
 from video_server.asyncwrap import asyncwrap
+from video_server.probe import probe
+from video_server.torrent import StreamHasher, make_torrent
 
 CHUNK_SIZE = 1024 * 64
 
@@ -33,11 +44,15 @@ def get_video_url(url: str) -> str:
     return url
 
 
-async def async_download(src: UploadFile, dst: str) -> None:
-    """Downloads a file to the destination."""
+async def async_download(
+    src: UploadFile, dst: str, hasher: Optional[StreamHasher] = None
+) -> None:
+    """Downloads a file to the destination, feeding the hasher as the bytes arrive."""
     with open(dst, mode="wb") as filed:
         while (chunk := await src.read(CHUNK_SIZE)) != b"":
             filed.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
     await src.close()
 
 
@@ -93,14 +108,27 @@ def async_get_image_size(fname: str) -> Tuple[int, int]:
     return get_image_size(fname)
 
 
+def keyframe_args() -> list[str]:
+    """
+    With HLS every encode gets a keyframe every HLS_SEGMENT_SECONDS, so that the
+    segments of all the renditions start at the same times and players can switch.
+    """
+    if not HLS_ENABLED:
+        return []
+    return ["-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})"]
+
+
 def encode(videopath: str, crf: int, height: int, outpath: str) -> None:
     """Encodes a video"""
     downmix_stmt = "-ac 1" if height <= 480 else ""
+    # Unquoted, the shell would take the parentheses of the expression as syntax.
+    keyframe_stmt = " ".join(f'"{arg}"' for arg in keyframe_args())
     # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
-    cmd = f'static_ffmpeg -hide_banner -i "{videopath}" -vf scale="trunc(oh*a/2)*2:{height}" {downmix_stmt} -movflags +faststart -preset {ENCODER_PRESET} -c:v libx264 -crf {crf} "{outpath}" -y'  # pylint: disable=line-too-long
+    cmd = f'static_ffmpeg -hide_banner -i "{videopath}" -vf scale="trunc(oh*a/2)*2:{height}" {downmix_stmt} {keyframe_stmt} -movflags +faststart -preset {ENCODER_PRESET} -c:v libx264 -crf {crf} "{outpath}" -y'  # pylint: disable=line-too-long
     log.info("Running:\n  %s", cmd)
-    proc = subprocess.Popen(cmd, shell=True)  # pylint: disable=consider-using-with
-    proc.wait()
+    with time_stage("encode", height):
+        proc = subprocess.Popen(cmd, shell=True)  # pylint: disable=consider-using-with
+        proc.wait()
     log.info("Generated file: %s", outpath)
 
 
@@ -110,18 +138,65 @@ def async_encode(videopath: str, crf: int, height: int, outpath: str) -> None:
     encode(videopath, crf, height, outpath)
 
 
+def encode_ladder(videopath: str, crf: int, heights: list[int], outpaths: list[str]) -> None:
+    """
+    Encodes all the heights in a single ffmpeg run. The source is decoded once and
+    then split into one scaled stream per output.
+    """
+    assert len(heights) == len(outpaths)
+    if not heights:
+        return
+    splits = "".join(f"[s{i}]" for i in range(len(heights)))
+    filters = [f"[0:v]split={len(heights)}{splits}"]
+    for i, height in enumerate(heights):
+        # trunc(oh*...) fixes issue with libx264 encoder not liking an add number of width pixels.
+        filters.append(f"[s{i}]scale=trunc(oh*a/2)*2:{height}[v{i}]")
+    cmd = ["static_ffmpeg", "-hide_banner", "-i", videopath, "-filter_complex", ";".join(filters)]
+    for i, (height, outpath) in enumerate(zip(heights, outpaths)):
+        cmd += ["-map", f"[v{i}]", "-map", "0:a?"]
+        if height <= 480:
+            cmd += ["-ac", "1"]
+        cmd += keyframe_args()
+        cmd += [
+            "-movflags",
+            "+faststart",
+            "-preset",
+            ENCODER_PRESET,
+            "-c:v",
+            "libx264",
+            "-crf",
+            str(crf),
+            outpath,
+        ]
+    cmd.append("-y")
+    log.info("Running:\n  %s", subprocess.list2cmdline(cmd))
+    with time_stage("encode_ladder", "/".join(str(height) for height in heights)):
+        proc = subprocess.Popen(cmd)  # pylint: disable=consider-using-with
+        proc.wait()
+    if proc.returncode != 0:
+        raise ValueError(f"Failed to encode {videopath} to heights {heights}")
+    for outpath in outpaths:
+        log.info("Generated file: %s", outpath)
+
+
+@asyncwrap
+def async_encode_ladder(
+    videopath: str, crf: int, heights: list[int], outpaths: list[str]
+) -> None:
+    """Async version of encode_ladder."""
+    encode_ladder(videopath, crf, heights, outpaths)
+
+
 def get_video_height(vidfile: str) -> int:
     """Gets the video height from the video file."""
-    # use ffprobe to get the height of the video
     assert os.path.exists(vidfile)
-    cmd = f'static_ffprobe "{vidfile}" -show_streams 2>&1'
-    stdout = subprocess.check_output(cmd, shell=True)
-    lines = stdout.decode().splitlines()
-    for line in lines:
-        if line.startswith("height"):
-            height = int(line.split("=")[1])
-            return height
-    raise ValueError(f"Missing height in {vidfile}")
+    start = time.perf_counter()
+    height = probe(vidfile).height
+    # Labeled by the height, the file names of the sources are unbounded.
+    observe_stage("probe", height or "", time.perf_counter() - start)
+    if height is None:
+        raise ValueError(f"Missing height in {vidfile}")
+    return height
 
 
 @asyncwrap
@@ -131,24 +206,23 @@ def async_get_video_height(vidfile: str) -> int:
 
 
 def mktorrent(
-    vidfile: str, torrent_path: str, tracker_announce_list: list[str], chunk_factor: int
+    vidfile: str,
+    torrent_path: str,
+    tracker_announce_list: list[str],
+    chunk_factor: int,
+    webseed: Optional[str] = None,
 ) -> None:
     """Creates a torrent file."""
-    # if windows
-    if os.name == "nt":
-        log.error("mktorrent not supported on windows")
-        return
     log.info("Creating torrent for %s", os.path.abspath(vidfile))
-    if os.path.exists(torrent_path):
-        os.remove(torrent_path)
-    # Use which to detect whether the mktorrent binary is available.
-    if not shutil.which("mktorrent"):
-        raise OSError("mktorrent not found")
-    tracker_announce = "-a " + " -a ".join(tracker_announce_list)
-    cmd = f'mktorrent "{vidfile}" {tracker_announce} -l {chunk_factor} -o "{torrent_path}"'
-    log.info("Running\n    %s", cmd)
-    # subprocess.check_output(cmd, shell=True)
-    os.system(cmd)
+    with time_stage("torrent", os.path.splitext(os.path.basename(vidfile))[0]):
+        make_torrent(
+            vidfile=vidfile,
+            torrent_path=torrent_path,
+            tracker_announce_list=tracker_announce_list,
+            chunk_factor=chunk_factor,
+            webseed=webseed,
+            max_workers=NUMBER_OF_ENCODING_THREADS,
+        )
     log.info("Created torrent: %s", os.path.abspath(torrent_path))
     assert os.path.exists(torrent_path), f"Missing expected {torrent_path}"
 
@@ -156,14 +230,7 @@ def mktorrent(
 def query_duration(vidfile: str) -> float:
     """Queries the duration of a video."""
     assert os.path.exists(vidfile)
-    cmd = f'static_ffprobe "{vidfile}" -show_format 2>&1'
-    stdout = subprocess.check_output(cmd, shell=True)
-    lines = stdout.decode().splitlines()
-    duration: float | None = None
-    for line in lines:
-        if line.startswith("duration"):
-            duration = float(line.split("=")[1])
-            break
+    duration: float | None = probe(vidfile).duration
     assert duration is not None, f"Missing duration in {vidfile}"
     return duration
 
@@ -182,6 +249,7 @@ def mktorrent_task(  # pylint: disable=too-many-arguments
         torrent_path=torrent_path,
         tracker_announce_list=tracker_announce_list,
         chunk_factor=chunk_factor,
+        webseed=webseed,
     )
     size_mp4file = os.path.getsize(vidfile)
     duration: float = query_duration(vidfile)
@@ -197,52 +265,19 @@ def mktorrent_task(  # pylint: disable=too-many-arguments
 
 def has_audio(vidfile: str) -> bool:
     """Checks if a video file has audio."""
-    cmd = (
-        "static_ffprobe -v error -select_streams a:0 -show_entries stream=codec_type"
-        f' -of default=noprint_wrappers=1:nokey=1 "{vidfile}"'  # pylint: disable=line-too-long
-    )
     try:
-        stdout = subprocess.check_output(cmd, shell=True, universal_newlines=True)
+        return probe(vidfile).has_audio
     except subprocess.CalledProcessError as cpe:
         # print out stdout and stderr
-        log.fatal("Error running command: %s", cmd)
+        log.fatal("Error probing: %s", vidfile)
         log.fatal("stdout: %s", cpe.stdout)
         log.fatal("stderr: %s", cpe.stderr)
         return True  # suppresses audio processing by faking that there is audio
-    return stdout.strip() == "audio"
-
-
-def add_audio(
-    audiopath: str, videopath: str
-) -> None:
-    """Adds audio to a video."""
-    log.info("Adding audio to %s", videopath)
-    with TemporaryDirectory() as temp_dir:
-        outpath = os.path.join(temp_dir, "out.mp4")
-        cmd = (
-            f'static_ffmpeg -y -i "{videopath}" -i "{audiopath}" -c:v copy -c:a aac '
-            f" -strict experimental {outpath}"
-        )
-        log.info("Running command:\n  %s", cmd)
-        try:
-            stdout = subprocess.check_output(cmd, shell=True)
-        except subprocess.CalledProcessError as cpe:
-            # print out stdout and stderr
-            log.fatal("Error running command: %s", cmd)
-            log.fatal("stdout: %s", cpe.stdout)
-            log.fatal("stderr: %s", cpe.stderr)
-            return
-        log.info("Output:\n%s", stdout)
-        shutil.move(outpath, videopath)
 
 
 def get_encoder(vidfile: str) -> str:
     """Returns the encoder used for the given video file."""
-    cmd = (
-        "static_ffprobe -v error -select_streams v:0 -show_entries stream=codec_name"
-        f" -of default=nokey=1:noprint_wrappers=1 {vidfile}"
-    )
-    return subprocess.check_output(cmd, shell=True, universal_newlines=True).strip()
+    return probe(vidfile).video_codec or ""
 
 
 def convert_to_h264(vidfile: str, fps: int | None = None) -> None:
@@ -271,15 +306,6 @@ def convert_to_h264(vidfile: str, fps: int | None = None) -> None:
         shutil.move(outpath, vidfile)
 
 
-def ytdlp_download(url: str, id: str, outfile: str) -> None:  # pylint: disable=invalid-name,redefined-builtin
-    """Downloads a video using yt-dlp."""
-    cmd = f'yt-dlp --no-check-certificate {url} -f "{id}" -o "{outfile}"'
-    log.info("Running command:\n  %s", cmd)
-    stdout = subprocess.check_output(cmd, shell=True, universal_newlines=True)
-    log.info(stdout)
-    log.info("Downloaded %s", outfile)
-
-
 class Cleanup:
     """Cancellable cleanup function"""
 
@@ -0,0 +1,94 @@
+"""
+Write-behind view counter.
+
+Play events only bump an in-memory counter of the worker that received them.
+Every VIEW_FLUSH_INTERVAL seconds each worker adds its counts to Video.views in
+one transaction, so the database sees at most one write per worker per interval
+no matter how much is being watched. Counts still buffered are flushed on
+shutdown. The new counts reach the cached catalog at most every
+VIEW_CATALOG_INTERVAL seconds. Counts written while the catalog bump was rate
+limited mark the worker dirty, and every flush retries the bump until it
+happens, even when no new views came in.
+"""
+
+import asyncio
+import threading
+from collections import Counter
+from typing import Optional
+
+from video_server.catalog import invalidate_catalog, invalidate_catalog_for_views
+from video_server.log import log
+from video_server.models import Video, db_proxy
+from video_server.settings import VIEW_CATALOG_INTERVAL, VIEW_FLUSH_INTERVAL
+
+_pending: Counter = Counter()
+_pending_lock = threading.Lock()
+# True while counts were written that the catalog doesn't reflect yet.
+_views_dirty = False  # pylint: disable=invalid-name
+_flusher_task: Optional[asyncio.Task] = None  # pylint: disable=invalid-name
+
+
+def record_view(vid_id: int) -> None:
+    """Counts a view, it reaches the database on the next flush."""
+    with _pending_lock:
+        _pending[vid_id] += 1
+
+
+def flush_views(force_bump: bool = False) -> int:
+    """
+    Writes the buffered counts in one transaction and bumps the catalog if it is
+    out of date, force_bump skips the rate limit. Returns the number of videos updated.
+    """
+    global _views_dirty  # pylint: disable=global-statement
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if pending:
+        try:
+            with db_proxy.atomic():
+                for vid_id, count in pending.items():
+                    Video.update(views=Video.views + count).where(Video.id == vid_id).execute()
+        except Exception:
+            # Put the counts back so the next flush retries them.
+            with _pending_lock:
+                _pending.update(pending)
+            raise
+        _views_dirty = True
+    if _views_dirty:
+        if force_bump:
+            invalidate_catalog()
+            _views_dirty = False
+        elif invalidate_catalog_for_views(VIEW_CATALOG_INTERVAL):
+            _views_dirty = False
+    return len(pending)
+
+
+async def view_flusher() -> None:
+    """Flushes the buffered views forever."""
+    while True:
+        await asyncio.sleep(VIEW_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_views)
+        except Exception as exc:  # pylint: disable=broad-except
+            log.error("Failed to flush views: %s", exc)
+
+
+def start_view_flusher() -> None:
+    """Starts the periodic flush on the current event loop."""
+    global _flusher_task  # pylint: disable=global-statement
+    if _flusher_task is None:
+        _flusher_task = asyncio.create_task(view_flusher())
+
+
+async def stop_view_flusher() -> None:
+    """Stops the periodic flush and writes whatever is still buffered."""
+    global _flusher_task  # pylint: disable=global-statement
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+    # No later flush of this worker would publish the counts.
+    flush_views(force_bump=True)